@@ -1,4 +1,11 @@
 #!/usr/bin/env bash
+#
+# Usage: start_forum_archive_server.sh [-w <numWorkers>] [<server options>]
+#
+# -w: number of server processes; 0 for one per CPU.
+#     Default: 1, or $FORUM_SERVER_WORKERS if set.
+# Other options are passed to forum_archive_server.py
+# unchanged; see forum_archive_server.py --help.
 
 
 # Get directory in which this script is running,
@@ -6,6 +13,13 @@
 
 CURR_SCRIPTS_DIR="$( cd "$( dirname "${0}" )" && pwd )"
 
+WORKERS=${FORUM_SERVER_WORKERS:-1}
+if [[ "$1" == "-w" ]]
+then
+    WORKERS=$2
+    shift 2
+fi
+
 EXEC_DIR=${CURR_SCRIPTS_DIR}/../src/forum_archive_server
 EXECUTABLE=${EXEC_DIR}/forum_archive_server.py
 
@@ -29,7 +43,7 @@ cd ${EXEC_DIR}
 #********
 #echo "Log file: '${LOG_FILE}'"
 #********
-nohup ./forum_archive_server.py  >> ${LOG_FILE} 2>&1 &
+nohup ./forum_archive_server.py --workers ${WORKERS} "$@" >> ${LOG_FILE} 2>&1 &
 
 
 
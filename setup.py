@@ -10,7 +10,8 @@ setup(
 
     # Dependencies on other packages:
     setup_requires   = ['nose>=1.1.2'],
-    install_requires = ['pymysql_utils>=0.51'
+    install_requires = ['pymysql_utils>=0.51',
+                        'futures>=3.0'
                         ],
     tests_require    = [],
 
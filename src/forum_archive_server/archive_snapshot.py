@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Read-only snapshot of a forum archive: ForumPosts and
+ForumKeywords in one file, which the server maps into memory
+and answers lookups from without a db. Archives do not change
+once a term ends; a snapshot is written once by running this
+module as a script:
+
+    archive_snapshot.py --db ForumArchive forum_archive.snap
+
+Worker processes that map the same file share its pages in
+the OS page cache. Opening a snapshot only reads its header:
+the keywords, an n-gram index over them, and the postings
+are all read in place from the mapping when a lookup needs
+them, and post bodies when a result shows them.
+
+Keywords are stored folded to lower case, as UTF-8; keywords
+that differ only in case share one entry. Like the MySQL
+lookup with LOCATE, a request term matches every keyword
+that contains it, ignoring case: terms of at most GRAM_LENGTH
+bytes are found in the table of grams, longer ones intersect
+the keyword lists of their grams, and the candidates are
+verified (see ngram_index.py, which does the same in memory).
+
+Posts are numbered in rank order, i.e. the order of the
+keyword index: answer_type, unique_views, total_no_upvotes,
+all descending, then question_id. A keyword's postings are
+the ascending numbers of its posts, so results for several
+keywords are planned from postings alone, with no sort keys;
+see query_planner.py.
+
+File layout; all integers little endian:
+
+    header     HEADER: magic, version, numPosts, numKeywords,
+               numGrams, and the file offsets of the posts,
+               keywords, and grams sections
+    data       per post: question_id, question, answer;
+               then the folded text of all keywords; all UTF-8
+    posts      POST per post number: data offset, and the
+               lengths of question_id, question, and answer
+    keywords   KEYWORD per keyword number, sorted by text: data
+               offset and length of its text, offset of its
+               postings, and number of postings
+    postings   uint32 post numbers, ascending per keyword
+    grams      GRAM per gram of 1 to GRAM_LENGTH bytes of the
+               keywords, sorted: the gram, padded with NULs,
+               offset of its keyword numbers, and their number
+    gram keywords
+               uint32 keyword numbers, ascending per gram
+
+@author:     Andreas Paepcke
+
+'''
+
+import argparse
+import array
+import datetime
+import getpass
+import heapq
+import mmap
+import os
+import struct
+import sys
+
+from MySQLdb.cursors import SSCursor
+
+from db_pool import MySQLConnectionPool, readMySQLPwd
+from keyword_index import descending
+from query_planner import planTerms, rankCandidates
+from row_batches import RowBatches
+from search_backend import SearchBackend
+
+
+MAGIC   = 'FASNAP01'
+VERSION = 2
+
+# Longest gram of keyword text, in bytes, in the gram table:
+GRAM_LENGTH = 3
+
+HEADER  = struct.Struct('<8sIIIIQQQ')
+POST    = struct.Struct('<QIII')
+KEYWORD = struct.Struct('<QIQI')
+GRAM    = struct.Struct('<%dsQI' % GRAM_LENGTH)
+
+POSTS_QUERY    = '''SELECT id, question, answer, answer_type, unique_views, total_no_upvotes
+                      FROM ForumPosts'''
+KEYWORDS_QUERY = 'SELECT keyword, question_id FROM ForumKeywords'
+
+# Posts read from the server-side cursor at a time:
+EXPORT_BATCH_SIZE = 1000
+
+UINT32_SIZE = 4
+
+class ArchiveSnapshot(object):
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, path):
+        '''
+        Map the snapshot at path, and read its header.
+
+        @param path: file written by exportSnapshot()
+        @type path: str
+        @raise IOError: if path is missing, or not a snapshot
+        '''
+        self.path = path
+        with open(path, 'rb') as snapshotFile:
+            self.map = mmap.mmap(snapshotFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise IOError("'%s' is not an archive snapshot" % path)
+        (magic, version, self.numPosts, self.numKeywords, self.numGrams,
+         self.postsOffset, self.keywordsOffset, self.gramsOffset) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise IOError("'%s' is not an archive snapshot of version %s" % (path, VERSION))
+
+    #-----------------------
+    # lookup
+    #---------------
+
+    def lookup(self, keywords, limit, offset=0, match='any'):
+        '''
+        Numbers of the posts matching the keywords, in the order
+        of query_planner.rankCandidates(), from offset to 
+        offset + limit.
+
+        @return: post numbers
+        @rtype: [int]
+        '''
+        termPostings = []
+        for term in planTerms(keywords):
+            termPostings.append(heapq.merge(*[self.postingsList(keywordNum)
+                                              for keywordNum in self.matchingKeywords(term)]))
+        return rankCandidates(termPostings, match)[offset:offset + limit]
+
+    #-----------------------
+    # matchingKeywords
+    #---------------
+
+    def matchingKeywords(self, term):
+        '''
+        Numbers of the keywords that contain term, ignoring case.
+
+        @param term: request term; unicode, or UTF-8
+        @type term: {str | unicode}
+        @return: keyword numbers
+        @rtype: [int]
+        '''
+        folded = foldKeyword(utf8(term))
+        if len(folded) == 0:
+            # LOCATE('', keyword) is 1 for every keyword:
+            return range(self.numKeywords)
+        if len(folded) <= GRAM_LENGTH:
+            return self.gramKeywords(folded)
+        candidates = None
+        for start in range(len(folded) - GRAM_LENGTH + 1):
+            keywordNums = self.gramKeywords(folded[start:start + GRAM_LENGTH])
+            if len(keywordNums) == 0:
+                return []
+            candidates = set(keywordNums) if candidates is None else candidates.intersection(keywordNums)
+        # All grams present does not guarantee that they are
+        # adjacent in the right order, so verify:
+        return sorted(keywordNum for keywordNum in candidates if folded in self.keyword(keywordNum))
+
+    #-----------------------
+    # gramKeywords
+    #---------------
+
+    def gramKeywords(self, gram):
+        '''
+        Binary search of the gram table.
+
+        @return: the numbers of the keywords containing gram, ascending
+        @rtype: (int)
+        '''
+        paddedGram = gram.ljust(GRAM_LENGTH, '\0')
+        (low, high) = (0, self.numGrams)
+        while low < high:
+            middle = (low + high) // 2
+            if GRAM.unpack_from(self.map, self.gramsOffset + middle * GRAM.size)[0] < paddedGram:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.numGrams:
+            return ()
+        (foundGram, keywordsOffset, numKeywords) = GRAM.unpack_from(self.map, self.gramsOffset + low * GRAM.size)
+        if foundGram != paddedGram:
+            return ()
+        return struct.unpack_from('<%dI' % numKeywords, self.map, keywordsOffset)
+
+    #-----------------------
+    # keyword
+    #---------------
+
+    def keyword(self, keywordNum):
+        '''
+        @return: folded text of a keyword, UTF-8
+        @rtype: str
+        '''
+        (textOffset, textLength, _postingsOffset, _numPostings) = \
+            KEYWORD.unpack_from(self.map, self.keywordsOffset + keywordNum * KEYWORD.size)
+        return self.map[textOffset:textOffset + textLength]
+
+    #-----------------------
+    # postingsList
+    #---------------
+
+    def postingsList(self, keywordNum):
+        '''
+        @return: the post numbers of a keyword, ascending
+        @rtype: (int)
+        '''
+        (_textOffset, _textLength, postingsOffset, numPostings) = \
+            KEYWORD.unpack_from(self.map, self.keywordsOffset + keywordNum * KEYWORD.size)
+        return struct.unpack_from('<%dI' % numPostings, self.map, postingsOffset)
+
+    #-----------------------
+    # post
+    #---------------
+
+    def post(self, postNum):
+        '''
+        @return: (<questionText>,<answerText>,<questionId>) of a post,
+            UTF-8 as stored; they are not decoded
+        @rtype: (str, str, str)
+        '''
+        (dataOffset, idLength, questionLength, answerLength) = \
+            POST.unpack_from(self.map, self.postsOffset + postNum * POST.size)
+        questionOffset = dataOffset + idLength
+        answerOffset = questionOffset + questionLength
+        return (self.map[questionOffset:answerOffset],
+                self.map[answerOffset:answerOffset + answerLength],
+                self.map[dataOffset:questionOffset])
+
+    #-----------------------
+    # close
+    #---------------
+
+    def close(self):
+        self.map.close()
+
+class SnapshotSearchBackend(SearchBackend):
+    '''
+    Answers lookups from an ArchiveSnapshot, with the results
+    of the MySQL keyword lookup. Rows are
+    (<questionText>,<answerText>,<questionId>), so page cursors
+    count ranks.
+    '''
+
+    def __init__(self, path, query_executor):
+        '''
+        @param path: file written by exportSnapshot()
+        @type path: str
+        @param query_executor: thread pool in which lookups run, so
+            that reading pages not yet in memory does not block the IOLoop
+        @type query_executor: concurrent.futures.ThreadPoolExecutor
+        '''
+        self.snapshot = ArchiveSnapshot(path)
+        self.query_executor = query_executor
+
+    def lookup(self, keywords, limit, after=None, match='any'):
+        offset = 0 if after is None else after.rank
+        return SnapshotRows(self.snapshot, self.query_executor, keywords, limit, offset, match)
+
+    def bestPosts(self, numPosts):
+        # Posts are numbered in rank order:
+        return [self.snapshot.post(postNum) for postNum in range(min(numPosts, self.snapshot.numPosts))]
+
+    def close(self):
+        self.snapshot.close()
+
+class SnapshotRows(RowBatches):
+
+    def __init__(self, snapshot, query_executor, keywords, limit, offset, match):
+        super(SnapshotRows, self).__init__(None, query_executor)
+        self.snapshot = snapshot
+        self.keywords = keywords
+        self.limit = limit
+        self.offset = offset
+        self.match = match
+        self.delivered = False
+
+    def fetchInThread(self):
+        if self.delivered:
+            return []
+        self.delivered = True
+        snapshot = self.snapshot
+        return [snapshot.post(postNum) for postNum in snapshot.lookup(self.keywords, self.limit, self.offset, self.match)]
+
+# ====================================  Utilities ================
+
+def exportSnapshot(mysqlDb, path):
+    '''
+    Write a snapshot of ForumPosts and ForumKeywords to path,
+    replacing any snapshot there. Post bodies are streamed to
+    the file; only ids, ranking columns, and keywords are
+    held in memory.
+
+    @param mysqlDb: open connection
+    @type mysqlDb: MySQLDB
+    @param path: snapshot file to write
+    @type path: str
+    @return: number of posts and of keywords exported
+    @rtype: (int, int)
+    '''
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as out:
+        out.write('\0' * HEADER.size)
+
+        # Data section, post bodies first. An unbuffered cursor
+        # keeps the bodies out of memory; it must be closed before
+        # the connection runs the keywords query:
+        posts = []
+        cursor = mysqlDb.connection.cursor(SSCursor)
+        try:
+            cursor.execute(POSTS_QUERY)
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if len(rows) == 0:
+                    break
+                for (question_id, question, answer, answer_type, unique_views, total_no_upvotes) in rows:
+                    (question_id, question, answer) = [utf8(text) for text in (question_id, question, answer)]
+                    sortKey = (descending(answer_type), descending(unique_views), descending(total_no_upvotes),
+                               question_id)
+                    posts.append((sortKey, out.tell(), len(question_id), len(question), len(answer)))
+                    out.write(question_id)
+                    out.write(question)
+                    out.write(answer)
+        finally:
+            cursor.close()
+        posts.sort()
+        postNums = {}
+        for (postNum, (sortKey, _dataOffset, _idLength, _questionLength, _answerLength)) in enumerate(posts):
+            postNums[sortKey[3]] = postNum
+
+        # Folded keyword --> numbers of its posts:
+        keywordPosts = {}
+        for (keyword, question_id) in mysqlDb.query(KEYWORDS_QUERY):
+            postNum = postNums.get(utf8(question_id))
+            # Keywords of posts that no longer exist do not
+            # join, and so yield no results:
+            if postNum is not None:
+                keywordPosts.setdefault(foldKeyword(utf8(keyword)), set()).add(postNum)
+        keywords = sorted(keywordPosts.keys())
+        keywordTexts = []
+        # gram --> ascending numbers of the keywords containing it:
+        gramKeywords = {}
+        for (keywordNum, keyword) in enumerate(keywords):
+            keywordTexts.append((out.tell(), len(keyword)))
+            out.write(keyword)
+            grams = set()
+            for length in range(1, min(GRAM_LENGTH, len(keyword)) + 1):
+                for start in range(len(keyword) - length + 1):
+                    grams.add(keyword[start:start + length])
+            for gram in grams:
+                gramKeywords.setdefault(gram.ljust(GRAM_LENGTH, '\0'), []).append(keywordNum)
+
+        postsOffset = out.tell()
+        for (_sortKey, dataOffset, idLength, questionLength, answerLength) in posts:
+            out.write(POST.pack(dataOffset, idLength, questionLength, answerLength))
+
+        keywordsOffset = out.tell()
+        nextPostings = keywordsOffset + len(keywords) * KEYWORD.size
+        for (keyword, (textOffset, textLength)) in zip(keywords, keywordTexts):
+            numPostings = len(keywordPosts[keyword])
+            out.write(KEYWORD.pack(textOffset, textLength, nextPostings, numPostings))
+            nextPostings += numPostings * UINT32_SIZE
+        for keyword in keywords:
+            writeUInt32s(out, sorted(keywordPosts[keyword]))
+
+        grams = sorted(gramKeywords.keys())
+        gramsOffset = out.tell()
+        nextKeywords = gramsOffset + len(grams) * GRAM.size
+        for gram in grams:
+            out.write(GRAM.pack(gram, nextKeywords, len(gramKeywords[gram])))
+            nextKeywords += len(gramKeywords[gram]) * UINT32_SIZE
+        for gram in grams:
+            writeUInt32s(out, gramKeywords[gram])
+
+        out.seek(0)
+        out.write(HEADER.pack(MAGIC, VERSION, len(posts), len(keywords), len(grams),
+                              postsOffset, keywordsOffset, gramsOffset))
+    os.rename(tmpPath, path)
+    return (len(posts), len(keywords))
+
+def writeUInt32s(out, numbers):
+    '''
+    Write numbers as little endian uint32s.
+    '''
+    numbers = array.array('I', numbers)
+    if sys.byteorder != 'little':
+        numbers.byteswap()
+    out.write(numbers.tostring())
+
+def foldKeyword(text):
+    '''
+    A keyword or term, UTF-8, in lower case, as stored in
+    snapshots; case-insensitive like MySQL's _ci collations.
+    '''
+    return text.decode('utf-8', 'replace').lower().encode('utf-8')
+
+def utf8(text):
+    '''
+    Byte string of a db value: unicode is encoded as UTF-8,
+    NULL becomes '', other values are converted with str().
+    '''
+    if text is None:
+        return ''
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return str(text)
+
+# ====================================  Main ================
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     description='Export ForumPosts and ForumKeywords into the read-only '
+                                                 'snapshot used by --search-backend snapshot.')
+    parser.add_argument('--db',
+                        default='ForumArchive',
+                        help='MySQL database holding ForumPosts and ForumKeywords (default: %(default)s)')
+    parser.add_argument('path',
+                        help='Snapshot file to write')
+    args = parser.parse_args(argv)
+
+    db_pool = MySQLConnectionPool(user=getpass.getuser(),
+                                  passwd=readMySQLPwd(),
+                                  db=args.db,
+                                  minSize=0,
+                                  maxSize=1)
+    try:
+        (numPosts, numKeywords) = db_pool.withConnection(exportSnapshot, args.path)
+    finally:
+        db_pool.close()
+    sys.stdout.write('%s info: Exported %s posts and %s keywords to %s.\n' %\
+                     (datetime.datetime.now(), numPosts, numKeywords, args.path))
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
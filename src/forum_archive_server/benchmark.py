@@ -0,0 +1,586 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Load test of the server against a synthetic forum, for
+comparing performance between commits:
+
+    benchmark.py --posts 20000 --skew 1.1 --concurrency 1 8 32 --out bench.json
+
+A SQLite file stands in for the MySQL archive: it is seeded
+with --posts posts, each tagged with --keywords-per-post of
+--keywords keywords. Keyword popularity follows a Zipf law
+with exponent --skew, as in the wordclouds, where a few
+keywords get most clicks; 0 makes all keywords equally likely.
+The same seed gives the same forum and the same requests.
+
+The application of forum_archive_server.py runs in a child
+process, with its connection pool handing out SQLiteMySQLDB
+connections, which understand the few MySQL idioms the
+server uses. The parent sends --requests requests at each
+--concurrency level: keyword lookups, with keywords drawn
+from the same Zipf law, and --feedback-ratio of feedback
+clicks. For each level it writes the throughput, and the
+50th, 95th, and 99th percentile latencies, overall and by
+request type, to the JSON output, together with the mean
+time per stage from the server's /metrics.
+
+pymysql_utils and MySQLdb must be installed, as for the
+server; no MySQL server is needed.
+
+@author:     Andreas Paepcke
+
+'''
+
+import argparse
+import bisect
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import urllib
+
+from concurrent.futures import ThreadPoolExecutor
+from db_pool import MySQLConnectionPool
+from feedback_store import FeedbackWriter
+from forum_archive_server import ForumArchiveServer, makeApplication
+from keyword_index import KeywordIndex
+from metrics import ServerMetrics
+from result_cache import LRUCache
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+import tornado.ioloop
+
+
+SCHEMA = ['''CREATE TABLE ForumPosts (
+                 id               TEXT PRIMARY KEY,
+                 question         TEXT NOT NULL,
+                 answer           TEXT NOT NULL,
+                 answer_type      INT NOT NULL,
+                 unique_views     INT NOT NULL,
+                 total_no_upvotes INT NOT NULL
+             )''',
+          '''CREATE TABLE ForumKeywords (
+                 question_id TEXT NOT NULL,
+                 keyword     TEXT NOT NULL
+             )''',
+          'CREATE INDEX ForumKeywordsKeyword ON ForumKeywords (keyword)',
+          'CREATE INDEX ForumKeywordsQuestion ON ForumKeywords (question_id)',
+          '''CREATE TABLE ForumFeedback (
+                 id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                 received   TIMESTAMP NOT NULL,
+                 feedback   TEXT NOT NULL,
+                 session_id TEXT NOT NULL,
+                 `rank`     INT NOT NULL,
+                 uid        TEXT NOT NULL
+             )'''
+          ]
+
+# Words of the synthetic questions and answers:
+VOCABULARY = ('the a of to in is how why does my when gradient loss network layer weight '
+              'training data model error value function output input matrix vector step '
+              'rate batch epoch learning descent neural convolution pooling dropout '
+              'overfitting regularization bias variance softmax activation').split()
+
+# MySQL functions the server uses, and their SQLite equivalents:
+LOCATE_CALL = re.compile(r'LOCATE\(([^,()]+),\s*([\w.]+)\)', re.IGNORECASE)
+CREATE_IF_NOT_EXISTS = re.compile(r'^\s*CREATE\s+TABLE\s+IF\s+NOT\s+EXISTS\s+`?(\w+)`?', re.IGNORECASE)
+
+FEEDBACK_VALUES = ['Not', 'Partial', 'Completely']
+
+STAGE_SAMPLE = re.compile(r'^forum_archive_stage_seconds_(sum|count)\{.*stage="(\w+)".*\} (\S+)$')
+
+class SQLiteMySQLDB(object):
+    '''
+    Stands in for a pymysql_utils MySQLDB connection to the
+    archive, with a SQLite file in its place.
+    '''
+
+    def __init__(self, path):
+        self.connection = SQLiteConnection(path)
+
+    def query(self, query):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query)
+            return iter(cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def execute(self, query, doCommit=True):
+        self.executeParameterized(query, None, doCommit)
+
+    def executeParameterized(self, query, params, doCommit=True):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query, params)
+            if doCommit:
+                self.connection.commit()
+        finally:
+            cursor.close()
+
+    def close(self):
+        self.connection.close()
+
+class SQLiteConnection(object):
+    '''
+    The MySQLdb connection of a SQLiteMySQLDB.
+    '''
+
+    def __init__(self, path):
+        # Pool connections move between query_executor threads,
+        # but are used by one thread at a time:
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+
+    def cursor(self, cursorClass=None):
+        # Server-side cursors are not needed; SQLite reads
+        # rows as they are fetched anyway:
+        return SQLiteCursor(self.db)
+
+    def ping(self, reconnect=False):
+        self.db.execute('SELECT 1')
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+class SQLiteCursor(object):
+
+    def __init__(self, db):
+        self.db = db
+        self.cursor = db.cursor()
+
+    def execute(self, query, params=None):
+        tableMatch = CREATE_IF_NOT_EXISTS.match(query)
+        if tableMatch is not None:
+            # The schema above has the server's tables; their
+            # MySQL definitions are not SQLite syntax:
+            if self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                               (tableMatch.group(1),)).fetchone() is not None:
+                return 0
+        self.cursor.execute(sqliteQuery(query), () if params is None else tuple(params))
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+class SQLiteConnectionPool(MySQLConnectionPool):
+    '''
+    Connection pool whose connections are SQLiteMySQLDBs
+    on the file at path.
+    '''
+
+    def __init__(self, path, **kwargs):
+        super(SQLiteConnectionPool, self).__init__(user='benchmark', **kwargs)
+        self.path = path
+
+    def openConnection(self):
+        return SQLiteMySQLDB(self.path)
+
+class ZipfSampler(object):
+    '''
+    Draws items with probability proportional to
+    1 / rank ** skew, where the first item has rank 1.
+    '''
+
+    def __init__(self, items, skew, rng):
+        self.items = items
+        self.rng = rng
+        self.cumulative = []
+        total = 0.0
+        for rank in range(1, len(items) + 1):
+            total += 1.0 / rank ** skew
+            self.cumulative.append(total)
+
+    def sample(self):
+        return self.items[bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])]
+
+# ====================================  Utilities ================
+
+def sqliteQuery(query):
+    '''
+    query, with MySQL's %s parameters and LOCATE()
+    in SQLite form.
+    '''
+    query = LOCATE_CALL.sub(lambda locateMatch: 'INSTR(%s, %s)' % (locateMatch.group(2), locateMatch.group(1)), query)
+    return query.replace('%s', '?')
+
+def seedForum(path, numPosts, numKeywords, keywordsPerPost, skew, seed):
+    '''
+    Write a synthetic forum to a new SQLite file at path.
+
+    @return: the keywords, most popular first
+    @rtype: [str]
+    '''
+    rng = random.Random(seed)
+    # Same width, so no keyword contains another:
+    keywords = ['kw%06d' % keywordNum for keywordNum in range(numKeywords)]
+    sampler = ZipfSampler(keywords, skew, rng)
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    try:
+        db.execute('PRAGMA journal_mode=WAL')
+        for statement in SCHEMA:
+            db.execute(statement)
+        for postNum in range(numPosts):
+            postKeywords = set()
+            while len(postKeywords) < min(keywordsPerPost, numKeywords):
+                postKeywords.add(sampler.sample())
+            question = ' '.join([rng.choice(VOCABULARY) for _word in range(rng.randint(10, 60))] +
+                                sorted(postKeywords)) + '?'
+            answer = ' '.join(rng.choice(VOCABULARY) for _word in range(rng.randint(30, 300))) + '.'
+            db.execute('INSERT INTO ForumPosts VALUES (?, ?, ?, ?, ?, ?)',
+                       (str(postNum), question, answer, rng.randint(0, 2), rng.randint(0, 5000), rng.randint(0, 100)))
+            db.executemany('INSERT INTO ForumKeywords VALUES (?, ?)',
+                           [(str(postNum), keyword) for keyword in postKeywords])
+        db.commit()
+    finally:
+        db.close()
+    return keywords
+
+def runServer(args, dbPath, ready):
+    '''
+    Serve the forum at dbPath on args.port until terminated.
+    Called in the child process; sets ready once listening.
+    '''
+    metrics = ServerMetrics()
+    db_pool = SQLiteConnectionPool(dbPath, minSize=1, maxSize=args.pool_max, metrics=metrics)
+    query_executor = ThreadPoolExecutor(max_workers=args.query_threads)
+    keyword_index = None
+    if args.keyword_index:
+        keyword_index = KeywordIndex()
+        db_pool.withConnection(keyword_index.load)
+    application = makeApplication(db_pool,
+                                  query_executor,
+                                  keyword_index=keyword_index,
+                                  result_cache=LRUCache(args.result_cache_size) if args.result_cache_size > 0 else None,
+                                  stream_flush_rows=args.stream_flush_rows,
+                                  row_batch_size=args.row_batch_size,
+                                  log_level=ForumArchiveServer.LOG_LEVEL_NONE,
+                                  feedback_writer=None if args.no_feedback_table else FeedbackWriter(db_pool),
+                                  fragment_cache=LRUCache(args.fragment_cache_size) if args.fragment_cache_size > 0 else None,
+                                  compress_level=args.compress_level,
+                                  metrics=metrics)
+    application.listen(args.port, address='127.0.0.1')
+    ready.set()
+    tornado.ioloop.IOLoop.current().start()
+
+def lookupUrl(baseUrl, keyword, asJson=False):
+    return '%s/serveFaqs?%s' % (baseUrl, urllib.urlencode([('req', 'getFaqsJson' if asJson else 'getFaqs'),
+                                                           ('keyword', keyword),
+                                                           ('uid', 'benchmark')]))
+
+def feedbackUrl(baseUrl, rng):
+    value = '%s,%032x,%s,benchmark' % (rng.choice(FEEDBACK_VALUES), rng.getrandbits(128), rng.randint(1, 10))
+    return '%s/serveFaqs?%s' % (baseUrl, urllib.urlencode([('feedback', "''"), ('value', value)]))
+
+def requestPlan(numRequests, sampler, rng, baseUrl, feedbackRatio, jsonRatio):
+    '''
+    @return: (request type, URL) of numRequests requests
+    @rtype: [(str, str)]
+    '''
+    plan = []
+    for _requestNum in range(numRequests):
+        draw = rng.random()
+        if draw < feedbackRatio:
+            plan.append(('feedback', feedbackUrl(baseUrl, rng)))
+        elif draw < feedbackRatio + jsonRatio:
+            plan.append(('getFaqsJson', lookupUrl(baseUrl, sampler.sample(), asJson=True)))
+        else:
+            plan.append(('getFaqs', lookupUrl(baseUrl, sampler.sample())))
+    return plan
+
+@gen.coroutine
+def driveLevel(plan, concurrency):
+    '''
+    Send the requests of plan, concurrency at a time.
+
+    @return: (request type, seconds, ok) of each request,
+        and the seconds all took
+    @rtype: ([(str, float, bool)], float)
+    '''
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    pending = iter(plan)
+    samples = []
+
+    @gen.coroutine
+    def sendRequests():
+        for (requestType, url) in pending:
+            startTime = time.time()
+            response = yield client.fetch(HTTPRequest(url, request_timeout=120), raise_error=False)
+            samples.append((requestType, time.time() - startTime, response.error is None))
+
+    startTime = time.time()
+    yield [sendRequests() for _sender in range(concurrency)]
+    elapsed = time.time() - startTime
+    client.close()
+    raise gen.Return((samples, elapsed))
+
+@gen.coroutine
+def stageTotals(baseUrl):
+    '''
+    @return: stage --> [seconds, count] from the server's /metrics
+    @rtype: {str : [float, int]}
+    '''
+    client = AsyncHTTPClient(force_instance=True)
+    response = yield client.fetch(baseUrl + '/metrics')
+    client.close()
+    totals = {}
+    for line in response.body.splitlines():
+        sampleMatch = STAGE_SAMPLE.match(line)
+        if sampleMatch is not None:
+            (kind, stage, value) = sampleMatch.groups()
+            totals.setdefault(stage, [0.0, 0])[0 if kind == 'sum' else 1] = float(value)
+    raise gen.Return(totals)
+
+def percentile(sortedValues, fraction):
+    '''
+    Nearest-rank percentile of a sorted list.
+    '''
+    if len(sortedValues) == 0:
+        return None
+    return sortedValues[max(0, int(round(fraction * len(sortedValues) + 0.5)) - 1)]
+
+def latencySummary(seconds):
+    '''
+    @return: mean, max, and percentile latencies in milliseconds
+    @rtype: {str : float}
+    '''
+    seconds = sorted(seconds)
+    if len(seconds) == 0:
+        return {'count' : 0}
+    return {'count' : len(seconds),
+            'mean'  : 1000 * sum(seconds) / len(seconds),
+            'p50'   : 1000 * percentile(seconds, 0.50),
+            'p95'   : 1000 * percentile(seconds, 0.95),
+            'p99'   : 1000 * percentile(seconds, 0.99),
+            'max'   : 1000 * seconds[-1]
+            }
+
+def levelReport(concurrency, samples, elapsed, stagesBefore, stagesAfter):
+    '''
+    @return: the results of one concurrency level, for the JSON output
+    @rtype: dict
+    '''
+    latencies = {'all' : latencySummary([seconds for (_requestType, seconds, _ok) in samples])}
+    for requestType in sorted(set(requestType for (requestType, _seconds, _ok) in samples)):
+        latencies[requestType] = latencySummary([seconds for (sampleType, seconds, _ok) in samples
+                                                 if sampleType == requestType])
+    stageMeans = {}
+    for (stage, (totalSeconds, count)) in stagesAfter.items():
+        (secondsBefore, countBefore) = stagesBefore.get(stage, (0.0, 0))
+        if count > countBefore:
+            stageMeans[stage] = 1000 * (totalSeconds - secondsBefore) / (count - countBefore)
+    return {'concurrency'      : concurrency,
+            'requests'         : len(samples),
+            'errors'           : sum(1 for (_requestType, _seconds, ok) in samples if not ok),
+            'seconds'          : elapsed,
+            'throughput'       : len(samples) / elapsed if elapsed > 0 else None,
+            'latencyMs'        : latencies,
+            'serverStageMeanMs': stageMeans
+            }
+
+def gitCommit():
+    '''
+    @return: commit of the code being measured, if known
+    @rtype: {str | None}
+    '''
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                           cwd=os.path.dirname(os.path.abspath(__file__)),
+                                           stderr=devnull).strip()
+    except Exception:
+        return None
+
+def runBenchmark(args):
+    '''
+    Seed the forum, start the server, and send the load of
+    each concurrency level.
+
+    @return: the report for the JSON output
+    @rtype: dict
+    '''
+    dbPath = args.db
+    if dbPath is None:
+        (fd, dbPath) = tempfile.mkstemp(suffix='.sqlite', prefix='forum_benchmark_')
+        os.close(fd)
+    sys.stdout.write('Seeding %s posts into %s...\n' % (args.posts, dbPath))
+    keywords = seedForum(dbPath, args.posts, args.keywords, args.keywords_per_post, args.skew, args.seed)
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=runServer, args=(args, dbPath, ready))
+    server.daemon = True
+    server.start()
+    try:
+        if not ready.wait(120) or not server.is_alive():
+            raise ValueError("Benchmark server did not start on port %s." % args.port)
+        baseUrl = 'http://127.0.0.1:%s' % args.port
+        rng = random.Random(args.seed)
+        sampler = ZipfSampler(keywords, args.skew, rng)
+        ioLoop = tornado.ioloop.IOLoop.current()
+        if args.warmup_requests > 0:
+            plan = requestPlan(args.warmup_requests, sampler, rng, baseUrl, args.feedback_ratio, args.json_ratio)
+            ioLoop.run_sync(lambda: driveLevel(plan, max(args.concurrency)))
+        levels = []
+        for concurrency in args.concurrency:
+            plan = requestPlan(args.requests, sampler, rng, baseUrl, args.feedback_ratio, args.json_ratio)
+            stagesBefore = ioLoop.run_sync(lambda: stageTotals(baseUrl))
+            (samples, elapsed) = ioLoop.run_sync(lambda: driveLevel(plan, concurrency))
+            stagesAfter = ioLoop.run_sync(lambda: stageTotals(baseUrl))
+            level = levelReport(concurrency, samples, elapsed, stagesBefore, stagesAfter)
+            sys.stdout.write('Concurrency %4s: %8.1f requests/s, p50 %7.1f ms, p95 %7.1f ms, p99 %7.1f ms, %s errors\n' %\
+                             (concurrency, level['throughput'] or 0, level['latencyMs']['all']['p50'],
+                              level['latencyMs']['all']['p95'], level['latencyMs']['all']['p99'], level['errors']))
+            levels.append(level)
+    finally:
+        server.terminate()
+        server.join()
+        if args.db is None:
+            for path in [dbPath, dbPath + '-wal', dbPath + '-shm']:
+                if os.path.exists(path):
+                    os.remove(path)
+    return {'commit'  : gitCommit(),
+            'started' : datetime.datetime.now().isoformat(),
+            'python'  : sys.version.split()[0],
+            'config'  : vars(args),
+            'levels'  : levels
+            }
+
+# ====================================  Main ================
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     description='Load test the server against a synthetic forum in SQLite, '
+                                                 'and report throughput and latency percentiles as JSON.')
+    parser.add_argument('--posts',
+                        type=int,
+                        default=10000,
+                        help='Posts in the synthetic forum (default: %(default)s)')
+    parser.add_argument('--keywords',
+                        type=int,
+                        default=1000,
+                        help='Distinct keywords (default: %(default)s)')
+    parser.add_argument('--keywords-per-post',
+                        type=int,
+                        default=3,
+                        help='Keywords of each post (default: %(default)s)')
+    parser.add_argument('--skew',
+                        type=float,
+                        default=1.0,
+                        help='Zipf exponent of keyword popularity, in posts and in requests; '
+                             '0 for uniform (default: %(default)s)')
+    parser.add_argument('--seed',
+                        type=int,
+                        default=42,
+                        help='Random seed of the forum and the requests (default: %(default)s)')
+    parser.add_argument('--db',
+                        help='SQLite file to seed, and keep; default: a temporary file')
+    parser.add_argument('--concurrency',
+                        type=int,
+                        nargs='+',
+                        default=[1, 4, 16, 64],
+                        help='Requests in flight at each level (default: %(default)s)')
+    parser.add_argument('--requests',
+                        type=int,
+                        default=1000,
+                        help='Requests sent at each level (default: %(default)s)')
+    parser.add_argument('--warmup-requests',
+                        type=int,
+                        default=100,
+                        help='Requests sent before the first level, and not reported (default: %(default)s)')
+    parser.add_argument('--feedback-ratio',
+                        type=float,
+                        default=0.1,
+                        help='Fraction of requests that are feedback clicks (default: %(default)s)')
+    parser.add_argument('--json-ratio',
+                        type=float,
+                        default=0.0,
+                        help='Fraction of requests that are getFaqsJson lookups (default: %(default)s)')
+    parser.add_argument('--port',
+                        type=int,
+                        default=8099,
+                        help='Local port of the server under test (default: %(default)s)')
+    parser.add_argument('--out',
+                        default='benchmark.json',
+                        help='JSON file to write (default: %(default)s)')
+    # Server configuration, as in forum_archive_server.py:
+    parser.add_argument('--pool-max',
+                        type=int,
+                        default=10,
+                        help='Maximum db connections (default: %(default)s)')
+    parser.add_argument('--query-threads',
+                        type=int,
+                        default=10,
+                        help='Threads running db calls (default: %(default)s)')
+    parser.add_argument('--keyword-index',
+                        action='store_true',
+                        help='Answer lookups from the in-memory keyword index')
+    parser.add_argument('--result-cache-size',
+                        type=int,
+                        default=0,
+                        help='Keyword lists whose results are cached; 0 for none (default: %(default)s)')
+    parser.add_argument('--fragment-cache-size',
+                        type=int,
+                        default=0,
+                        help='Rendered posts kept for reuse; 0 for none (default: %(default)s)')
+    parser.add_argument('--stream-flush-rows',
+                        type=int,
+                        default=0,
+                        help='Flush result pages after this many results; 0 for none (default: %(default)s)')
+    parser.add_argument('--row-batch-size',
+                        type=int,
+                        default=0,
+                        help='Read result rows this many at a time; 0 for all at once (default: %(default)s)')
+    parser.add_argument('--compress-level',
+                        type=int,
+                        default=0,
+                        help='Gzip level of /serveFaqs responses, which the load driver '
+                             'accepts; 0 for none (default: %(default)s)')
+    parser.add_argument('--no-feedback-table',
+                        action='store_true',
+                        help='Do not store feedback in the db')
+    args = parser.parse_args(argv)
+
+    if args.posts < 1 or args.keywords < 1 or args.keywords_per_post < 1:
+        parser.error('--posts, --keywords, and --keywords-per-post must be positive')
+    if min(args.concurrency) < 1:
+        parser.error('--concurrency levels must be positive')
+    if args.feedback_ratio < 0 or args.json_ratio < 0 or args.feedback_ratio + args.json_ratio > 1:
+        parser.error('--feedback-ratio and --json-ratio must be between 0 and 1, and add up to at most 1')
+
+    try:
+        report = runBenchmark(args)
+    except ValueError as e:
+        sys.stderr.write('%s\n' % str(e))
+        return 2
+    with open(args.out, 'w') as outFile:
+        json.dump(report, outFile, indent=1, sort_keys=True)
+    sys.stdout.write('Wrote %s.\n' % args.out)
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
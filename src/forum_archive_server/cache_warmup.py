@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Warms the result cache with the keywords of the wordclouds.
+Each wordcloud page is an image map whose areas link to
+
+    .../serveFaqs?req=getFaqs&keyword=<keyword>
+
+and those are the lookups students will click. CacheWarmup
+extracts the distinct keywords of all maps, and runs the
+request of a click for each through the application, a few
+at a time. The requests never touch the network: they are
+answered into a WarmupConnection that discards the response.
+So the results are rendered and cached exactly as for a
+click, with the same cache keys, in every worker process.
+
+Warm-up requests are not logged as responses, and are not
+remembered for feedback; see ForumArchiveServer.warmup.
+
+@author:     Andreas Paepcke
+
+'''
+
+import datetime
+import glob
+import os
+import re
+import sys
+import time
+import urllib
+import urlparse
+
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httputil import HTTPServerRequest
+
+
+# Maps of the wordclouds served under /wordclouds:
+WORDCLOUD_MAPS = os.path.join('wordclouds', '*', 'index.html')
+
+AREA_HREF = re.compile(r'<area\b[^>]*?\bhref\s*=\s*"([^"]*)"', re.IGNORECASE)
+
+# uid of the warm-up requests; uids are not part of cached results:
+WARMUP_UID = 'warmup'
+
+class CacheWarmup(object):
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, application, query_executor, mapPattern=WORDCLOUD_MAPS, concurrency=4):
+        '''
+        @param application: the server application, whose caches to warm
+        @type application: tornado.web.Application
+        @param query_executor: thread pool in which the maps are read
+        @type query_executor: concurrent.futures.ThreadPoolExecutor
+        @param mapPattern: glob of the wordcloud pages
+        @type mapPattern: str
+        @param concurrency: number of lookups in flight at a time
+        @type concurrency: int
+        '''
+        self.application = application
+        self.query_executor = query_executor
+        self.mapPattern = mapPattern
+        self.concurrency = max(1, concurrency)
+        self.running = False
+
+    #-----------------------
+    # warm
+    #---------------
+
+    @gen.coroutine
+    def warm(self):
+        '''
+        Look up every wordcloud keyword, so its first result page
+        is cached. Re-reads the maps, which may have changed since
+        the last warm-up. Does nothing while a warm-up is running.
+
+        @return: number of keywords looked up
+        @rtype: int
+        '''
+        if self.running:
+            raise gen.Return(0)
+        self.running = True
+        startTime = time.time()
+        try:
+            keywords = yield self.query_executor.submit(wordcloudKeywords, self.mapPattern)
+            # The workers take keywords from one iterator, so at
+            # most concurrency lookups are in flight:
+            pending = iter(keywords)
+            workerCounts = yield [self.warmKeywords(pending) for _worker in range(self.concurrency)]
+            numWarmed = sum(workerCounts)
+        except Exception as e:
+            sys.stderr.write('%s error: Could not warm up cache: %s\n' % (datetime.datetime.now(), `e`))
+            raise gen.Return(0)
+        finally:
+            self.running = False
+        sys.stdout.write('%s info: Cache warmed up with %s wordcloud keywords in %.1f seconds.\n' %\
+                         (datetime.datetime.now(), numWarmed, time.time() - startTime))
+        raise gen.Return(numWarmed)
+
+    #-----------------------
+    # warmKeywords
+    #---------------
+
+    @gen.coroutine
+    def warmKeywords(self, pending):
+        '''
+        Look up keywords from pending, one after the other,
+        until there are none left.
+
+        @param pending: keywords shared with the other workers
+        @type pending: iterator
+        @return: number of keywords looked up
+        @rtype: int
+        '''
+        numWarmed = 0
+        for keyword in pending:
+            yield self.lookUp(keyword)
+            numWarmed += 1
+        raise gen.Return(numWarmed)
+
+    #-----------------------
+    # lookUp
+    #---------------
+
+    def lookUp(self, keyword):
+        '''
+        Run the request of a click on keyword through the
+        application.
+
+        @return: future that resolves when the response is complete
+        @rtype: tornado.concurrent.Future
+        '''
+        connection = WarmupConnection()
+        query = urllib.urlencode([('req', 'getFaqs'), ('keyword', keyword), ('uid', WARMUP_UID)])
+        self.application(HTTPServerRequest(method='GET',
+                                           uri='/serveFaqs?' + query,
+                                           connection=connection))
+        return connection.finished
+
+class WarmupConnection(object):
+    '''
+    Takes the place of the HTTP connection of a warm-up
+    request. The response is discarded; finished resolves
+    when the handler is done with it.
+    '''
+
+    def __init__(self):
+        self.finished = Future()
+
+    def set_close_callback(self, callback):
+        pass
+
+    def write_headers(self, start_line, headers, chunk=None, callback=None):
+        return self.write(chunk, callback)
+
+    def write(self, chunk, callback=None):
+        if callback is not None:
+            callback()
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def finish(self):
+        if not self.finished.done():
+            self.finished.set_result(None)
+
+# ====================================  Utilities ================
+
+def wordcloudKeywords(mapPattern=WORDCLOUD_MAPS):
+    '''
+    The distinct keywords that the areas of the wordcloud maps
+    look up, as the server receives them.
+
+    @param mapPattern: glob of the wordcloud pages
+    @type mapPattern: str
+    @return: the keywords, sorted
+    @rtype: [str]
+    '''
+    keywords = set()
+    for mapPath in glob.glob(mapPattern):
+        with open(mapPath) as mapFile:
+            for href in AREA_HREF.findall(mapFile.read()):
+                (path, _sep, query) = href.replace('&amp;', '&').partition('?')
+                args = urlparse.parse_qs(query)
+                if path.endswith('/serveFaqs') and args.get('req') == ['getFaqs']:
+                    keywords.update(args.get('keyword', []))
+    return sorted(keywords)
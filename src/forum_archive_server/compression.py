@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Gzip compression of /serveFaqs responses.
+
+Cached results are compressed once, and reused: the fixed
+parts of a cached page are held as raw deflate segments, each
+compressed on its own and ended by a sync flush, so that it
+ends on a byte boundary and refers to no other segment. Such
+segments may be concatenated in any order into one deflate
+stream. gzipPieces() builds a response from the segments of
+the fixed parts and segments of the per-request text, which
+is short; of the whole text it only computes the CRC, which
+is much cheaper than compressing it.
+
+Responses that are not in the cache are compressed as they
+are written, by the output transform of resultCompression().
+
+@author:     Andreas Paepcke
+
+'''
+
+import struct
+import zlib
+
+from static_assets import acceptedEncodings
+from tornado.web import GZipContentEncoding
+
+
+# Gzip header: deflate, no name or time, unknown OS:
+GZIP_HEADER = '\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+# Empty last block of a deflate stream:
+FINAL_BLOCK = '\x03\x00'
+
+# (text, level) --> segment, for texts that are the
+# same in all responses, such as page headers:
+constantSegments = {}
+
+# ====================================  Utilities ================
+
+def deflateSegment(text, level=6):
+    '''
+    Raw deflate segment of text that can be concatenated with
+    other segments; see above.
+
+    @param text: text to compress
+    @type text: str
+    @param level: zlib compression level, 1 to 9
+    @type level: int
+    @return: the segment
+    @rtype: str
+    '''
+    if len(text) == 0:
+        return ''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(text) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+def constantSegment(text, level=6):
+    '''
+    Like deflateSegment(), but compresses each text only once.
+    For the few texts that are part of every response.
+    '''
+    key = (text, level)
+    segment = constantSegments.get(key)
+    if segment is None:
+        segment = deflateSegment(text, level)
+        constantSegments[key] = segment
+    return segment
+
+def splicedPieces(splicedText, level=6, **values):
+    '''
+    The pieces of a filled SplicedText for gzipPieces(): its
+    fixed parts with their segments, and the values of its
+    gaps, which are compressed when the response is built.
+
+    @param splicedText: text with gaps
+    @type splicedText: SplicedText
+    @param level: zlib compression level
+    @type level: int
+    @param values: value of each field
+    @type values: {str : str}
+    @return: (text, segment) pairs; segment is None for values
+    @rtype: [(str, {str | None})]
+    '''
+    segments = splicedText.deflated(level)
+    pieces = [(splicedText.parts[0], segments[0])]
+    for (fieldName, part, segment) in zip(splicedText.fieldNames, splicedText.parts[1:], segments[1:]):
+        pieces.append((values[fieldName], None))
+        pieces.append((part, segment))
+    return pieces
+
+def gzipPieces(pieces, level=6):
+    '''
+    Gzip file of the concatenated texts of pieces.
+
+    @param pieces: text of each piece, and its deflate segment;
+        pieces without a segment are compressed here
+    @type pieces: [(str, {str | None})]
+    @param level: zlib compression level for the pieces without segment
+    @type level: int
+    @return: gzip-compressed text
+    @rtype: str
+    '''
+    segments = [GZIP_HEADER]
+    crc = 0
+    size = 0
+    for (text, segment) in pieces:
+        crc = zlib.crc32(text, crc)
+        size += len(text)
+        segments.append(deflateSegment(text, level) if segment is None else segment)
+    segments.append(FINAL_BLOCK)
+    segments.append(struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+    return ''.join(segments)
+
+def resultCompression(level=6, minBytes=1024, paths=('/serveFaqs',)):
+    '''
+    Output transform, for the transforms of a tornado.web.Application,
+    that gzips responses to requests for paths whose browser
+    accepts it. Responses written in one piece are compressed
+    if they have at least minBytes; streamed responses always
+    are. Responses that already carry a Content-Encoding, such
+    as cached results from gzipPieces(), are left alone.
+
+    @param level: zlib compression level, 1 to 9
+    @type level: int
+    @param minBytes: minimum size of responses written in one piece
+    @type minBytes: int
+    @param paths: request paths whose responses are compressed
+    @type paths: [str]
+    @return: the transform class
+    @rtype: type
+    '''
+    class ResultCompression(GZipContentEncoding):
+
+        GZIP_LEVEL = level
+        MIN_LENGTH = minBytes
+
+        def __init__(self, request):
+            super(ResultCompression, self).__init__(request)
+            self.applies = request.path in paths
+            self._gzipping = self.applies and 'gzip' in acceptedEncodings(request.headers.get('Accept-Encoding', ''))
+
+        def transform_first_chunk(self, status_code, headers, chunk, finishing):
+            if not self.applies:
+                return (status_code, headers, chunk)
+            return super(ResultCompression, self).transform_first_chunk(status_code, headers, chunk, finishing)
+
+    return ResultCompression
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Process-wide pool of long-lived MySQLDB connections.
+Created once in main(), and shared by all requests
+to the forum archive server. Connections are health
+checked when checked out, and are transparently re-opened
+when the MySQL server dropped them (e.g. after wait_timeout).
+
+@author:     Andreas Paepcke
+
+'''
+
+import os
+import threading
+import time
+
+from pymysql_utils.pymysql_utils import MySQLDB
+
+
+class PoolExhaustedError(Exception):
+    '''
+    Raised when no connection became available within
+    the checkout timeout.
+    '''
+    pass
+
+class MySQLConnectionPool(object):
+
+    # =========================== Constants ==================
+
+    # Connections that sat idle for longer than this
+    # many seconds are pinged before being handed out.
+    # Connections that MySQL dropped more recently fail
+    # their first query instead:
+    DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self,
+                 user,
+                 passwd=None,
+                 db='ForumArchive',
+                 host=None,
+                 port=None,
+                 minSize=2,
+                 maxSize=10,
+                 checkoutTimeout=5.0,
+                 healthCheckInterval=DEFAULT_HEALTH_CHECK_INTERVAL,
+                 metrics=None):
+        '''
+        Create a pool. No connections are opened until
+        fill() or acquire() is called.
+
+        @param user: MySQL user
+        @type user: str
+        @param passwd: MySQL password, or None if none is needed
+        @type passwd: {str | None}
+        @param db: database to connect to
+        @type db: str
+        @param host: MySQL host, or None for MySQLDB's default
+        @type host: {str | None}
+        @param port: MySQL port, or None for MySQLDB's default
+        @type port: {int | None}
+        @param minSize: number of connections opened by fill(), and
+                 kept open even when idle
+        @type minSize: int
+        @param maxSize: maximum number of simultaneously open connections
+        @type maxSize: int
+        @param checkoutTimeout: seconds acquire() waits for a connection
+                 when all maxSize connections are in use
+        @type checkoutTimeout: float
+        @param healthCheckInterval: idle seconds after which a connection
+                 is pinged before being handed out; 0 pings on every
+                 checkout, at the cost of a round trip to MySQL each
+        @type healthCheckInterval: float
+        @param metrics: if provided, the time each checkout
+                 takes is recorded as stage 'acquire'
+        @type metrics: {ServerMetrics | None}
+        '''
+        if minSize < 0 or maxSize < 1 or minSize > maxSize:
+            raise ValueError("Pool sizes must satisfy 0 <= minSize <= maxSize, and maxSize >= 1; got %s/%s" %\
+                             (minSize, maxSize))
+        self.user   = user
+        self.passwd = passwd
+        self.db     = db
+        self.host   = host
+        self.port   = port
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.checkoutTimeout = checkoutTimeout
+        self.healthCheckInterval = healthCheckInterval
+        self.metrics = metrics
+
+        # Idle connections as (MySQLDB, timeLastReturned) tuples.
+        # Used as a stack, so that the most recently used
+        # (and therefore most likely alive) connection is
+        # handed out first:
+        self.idle = []
+        self.numOpen = 0
+        self.closed = False
+        self.lock = threading.Condition(threading.Lock())
+
+        # Counters for monitoring:
+        self.numCheckouts   = 0
+        self.numWaits       = 0
+        self.numTimeouts    = 0
+        self.numReconnects  = 0
+        self.numHealthCheckFailures = 0
+
+    #-----------------------
+    # fill
+    #---------------
+
+    def fill(self):
+        '''
+        Open connections until minSize connections exist.
+        Called once at startup. Connection errors propagate
+        to the caller.
+        '''
+        with self.lock:
+            while self.numOpen < self.minSize:
+                mysqlDb = self.openConnection()
+                self.numOpen += 1
+                self.idle.append((mysqlDb, time.time()))
+
+    #-----------------------
+    # acquire
+    #---------------
+
+    def acquire(self, timeout=None):
+        '''
+        Check out a connection. If an idle connection exists
+        it is health checked and returned. Else a new connection
+        is opened if fewer than maxSize exist. Else waits until
+        another request releases a connection.
+
+        @param timeout: seconds to wait; None means use checkoutTimeout
+        @type timeout: {float | None}
+        @return: an open connection
+        @rtype: MySQLDB
+        @raise PoolExhaustedError: if no connection came free in time
+        @raise ValueError: if a new connection could not be opened
+        '''
+        if timeout is None:
+            timeout = self.checkoutTimeout
+        startTime = time.time()
+        deadline = startTime + timeout
+        with self.lock:
+            if self.closed:
+                raise ValueError("Connection pool is closed.")
+            waited = False
+            while len(self.idle) == 0 and self.numOpen >= self.maxSize:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.numTimeouts += 1
+                    raise PoolExhaustedError("All %s MySQL connections busy for %s seconds." %\
+                                             (self.maxSize, timeout))
+                if not waited:
+                    self.numWaits += 1
+                    waited = True
+                self.lock.wait(remaining)
+            if len(self.idle) > 0:
+                (mysqlDb, lastUsed) = self.idle.pop()
+            else:
+                # Reserve the slot now; the actual connect
+                # happens outside the lock:
+                (mysqlDb, lastUsed) = (None, None)
+                self.numOpen += 1
+            self.numCheckouts += 1
+
+        try:
+            if mysqlDb is None:
+                mysqlDb = self.openConnection()
+            elif time.time() - lastUsed > self.healthCheckInterval and not self.isAlive(mysqlDb):
+                self.numHealthCheckFailures += 1
+                self.closeQuietly(mysqlDb)
+                mysqlDb = self.openConnection()
+                self.numReconnects += 1
+        except Exception:
+            # Give the slot back:
+            with self.lock:
+                self.numOpen -= 1
+                self.lock.notify()
+            raise
+        if self.metrics is not None:
+            self.metrics.observeStage('acquire', time.time() - startTime)
+        return mysqlDb
+
+    #-----------------------
+    # release
+    #---------------
+
+    def release(self, mysqlDb, discard=False):
+        '''
+        Return a connection to the pool.
+
+        @param mysqlDb: connection obtained from acquire()
+        @type mysqlDb: MySQLDB
+        @param discard: if True the connection is closed rather than
+                 reused; use when it is known to be broken.
+        @type discard: bool
+        '''
+        if mysqlDb is None:
+            return
+        if not discard:
+            self.closeQueryCursors(mysqlDb)
+        with self.lock:
+            if discard or self.closed:
+                self.numOpen -= 1
+                toClose = mysqlDb
+            else:
+                self.idle.append((mysqlDb, time.time()))
+                toClose = None
+            self.lock.notify()
+        if toClose is not None:
+            self.closeQuietly(toClose)
+
+    #-----------------------
+    # withConnection
+    #---------------
+
+    def withConnection(self, fn, *args):
+        '''
+        Call fn(mysqlDb, *args) with a checked out connection,
+        and return the connection to the pool afterwards.
+
+        @param fn: function taking an open MySQLDB as first argument
+        @type fn: callable
+        @return: fn's return value
+        @rtype: <any>
+        '''
+        mysqlDb = self.acquire()
+        try:
+            return fn(mysqlDb, *args)
+        finally:
+            self.release(mysqlDb)
+
+    #-----------------------
+    # close
+    #---------------
+
+    def close(self):
+        '''
+        Close all idle connections, and have connections
+        that are still checked out closed when released.
+        '''
+        with self.lock:
+            self.closed = True
+            toClose = [mysqlDb for (mysqlDb, _lastUsed) in self.idle]
+            self.numOpen -= len(toClose)
+            self.idle = []
+            self.lock.notify_all()
+        for mysqlDb in toClose:
+            self.closeQuietly(mysqlDb)
+
+    #-----------------------
+    # stats
+    #---------------
+
+    def stats(self):
+        '''
+        Snapshot of pool state and counters.
+
+        @return: dict with keys open, idle, inUse, maxSize, checkouts,
+                 waits (checkouts that found the pool exhausted),
+                 timeouts, reconnects, and healthCheckFailures
+        @rtype: {str : int}
+        '''
+        with self.lock:
+            return {'open'       : self.numOpen,
+                    'idle'       : len(self.idle),
+                    'inUse'      : self.numOpen - len(self.idle),
+                    'maxSize'    : self.maxSize,
+                    'checkouts'  : self.numCheckouts,
+                    'waits'      : self.numWaits,
+                    'timeouts'   : self.numTimeouts,
+                    'reconnects' : self.numReconnects,
+                    'healthCheckFailures' : self.numHealthCheckFailures
+                    }
+
+    #-----------------------
+    # openConnection
+    #---------------
+
+    def openConnection(self):
+        '''
+        Open one new MySQLDB connection. Only the connection
+        parameters that were given to the pool are passed on;
+        MySQLDB supplies defaults for the others.
+        '''
+        connectArgs = {'user' : self.user, 'db' : self.db}
+        if self.passwd is not None:
+            connectArgs['passwd'] = self.passwd
+        if self.host is not None:
+            connectArgs['host'] = self.host
+        if self.port is not None:
+            connectArgs['port'] = self.port
+        return MySQLDB(**connectArgs)
+
+    #-----------------------
+    # isAlive
+    #---------------
+
+    def isAlive(self, mysqlDb):
+        '''
+        Ping the server through the given connection.
+        '''
+        try:
+            mysqlDb.connection.ping()
+            return True
+        except Exception:
+            return False
+
+    #-----------------------
+    # closeQuietly
+    #---------------
+
+    def closeQuietly(self, mysqlDb):
+        try:
+            mysqlDb.close()
+        except Exception:
+            pass
+
+    #-----------------------
+    # closeQueryCursors
+    #---------------
+
+    def closeQueryCursors(self, mysqlDb):
+        '''
+        MySQLDB.query() keeps each cursor it opens in
+        mysqlDb.cursors until the connection is closed. Pooled
+        connections are never closed, so close and forget those
+        cursors whenever a connection comes back.
+        '''
+        cursors = getattr(mysqlDb, 'cursors', None)
+        if not cursors:
+            return
+        for cursor in cursors:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        del cursors[:]
+
+# ====================================  Utilities ================
+
+def readMySQLPwd():
+    '''
+    Finds MySQL password in ~/.ssh/mysql.
+
+    @return: the password, or None if the file does not exist.
+    @rtype: {str | None}
+    '''
+    home_dir = os.path.expanduser('~')
+    try:
+        with open(os.path.join(home_dir, '.ssh/mysql'), 'r') as fd:
+            return fd.readline().strip()
+    except IOError:
+        return None
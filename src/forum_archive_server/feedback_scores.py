@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Usefulness scores of results, learned from the Not/Partial/
+Completely feedback that students give on result pages, and
+the re-ranking of lookup results by those scores.
+
+Scores are kept in memory per (keyword, question_id), where
+keyword is the first keyword of the request, in lower case.
+Feedback only names a session_id and a rank, so the results
+of recent sessions are remembered, in order to find the
+question that the feedback is about. Those sessions live in
+the server process, so re-ranking needs a single server
+process (--workers 1). Each feedback click updates one
+score; nothing is recomputed. The scores are periodically
+written to a snapshot file, from which they are loaded at
+startup.
+
+A question's usefulness is the mean of its feedback, with
+Not=0, Partial=0.5, Completely=1, pulled towards 0.5 for
+questions with little feedback:
+
+    usefulness = (sum + 0.5 * PRIOR_WEIGHT) / (count + PRIOR_WEIGHT)
+
+Re-ranking orders the candidates that match the same number
+of request terms by a weighted blend of the ranking columns
+and the usefulness:
+
+    answer_type      * answer_type
+  + unique_views     * log(1 + unique_views)
+  + total_no_upvotes * log(1 + total_no_upvotes)
+  + feedback         * (usefulness - 0.5)
+
+The weights are given as a string like RankBlend.DEFAULT_SPEC.
+
+@author:     Andreas Paepcke
+
+'''
+
+from collections import OrderedDict
+import json
+import math
+import os
+import threading
+
+
+FEEDBACK_USEFULNESS = {'Not' : 0.0, 'Partial' : 0.5, 'Completely' : 1.0}
+
+# Weight of the neutral 0.5 prior, in feedback clicks:
+PRIOR_WEIGHT = 2.0
+
+class FeedbackScores(object):
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, snapshotPath=None, sessionWindow=100000):
+        '''
+        @param snapshotPath: file for snapshot() and load(); None for
+            scores that only live in memory
+        @type snapshotPath: {str | None}
+        @param sessionWindow: number of recent sessions whose results
+            are remembered for attributing feedback
+        @type sessionWindow: int
+        '''
+        self.snapshotPath = snapshotPath
+        self.sessionWindow = sessionWindow
+        # keyword --> {question_id : [numFeedback, usefulnessSum]}:
+        self.scores = {}
+        # session_id --> (keyword, {rank : question_id}), oldest first:
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        # Incremented by advanceEpoch() and load(); part of result
+        # cache keys, so that cached rankings follow the scores:
+        self.epoch = 0
+        # numFeedback when the epoch last advanced:
+        self.epochFeedback = 0
+        self.numFeedback = 0
+        self.numUnattributed = 0
+
+    #-----------------------
+    # rememberResponses
+    #---------------
+
+    def rememberResponses(self, session_id, keyword, rankedQuestionIds):
+        '''
+        Note which questions a session was shown, so that
+        feedback on them can be attributed.
+
+        @param session_id: session of the response
+        @type session_id: str
+        @param keyword: first keyword of the request
+        @type keyword: str
+        @param rankedQuestionIds: (rank, question_id) pairs
+        @type rankedQuestionIds: [(int, str)]
+        '''
+        with self.lock:
+            self.sessions[session_id] = (keyword.lower(), dict(rankedQuestionIds))
+            if len(self.sessions) > self.sessionWindow:
+                self.sessions.popitem(last=False)
+
+    #-----------------------
+    # recordFeedback
+    #---------------
+
+    def recordFeedback(self, session_id, rank, feedback):
+        '''
+        Update the score of the question shown at rank in
+        session_id.
+
+        @return: False if the session is unknown, e.g. too old,
+            or served by another process
+        @rtype: bool
+        '''
+        with self.lock:
+            (keyword, questionIds) = self.sessions.get(session_id, (None, {}))
+            question_id = questionIds.get(rank)
+            if question_id is None:
+                self.numUnattributed += 1
+                return False
+            counts = self.scores.setdefault(keyword, {}).setdefault(question_id, [0, 0.0])
+            counts[0] += 1
+            counts[1] += FEEDBACK_USEFULNESS[feedback]
+            self.numFeedback += 1
+            return True
+
+    #-----------------------
+    # usefulness
+    #---------------
+
+    def usefulness(self, keyword, question_id):
+        '''
+        Usefulness of question_id for keyword, between 0 and 1;
+        0.5 without feedback.
+        '''
+        counts = self.scores.get(keyword.lower(), {}).get(question_id)
+        if counts is None:
+            return 0.5
+        return (counts[1] + 0.5 * PRIOR_WEIGHT) / (counts[0] + PRIOR_WEIGHT)
+
+    #-----------------------
+    # rerank
+    #---------------
+
+    def rerank(self, keyword, candidates, blend):
+        '''
+        Order candidates by blend, best first. Only candidates
+        that match the same number of request terms trade places,
+        so that posts matching more terms stay ahead. Candidates
+        with equal relevance keep their order.
+
+        @param keyword: first keyword of the request
+        @type keyword: str
+        @param candidates: (question_id, answer_type, unique_views,
+            total_no_upvotes, numMatched, payload) tuples, in the
+            original order
+        @type candidates: [tuple]
+        @param blend: weights of the ranking components
+        @type blend: RankBlend
+        @return: the payloads in the new order
+        @rtype: [<any>]
+        '''
+        relevances = []
+        for (position, (question_id, answer_type, unique_views, total_no_upvotes, numMatched, payload)) \
+                in enumerate(candidates):
+            relevance = blend.relevance(answer_type, 
+                                        unique_views, 
+                                        total_no_upvotes, 
+                                        self.usefulness(keyword, question_id))
+            relevances.append((-numMatched, -relevance, position, payload))
+        relevances.sort()
+        return [payload for (_numMatched, _relevance, _position, payload) in relevances]
+
+    #-----------------------
+    # advanceEpoch
+    #---------------
+
+    def advanceEpoch(self):
+        '''
+        Start a new epoch if feedback was recorded since the last
+        one, so that results cached with older scores are no
+        longer used. Called periodically.
+
+        @return: whether a new epoch started
+        @rtype: bool
+        '''
+        with self.lock:
+            if self.numFeedback == self.epochFeedback:
+                return False
+            self.epochFeedback = self.numFeedback
+            self.epoch += 1
+            return True
+
+    #-----------------------
+    # snapshot
+    #---------------
+
+    def snapshot(self):
+        '''
+        Write the scores to snapshotPath. The file is replaced
+        in one step, so a crash leaves the previous snapshot.
+        '''
+        with self.lock:
+            scores = dict((keyword, dict((question_id, list(counts))
+                                         for (question_id, counts) in questionScores.items()))
+                          for (keyword, questionScores) in self.scores.items())
+        if self.snapshotPath is None:
+            return
+        tmpPath = self.snapshotPath + '.tmp'
+        with open(tmpPath, 'w') as snapshotFile:
+            json.dump(scores, snapshotFile)
+        os.rename(tmpPath, self.snapshotPath)
+
+    #-----------------------
+    # load
+    #---------------
+
+    def load(self):
+        '''
+        Read the scores from snapshotPath, if it exists.
+
+        @return: number of keywords with scores
+        @rtype: int
+        '''
+        if self.snapshotPath is None or not os.path.exists(self.snapshotPath):
+            return 0
+        with open(self.snapshotPath) as snapshotFile:
+            scores = json.load(snapshotFile)
+        with self.lock:
+            self.scores = dict((keyword, dict((question_id, list(counts))
+                                              for (question_id, counts) in questionScores.items()))
+                               for (keyword, questionScores) in scores.items())
+            self.epoch += 1
+            return len(self.scores)
+
+    #-----------------------
+    # stats
+    #---------------
+
+    def stats(self):
+        with self.lock:
+            return {'keywords'     : len(self.scores),
+                    'sessions'     : len(self.sessions),
+                    'feedback'     : self.numFeedback,
+                    'unattributed' : self.numUnattributed,
+                    'epoch'        : self.epoch
+                    }
+
+class RankBlend(object):
+    '''
+    Weights of the components of the re-ranking relevance.
+    '''
+
+    COMPONENTS = ['answer_type', 'unique_views', 'total_no_upvotes', 'feedback']
+
+    DEFAULT_SPEC = 'answer_type=10,unique_views=1,total_no_upvotes=1,feedback=4'
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, spec=DEFAULT_SPEC):
+        '''
+        @param spec: comma separated <component>=<weight>;
+            components not mentioned get weight 0
+        @type spec: str
+        @raise ValueError: if spec cannot be parsed
+        '''
+        self.weights = dict((component, 0.0) for component in RankBlend.COMPONENTS)
+        for assignment in spec.split(','):
+            if len(assignment.strip()) == 0:
+                continue
+            (component, _eq, weight) = assignment.partition('=')
+            component = component.strip()
+            if component not in self.weights:
+                raise ValueError("Unknown rank blend component '%s'; must be one of %s" %\
+                                 (component, RankBlend.COMPONENTS))
+            self.weights[component] = float(weight)
+
+    #-----------------------
+    # relevance
+    #---------------
+
+    def relevance(self, answer_type, unique_views, total_no_upvotes, usefulness):
+        '''
+        Weighted sum of the components; NULL columns count as 0.
+        '''
+        weights = self.weights
+        return weights['answer_type'] * (answer_type or 0) +\
+               weights['unique_views'] * math.log1p(max(0, unique_views or 0)) +\
+               weights['total_no_upvotes'] * math.log1p(max(0, total_no_upvotes or 0)) +\
+               weights['feedback'] * (usefulness - 0.5)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Stores the feedback that students give on results in the
+ForumFeedback table. Handlers only put feedback into a bounded
+in-memory queue, and can acknowledge the click right away; a
+background thread inserts the queued feedback with one
+multi-row INSERT per batch. A batch whose INSERT fails is
+retried with growing delays; if it still fails, its rows are
+written to stderr in the 'Feedback: ' log form, so they are
+not lost. A batch that MySQL rejects for its data is not
+retried, but inserted again one row at a time, so that only
+the offending rows are lost to the table.
+
+Feedback arrives as the value of the result page radio
+buttons:
+
+    <Not|Partial|Completely>,<session_id>,<rank>,<uid>
+
+@author:     Andreas Paepcke
+
+'''
+
+import datetime
+import Queue
+import sys
+import threading
+import time
+
+
+FEEDBACK_VALUES = ['Not', 'Partial', 'Completely']
+
+# Widths of the ForumFeedback columns:
+MAX_SESSION_ID_LEN = 64
+MAX_UID_LEN        = 255
+
+# DB-API exceptions, of MySQLdb and pymysql alike, that retrying
+# will not cure:
+DATA_ERRORS = ['DataError', 'IntegrityError']
+
+class FeedbackWriter(object):
+
+    # =========================== Constants ==================
+
+    CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS ForumFeedback (
+                          id         BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                          received   DATETIME NOT NULL,
+                          feedback   VARCHAR(16) NOT NULL,
+                          session_id VARCHAR(%s) NOT NULL,
+                          `rank`     INT NOT NULL,
+                          uid        VARCHAR(%s) NOT NULL,
+                          INDEX (session_id, `rank`),
+                          INDEX (received)
+                      )
+                   ''' % (MAX_SESSION_ID_LEN, MAX_UID_LEN)
+
+    INSERT_PREFIX = 'INSERT INTO ForumFeedback (received, feedback, session_id, `rank`, uid) VALUES '
+    INSERT_ROW    = '(%s,%s,%s,%s,%s)'
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self,
+                 db_pool,
+                 maxQueueSize=10000,
+                 batchSize=200,
+                 flushInterval=1.0,
+                 maxRetries=5,
+                 retryDelay=0.5):
+        '''
+        Starts the background writer thread.
+
+        @param db_pool: pool from which to check out connections
+        @type db_pool: MySQLConnectionPool
+        @param maxQueueSize: number of feedback clicks that may wait
+            to be inserted
+        @type maxQueueSize: int
+        @param batchSize: maximum number of rows per INSERT
+        @type batchSize: int
+        @param flushInterval: maximum seconds a click waits to be inserted
+        @type flushInterval: float
+        @param maxRetries: number of times a failed INSERT is retried
+        @type maxRetries: int
+        @param retryDelay: seconds before the first retry; doubled
+            for each further retry
+        @type retryDelay: float
+        '''
+        self.db_pool = db_pool
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.maxRetries = maxRetries
+        self.retryDelay = retryDelay
+
+        self.queue = Queue.Queue(maxsize=maxQueueSize)
+        self.tableCreated = False
+        self.statsLock = threading.Lock()
+        self.numInserted = 0
+        self.numBatches = 0
+        self.numRetries = 0
+        self.numDropped = 0
+        self.numFailed = 0
+
+        self.thread = threading.Thread(target=self.run, name='FeedbackWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    #-----------------------
+    # submit
+    #---------------
+
+    def submit(self, feedback, session_id, rank, uid):
+        '''
+        Queue one feedback click for insertion. Does not block.
+
+        @return: False if the queue was full, and the feedback dropped
+        @rtype: bool
+        '''
+        try:
+            self.queue.put_nowait((datetime.datetime.now(), feedback, session_id, rank, uid))
+            return True
+        except Queue.Full:
+            with self.statsLock:
+                self.numDropped += 1
+            return False
+
+    #-----------------------
+    # close
+    #---------------
+
+    def close(self, timeout=10):
+        '''
+        Insert all queued feedback, and stop the writer thread.
+        '''
+        # None tells the writer thread to finish:
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    #-----------------------
+    # stats
+    #---------------
+
+    def stats(self):
+        '''
+        @return: dict with keys queued, inserted, batches,
+            retries, dropped, and failed
+        @rtype: {str : int}
+        '''
+        with self.statsLock:
+            return {'queued'   : self.queue.qsize(),
+                    'inserted' : self.numInserted,
+                    'batches'  : self.numBatches,
+                    'retries'  : self.numRetries,
+                    'dropped'  : self.numDropped,
+                    'failed'   : self.numFailed
+                    }
+
+    # ---------------------------- Writer thread -----------------
+
+    #-----------------------
+    # run
+    #---------------
+
+    def run(self):
+        '''
+        Body of the writer thread: collects up to batchSize
+        rows, or what arrived within flushInterval seconds,
+        and inserts them.
+        '''
+        while True:
+            row = self.queue.get()
+            if row is None:
+                return
+            batch = [row]
+            deadline = time.time() + self.flushInterval
+            finished = False
+            while len(batch) < self.batchSize:
+                try:
+                    row = self.queue.get(timeout=max(0, deadline - time.time()))
+                except Queue.Empty:
+                    break
+                if row is None:
+                    finished = True
+                    break
+                batch.append(row)
+            self.insertWithRetries(batch)
+            if finished:
+                return
+
+    #-----------------------
+    # insertWithRetries
+    #---------------
+
+    def insertWithRetries(self, batch):
+        delay = self.retryDelay
+        for attempt in range(self.maxRetries + 1):
+            try:
+                self.db_pool.withConnection(self.insertBatch, batch)
+                with self.statsLock:
+                    self.numInserted += len(batch)
+                    self.numBatches += 1
+                return
+            except Exception as e:
+                error = e
+            if isDataError(error):
+                if len(batch) > 1:
+                    for row in batch:
+                        self.insertWithRetries([row])
+                    return
+                break
+            if attempt < self.maxRetries:
+                with self.statsLock:
+                    self.numRetries += 1
+                time.sleep(delay)
+                delay *= 2
+        # Keep the feedback in the log, where it used to be:
+        with self.statsLock:
+            self.numFailed += len(batch)
+        now = datetime.datetime.now()
+        sys.stderr.write('%s error: Could not insert %s feedback rows: %s\n' % (now, len(batch), `error`))
+        for (_received, feedback, session_id, rank, uid) in batch:
+            sys.stderr.write('%s info: Feedback: %s,%s,%s,%s\n' % (now, feedback, session_id, rank, uid))
+        sys.stderr.flush()
+
+    #-----------------------
+    # insertBatch
+    #---------------
+
+    def insertBatch(self, mysqlDb, batch):
+        '''
+        Insert all rows of batch with a single statement.
+
+        @param mysqlDb: open connection
+        @type mysqlDb: MySQLDB
+        @param batch: (received, feedback, session_id, rank, uid) tuples
+        @type batch: [tuple]
+        '''
+        cursor = mysqlDb.connection.cursor()
+        try:
+            if not self.tableCreated:
+                cursor.execute(FeedbackWriter.CREATE_TABLE)
+                self.tableCreated = True
+            params = []
+            for row in batch:
+                params.extend(row)
+            cursor.execute(FeedbackWriter.INSERT_PREFIX + ','.join([FeedbackWriter.INSERT_ROW] * len(batch)),
+                           params)
+            mysqlDb.connection.commit()
+        finally:
+            cursor.close()
+
+# ====================================  Utilities ================
+
+def parseFeedback(value):
+    '''
+    Split the value of a feedback radio button.
+
+    @param value: <Not|Partial|Completely>,<session_id>,<rank>,<uid>
+    @type value: str
+    @return: (feedback, session_id, rank, uid)
+    @rtype: (str, str, int, str)
+    @raise ValueError: if value is not of that form
+    '''
+    parts = value.split(',', 3)
+    if len(parts) != 4:
+        raise ValueError("Feedback value must be <feedback>,<session_id>,<rank>,<uid>; got '%s'" % value)
+    (feedback, session_id, rank, uid) = parts
+    if feedback not in FEEDBACK_VALUES:
+        raise ValueError("Feedback must be one of %s; got '%s'" % (FEEDBACK_VALUES, feedback))
+    if len(session_id) > MAX_SESSION_ID_LEN:
+        raise ValueError("Session ID must be at most %s characters; got %s" % (MAX_SESSION_ID_LEN, len(session_id)))
+    if len(uid) > MAX_UID_LEN:
+        raise ValueError("UID must be at most %s characters; got %s" % (MAX_UID_LEN, len(uid)))
+    return (feedback, session_id, int(rank), uid)
+
+def isDataError(e):
+    '''
+    Whether e is a database error about the data of a statement,
+    rather than about the connection or the server.
+    '''
+    return type(e).__name__ in DATA_ERRORS
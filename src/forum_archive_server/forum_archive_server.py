@@ -9,25 +9,61 @@ incoming connections.
 
 '''
 
+import argparse
 import datetime
 import getpass
+import json
 import os
+import signal
 import socket
 import sys
+import time
 import traceback
 import uuid
 import urllib
 
-from pymysql_utils.pymysql_utils import MySQLDB
-from tornado import template
+from archive_snapshot import SnapshotSearchBackend
+from cache_warmup import CacheWarmup, WarmupConnection
+from compression import constantSegment, gzipPieces, resultCompression, splicedPieces
+from db_pool import MySQLConnectionPool, readMySQLPwd
+from feedback_scores import FeedbackScores, RankBlend
+from feedback_store import FeedbackWriter, parseFeedback
+from keyword_index import KeywordIndex
+from log_writer import AsyncLogWriter, FULL_POLICIES, LOG_FORMATS
+from materialized_results import MaterializedResults
+from metrics import MetricsHandler, ServerMetrics
+from paging import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PageCursor, RankedRows
+from query_planner import MATCH_MODES
+from result_cache import LRUCache, RenderedResults, SplicedText, normalizeKeywords, placeholder
+from search_backend import MySQLSearchBackend
+from sqlite_search import SQLiteSearchBackend
+from static_assets import PrecompressedStaticHandler, acceptedEncodings, loadManifest
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen, template
+from tornado.escape import utf8, xhtml_escape
 import tornado;
 from tornado.httpclient import AsyncHTTPClient
-from tornado.web import RequestHandler, asynchronous
+import tornado.httpserver
+import tornado.ioloop
+from tornado.log import enable_pretty_logging
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes, task_id
+from tornado.web import RequestHandler
 
 DEBUG = 1
 
 RESULT_TEMPLATE = template.Loader(os.path.dirname(__file__)).load("responseTemplate.html")
 
+# Style sheet of the result pages; with --static-dir it is
+# linked by its hashed name:
+RESULT_STYLE_SHEET = '/css/forumArchiveStyle.css'
+
+# Parts of a rendered question/answer result that differ
+# between requests; see renderFragment(). The session_id
+# and uid go into the page once, in feedbackFields(), so
+# that the results hold as few gaps as possible:
+FRAGMENT_FIELDS = ['rank']
+
 class ForumArchiveServer(RequestHandler):
 
     # =========================== Constants ==================
@@ -36,7 +72,12 @@ class ForumArchiveServer(RequestHandler):
     LOG_LEVEL_INFO  = 2    
     LOG_LEVEL_DEBUG = 3
 
-    LEGAL_REQUESTS = ['getFaqs', 'demo']
+    LEGAL_REQUESTS = ['getFaqs', 'getFaqsJson', 'demo']
+
+    # Rendered results larger than this are not kept
+    # for the result cache, which bounds per-request
+    # memory when a broad keyword matches many posts:
+    MAX_CACHEABLE_RESULT_BYTES = 2 * 1024 * 1024
     
     RESULT_WEB_PAGE_HEADER = '''
         <!DOCTYPE html>
@@ -48,10 +89,10 @@ class ForumArchiveServer(RequestHandler):
     				      <title>From the Forum Archives</title>
     				      <meta content='Forum Questions and Answers' name='description' />
     				      <meta content='width=device-width, initial-scale=1' name='viewport' />
-    				      <link rel="stylesheet" href="/css/forumArchiveStyle.css" />
+    				      <link rel="stylesheet" href="%s" />
     				    </head>
     				    <body>
-		'''
+		''' % RESULT_STYLE_SHEET
     RESULT_WEB_PAGE_JS_AND_FOOTER = ''' 
         <script type="text/javascript">
           var feedbackForms = document.getElementsByClassName('line-item-feedback')
@@ -62,11 +103,23 @@ class ForumArchiveServer(RequestHandler):
                   var port     = window.location.port;      // 8080
                   var protocol = window.location.protocol;  // http:
                   var pathname = window.location.pathname;  // /serveFaqs
-                  var params   = "?feedback=''&value=" + event.target.value;
+                  // The feedback value is <Not|Partial|Completely>,<session_id>,<rank>,<uid>.
+                  // session_id and uid are set once per page by feedbackFields(),
+                  // the rank is in the data-rank attribute of each form:
+                  var value    = event.target.value + ',' + feedbackSessionId + ',' +
+                                 this.getAttribute('data-rank') + ',' + feedbackUid;
+                  var params   = "?feedback=''&value=" + encodeURIComponent(value);
                                            
                   // alert(protocol + '//' + host + ':' + port + pathname + params);
                   if (typeof event.target.value != 'undefined') {
-                     fetch(protocol + '//' + host + ':' + port + pathname + params)
+                     // The server answers feedback with an empty 204;
+                     // a beacon does not even wait for that:
+                     var url = protocol + '//' + host + ':' + port + pathname + params;
+                     if (navigator.sendBeacon) {
+                        navigator.sendBeacon(url)
+                     } else {
+                        fetch(url)
+                     }
                   }
               }
           }
@@ -115,23 +168,38 @@ class ForumArchiveServer(RequestHandler):
         @type httpServerRequest: HTTPServerRequest
         '''
         super(ForumArchiveServer, self).__init__(tornadoWebAppObj, httpServerRequest)
-        self.loglevel = ForumArchiveServer.LOG_LEVEL_DEBUG
-        #self.loglevel = CourseCSVServer.LOG_LEVEL_INFO
-        #self.loglevel = CourseCSVServer.LOG_LEVEL_NONE
+        # Set by --log-level; one of the LOG_LEVEL_xxx constants:
+        self.loglevel = self.settings.get('log_level', ForumArchiveServer.LOG_LEVEL_DEBUG)
         
         self.testing = False
+        # Requests of the cache warm-up are answered like others,
+        # but are not logged or remembered for feedback:
+        self.warmup = isinstance(httpServerRequest.connection, WarmupConnection)
+        # Warm-up requests are left out of the metrics too. The
+        # req type and any error are counted in on_finish():
+        self.metrics = None if self.warmup else self.settings.get('metrics')
+        self.requestType = 'other'
+        self.failed = False
+        # Seconds spent rendering, and flushing, so far:
+        self.renderSeconds = 0.0
+        self.writeSeconds = 0.0
+        # Only JSON results get an ETag; see compute_etag():
+        self.useEtag = False
     
     #-----------------------
     # get() 
     #---------------
         
-    @asynchronous
+    @gen.coroutine
     def get(self):
         '''
         Called by Tornado when HTTP GET request
         arrives. Arguments part of URL is in 
         self.request.arguments.
 
+        Database work runs in the query_executor thread
+        pool, so the IOLoop keeps serving other requests
+        and static files while a query is in flight.
         '''
         http_client  = AsyncHTTPClient()
         request_dict = self.request.arguments
@@ -141,25 +209,63 @@ class ForumArchiveServer(RequestHandler):
         # page?
         
         if request_dict.get('req', None) is not None:
-            self.serveOneForumRequest(request_dict, http_client)
+            self.requestType = request_dict['req'][0]
+            yield self.serveOneForumRequest(request_dict, http_client)
         elif request_dict.get('feedback', None) is not None:
+            self.requestType = 'feedback'
             self.logFeedback(request_dict)
         else:
             msg = "Bad request: %s" % request_dict
             self.logErr(msg)
             self.writeError(msg)
             
+        finishStart = time.time()
         self.finish()
+        if self.metrics is not None and self.requestType != 'feedback':
+            self.metrics.observeStage('write', self.writeSeconds + time.time() - finishStart)
         http_client.close()    
 
+    #-----------------------
+    # post() 
+    #---------------
+
+    def post(self):
+        '''
+        Called by Tornado when HTTP POST request arrives. 
+        Result pages send feedback with navigator.sendBeacon(),
+        which POSTs to the same URL as the GET they used before.
+        '''
+        request_dict = self.request.arguments
+        if request_dict.get('feedback', None) is not None:
+            self.requestType = 'feedback'
+            self.logFeedback(request_dict)
+        else:
+            msg = "Bad request: %s" % request_dict
+            self.logErr(msg)
+            self.set_status(400)
+
+    #-----------------------
+    # on_finish() 
+    #---------------
+
+    def on_finish(self):
+        '''
+        Called by Tornado once the response is sent.
+        Counts the request, and any error, in the metrics.
+        '''
+        if self.metrics is None:
+            return
+        self.metrics.countRequest(self.requestType)
+        if self.failed or self.get_status() >= 400:
+            self.metrics.countError(self.requestType)
+
     #-----------------------
     # logInfo() 
     #---------------
 
     def logInfo(self, msg):
         if self.loglevel >= ForumArchiveServer.LOG_LEVEL_INFO:
-            sys.stdout.write(str(datetime.datetime.now()) + ' info: ' + msg + '\n')
-            sys.stdout.flush()
+            self.writeLog('info', msg, sys.stdout)
 
     #-----------------------
     # logErr() 
@@ -167,8 +273,7 @@ class ForumArchiveServer(RequestHandler):
 
     def logErr(self, msg):
         if self.loglevel >= ForumArchiveServer.LOG_LEVEL_ERR:
-            sys.stderr.write(str(datetime.datetime.now()) + ' error: ' + msg + '\n')
-            sys.stderr.flush()
+            self.writeLog('error', msg, sys.stderr)
 
     #-----------------------
     # logDebug() 
@@ -176,8 +281,23 @@ class ForumArchiveServer(RequestHandler):
 
     def logDebug(self, msg):
         if self.loglevel >= ForumArchiveServer.LOG_LEVEL_DEBUG:
-            sys.stdout.write(str(datetime.datetime.now()) + ' debug: ' + msg + '\n')
-            sys.stdout.flush()
+            self.writeLog('debug', msg, sys.stdout)
+
+    #-----------------------
+    # writeLog() 
+    #---------------
+
+    def writeLog(self, level, msg, stream):
+        '''
+        Hands msg to the asynchronous log writer, if the 
+        application has one. Else writes it to stream right away.
+        '''
+        log_writer = self.settings.get('log_writer')
+        if log_writer is not None:
+            log_writer.log(level, msg)
+            return
+        stream.write(str(datetime.datetime.now()) + ' ' + level + ': ' + msg + '\n')
+        stream.flush()
 
     #-----------------------
     # logFeedback() 
@@ -192,15 +312,42 @@ class ForumArchiveServer(RequestHandler):
         and answer rank whose survey was clicked. Rank 
         is same as number of entry in viewing order.  
         
+        If the application has a feedback_writer, the feedback
+        is also queued for insertion into the ForumFeedback
+        table. The browser gets an empty 204 response right 
+        away; it does not wait for the insertion.
+        
         @param request_dict: URL argument part
         @type request_dict: dict
         '''
+        try:
+            value = request_dict['value'][0]
+        except (KeyError, IndexError):
+            self.logErr("Feedback without value: %s" % request_dict)
+            self.set_status(400)
+            return
         # The [0] pulls the info in 
         #   ['Partial,040c8977-e040-4b87-bcc0-b899cdcd093c,1']
         # out of the parens to make the log simple:
         
-        self.logInfo("Feedback: %s" % str(request_dict['value'][0]))
+        self.logInfo("Feedback: %s" % str(value))
+
+        feedback_writer = self.settings.get('feedback_writer')
+        feedback_scores = self.settings.get('feedback_scores')
+        if feedback_writer is not None or feedback_scores is not None:
+            try:
+                (feedback, session_id, rank, uid) = parseFeedback(value)
+            except ValueError as e:
+                self.logErr("Feedback not stored: %s" % str(e))
+                self.set_status(400)
+                return
+            if feedback_writer is not None and not feedback_writer.submit(feedback, session_id, rank, uid):
+                self.logErr("Feedback queue full; not stored: %s" % value)
+            if feedback_scores is not None:
+                feedback_scores.recordFeedback(session_id, rank, feedback)
+        self.set_status(204)
         
+    @gen.coroutine
     def serveOneForumRequest(self, request_dict, http_client):
         '''
         Responsible for asychnonously serving the HTTP request
@@ -212,18 +359,6 @@ class ForumArchiveServer(RequestHandler):
         @type http_client: AsyncHTTPClient
         '''
 
-        # Unittests not implemented:
-        if self.testing:
-            self.currUser  = 'unittest'
-            self.defaultDb = 'unittest'
-        else:
-            self.currUser  = getpass.getuser()
-            self.defaultDb = 'ForumArchive'
-
-        self.dbError = 'no error'
-        if self.ensureOpenMySQLDb() is None:
-            self.writeError("Error opening database: '%s'" % self.dbError)
-            return
         # Get the request name:
         try:
             try:
@@ -240,7 +375,7 @@ class ForumArchiveServer(RequestHandler):
                 return   
             
             # What does the student want?
-            if requestName in ['getFaqs', 'demo']:
+            if requestName in ['getFaqs', 'getFaqsJson', 'demo']:
                 # For FAQ entry requests, args is a list of 
                 # keywords:
                 try:
@@ -260,7 +395,33 @@ class ForumArchiveServer(RequestHandler):
                 if len(uid) == 0:
                     self.writeError("Requested getFaqs with empty uid.")
                     return
-                self.handleFaqLookup(keywords, requestName == 'demo', uid[0])
+                # Optional paging arguments:
+                try:
+                    pageSize = int(request_dict['pageSize'][0]) if 'pageSize' in request_dict \
+                        else self.settings.get('page_size', DEFAULT_PAGE_SIZE)
+                except ValueError:
+                    self.writeError("Requested getFaqs with non-integer pageSize.")
+                    return
+                if pageSize < 1 or pageSize > MAX_PAGE_SIZE:
+                    self.writeError("Requested getFaqs with pageSize outside 1..%s." % MAX_PAGE_SIZE)
+                    return
+                try:
+                    after = PageCursor.decode(request_dict['after'][0]) if 'after' in request_dict else None
+                except ValueError as e:
+                    self.writeError("Requested getFaqs with bad 'after' argument: %s" % str(e))
+                    return
+                # Whether results must match any or all keywords:
+                match = request_dict['match'][0] if 'match' in request_dict else 'any'
+                if match not in MATCH_MODES:
+                    self.writeError("Requested getFaqs with match other than one of %s." % MATCH_MODES)
+                    return
+                yield self.handleFaqLookup(keywords, 
+                                           requestName == 'demo', 
+                                           uid[0], 
+                                           pageSize, 
+                                           after, 
+                                           asJson=(requestName == 'getFaqsJson'),
+                                           match=match)
                 return
             else:
                 self.logDebug("Unknown request: %s" % requestName)
@@ -272,41 +433,214 @@ class ForumArchiveServer(RequestHandler):
             elif self.loglevel == ForumArchiveServer.LOG_LEVEL_DEBUG:
                 self.logErr('Error while processing req: %s' % str(traceback.print_exc()))
             self.writeError("%s" % `e`)
-        finally:
-            try:
-                if self.mysqlDb is not None:
-                    self.mysqlDb.close()
-            except Exception as e:
-                self.writeError("Error during MySQL driver close: '%s'" % `e`)
-
-    def handleFaqLookup(self, keywords, isDemo, uid):
-        query = '''SELECT question, answer, question_id
-    				 FROM ForumKeywords LEFT JOIN ForumPosts
-    				 ON question_id = id
-                                 WHERE LOCATE('%s', keyword) > 0
-                     ''' % keywords[0]
-        if len(keywords) > 1:
-            for keyword in keywords[1:]:
-                query += " OR keyword = '%s'" % keyword
-            
-        query += ''' 
-                     ORDER BY answer_type DESC,
-    				          unique_views DESC,
-    				          total_no_upvotes DESC;
-    			'''
+
+    @gen.coroutine
+    def handleFaqLookup(self, keywords, isDemo, uid, pageSize=DEFAULT_PAGE_SIZE, after=None, asJson=False, match='any'):
+        '''
+        Look up, rank, and log the results for one page of a
+        keyword request, and write them either as an HTML
+        page, or as JSON (see writeJsonResults()).
+
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
+        @param isDemo: if True, the session_id is 'demo'
+        @type isDemo: bool
+        @param uid: user ID created by browser or retrieved there from cookie.
+        @type uid: string
+        @param pageSize: maximum number of results to return
+        @type pageSize: int
+        @param after: cursor from the previous page; None for the first page
+        @type after: {PageCursor | None}
+        @param asJson: whether to return JSON instead of HTML
+        @type asJson: bool
+        @param match: whether results must match 'any' or 'all' keywords
+        @type match: str
+        '''
         # Create a unique session ID unless running in demo mode:
         session_id = 'demo' if isDemo else str(uuid.uuid4())    
-        rank = 0
-        results = self.mysqlDb.query(query)
-
-        web_page = self.startResultWebPage(keywords)
-        for result in results:
-            # Format the list of tuples, and send
-            # back to browser. Each result will
-            # be a tuple: (<questionText>,<answerText>,<questionId>)
-            rank += 1
-            web_page = self.addWebResult(web_page, result, keywords, rank, session_id, uid)
-        self.writeResult(web_page)
+        # Ranks continue from the previous page:
+        firstRank = 1 if after is None else after.rank + 1
+        self.response_records = []
+
+        # Rendered results for the same keywords and page are cached
+        # without session_id, uid, and the "More results" link, which
+        # are added below.
+        # With re-ranking, the scores of the first keyword order
+        # the results, so it is part of the key, even though the
+        # order of the keywords does not matter otherwise; and each
+        # epoch of the scores, see FeedbackScores.advanceEpoch(),
+        # starts a new set of cached rankings:
+        result_cache = self.settings.get('result_cache')
+        feedback_scores = self.settings.get('feedback_scores')
+        if result_cache is not None:
+            cacheKey = ('json' if asJson else 'html', 
+                        normalizeKeywords(keywords), 
+                        match,
+                        pageSize, 
+                        None if after is None else after.encode(),
+                        None if feedback_scores is None else (feedback_scores.epoch, keywords[0].lower()))
+            cacheGeneration = result_cache.generation
+            rendered = result_cache.get(cacheKey)
+        else:
+            rendered = None
+
+        if asJson:
+            if rendered is None:
+                rows = self.settings['search_backend'].lookup(keywords, pageSize + 1, after, match)
+                rows.metrics = self.metrics
+                try:
+                    rendered = yield self.renderJsonResults(rows, firstRank, pageSize, after)
+                finally:
+                    rows.close()
+                if result_cache is not None and len(rendered.body) <= ForumArchiveServer.MAX_CACHEABLE_RESULT_BYTES:
+                    self.cacheResults(cacheKey, rendered, cacheGeneration)
+            self.writeJsonResults(rendered, keywords, session_id, uid, firstRank)
+            self.rememberResponses(keywords, session_id)
+            self.observeLookup()
+            return
+
+        if rendered is not None and self.sendsGzipped(len(rendered.body)):
+            # Neither rendered nor compressed again:
+            self.writeGzippedResults(rendered, keywords, session_id, uid, firstRank)
+            self.rememberResponses(keywords, session_id)
+            self.observeLookup()
+            return
+
+        # In streaming mode the page head goes out right away,
+        # and results are flushed every stream_flush_rows rows:
+        flush_rows = self.settings.get('stream_flush_rows', 0)
+        self.write(self.startResultWebPage(keywords))
+        if flush_rows > 0:
+            yield self.timedFlush()
+
+        if rendered is None:
+            # One row beyond the page tells whether there are more;
+            # RankedRows cuts it off:
+            rows = self.settings['search_backend'].lookup(keywords, pageSize + 1, after, match)
+            rows.metrics = self.metrics
+            try:
+                rendered = yield self.writeWebResults(rows, keywords, session_id, uid, flush_rows, firstRank, pageSize, after)
+            finally:
+                rows.close()
+            if result_cache is not None and rendered is not None:
+                self.cacheResults(cacheKey, rendered, cacheGeneration)
+        else:
+            self.addWebResults(rendered, keywords, session_id, uid, firstRank)
+        self.writeResult(session_id, uid)
+        self.rememberResponses(keywords, session_id)
+        self.observeLookup()
+
+    @gen.coroutine
+    def timedFlush(self):
+        '''
+        flush(), adding the time it takes to the write stage.
+        '''
+        startTime = time.time()
+        yield self.flush()
+        self.writeSeconds += time.time() - startTime
+
+    def observeLookup(self):
+        '''
+        Records the render time and the number of results
+        of a completed lookup in the metrics, if any.
+        '''
+        if self.metrics is not None:
+            self.metrics.observeStage('render', self.renderSeconds)
+            self.metrics.observeResults(len(self.response_records))
+
+    def sendsGzipped(self, size):
+        '''
+        Whether a response of about size bytes that is built from
+        cached results is sent gzipped, from their stored deflate
+        segments. That is the case if compression is on, and the
+        browser accepts gzip. As with responses that are compressed
+        as they are written, small ones are not worth it.
+
+        @param size: size of the cached results
+        @type size: int
+        @rtype: bool
+        '''
+        if self.testing or self.settings.get('compress_level', 0) <= 0:
+            return False
+        if size < self.settings.get('compress_min_bytes', 0):
+            return False
+        return 'gzip' in acceptedEncodings(self.request.headers.get('Accept-Encoding', ''))
+
+    def cacheResults(self, cacheKey, rendered, cacheGeneration):
+        '''
+        Puts rendered into the result cache. When compression
+        is on, its deflate segments are computed first, and kept
+        with it, so that cache hits need not compress them. As
+        that takes a while for large results, it runs in a
+        query_executor thread, and the entry appears once it
+        is done; the response does not wait for it.
+
+        @param cacheKey: key of the results
+        @type cacheKey: tuple
+        @param rendered: results about to be cached
+        @type rendered: RenderedResults
+        @param cacheGeneration: result cache generation read
+            before the results were computed
+        @type cacheGeneration: int
+        '''
+        result_cache = self.settings['result_cache']
+        compress_level = self.settings.get('compress_level', 0)
+        if compress_level <= 0:
+            result_cache.put(cacheKey, rendered, len(rendered.body), cacheGeneration)
+            return
+        def deflateAndPut():
+            rendered.body.deflated(compress_level)
+            result_cache.put(cacheKey, rendered, len(rendered.body) + rendered.body.deflatedLength(), cacheGeneration)
+        self.settings['query_executor'].submit(deflateAndPut)
+
+    def writeGzippedResults(self, rendered, keywords, session_id, uid, firstRank=1):
+        '''
+        Writes a complete HTML result page for cached results,
+        gzipped. The page head and footer, and the results, are
+        sent as stored deflate segments; only the title and the
+        per-request fields are compressed here.
+
+        @param rendered: cached results from writeWebResults()
+        @type rendered: RenderedResults
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
+        @param session_id: unique id used in log to know the answers
+                 that were given in response to a single request.
+        @type session_id: string
+        @param uid: user ID created by browser or retrieved there from cookie.
+        @type uid: string
+        @param firstRank: rank of the first result
+        @type firstRank: int
+        '''
+        self.addResponseRecords(rendered.questionIds, keywords, session_id, uid, firstRank)
+        self.logResponseRecords()
+        renderStart = time.time()
+        compress_level = self.settings['compress_level']
+        header = self.settings.get('result_page_header', ForumArchiveServer.RESULT_WEB_PAGE_HEADER)
+        footer = ForumArchiveServer.RESULT_WEB_PAGE_JS_AND_FOOTER
+        pieces = [(header, constantSegment(header, compress_level)),
+                  (utf8(self.resultPageTitle(keywords)), None)]
+        pieces.extend(splicedPieces(rendered.body, compress_level))
+        if rendered.nextPage is not None:
+            pieces.append((utf8(self.renderMoreResultsLink(rendered.nextPage, uid)), None))
+        pieces.append((self.feedbackFields(session_id, uid), None))
+        pieces.append((footer, constantSegment(footer, compress_level)))
+        self.set_header('Content-Encoding', 'gzip')
+        self.write(gzipPieces(pieces, compress_level))
+        self.renderSeconds += time.time() - renderStart
+
+    def rememberResponses(self, keywords, session_id):
+        '''
+        Lets the feedback scores, if any, know which question
+        was shown at which rank, so that feedback on this
+        session can be attributed.
+        '''
+        feedback_scores = self.settings.get('feedback_scores')
+        if feedback_scores is None or session_id == 'demo' or self.warmup:
+            return
+        feedback_scores.rememberResponses(session_id, 
+                                          keywords[0], 
+                                          [(int(record[3]), record[1]) for record in self.response_records])
 
     def startResultWebPage(self, keywords):
         '''
@@ -318,72 +652,347 @@ class ForumArchiveServer(RequestHandler):
         @return: Web page fragment
         @rtype: str
         '''
-        self.response_records = []
-        header = ForumArchiveServer.RESULT_WEB_PAGE_HEADER +\
-            '<div class="title">Keyword(s): %s' % ','.join(keywords) +\
+        return self.settings.get('result_page_header', ForumArchiveServer.RESULT_WEB_PAGE_HEADER) +\
+            self.resultPageTitle(keywords)
+
+    def resultPageTitle(self, keywords):
+        '''
+        The title of a result page, which lists the keywords.
+
+        @param keywords: keywords that led to this result
+        @type keywords: [str]
+        @return: Web page fragment
+        @rtype: str
+        '''
+        title = '<div class="title">Keyword(s): %s' % ','.join(keywords) +\
             '  <div class="feedback_email">' +\
             '    <a href="mailto:ankitab@stanford.edu?subject=Forum%20Archive%20Feedback&cc=paepcke@cs.stanford.edu">' +\
             '       Send Feedback' +\
             '    </a></div>\n' +\
             '</div>\n'
-        return header
+        return title
         
-    def addWebResult(self, web_page, resultTuple, keywords, rank, session_id, uid):
+    @gen.coroutine
+    def writeWebResults(self, rows, keywords, session_id, uid, flush_rows=0, firstRank=1, pageSize=None, after=None):
         '''
         Result tuples are (<questionText>, answerText, questionID).
-        Keywords is an array of keywords that are were requested from
-        the browser. The questionText/answerText are placed in the
-        Tornado Web template, which is then sent to the browser. 
-        The questionID and keywords are used for logging.
+        They are read from rows batch by batch. Keywords is an array
+        of keywords that are were requested from the browser. The
+        questionText/answerText of each result are placed in the
+        Tornado Web template, which is then written to the browser.
+        If flush_rows is positive, the output is flushed every 
+        flush_rows results, so the browser can start painting 
+        before the last result is rendered.
+
+        At most pageSize results are written. If rows holds more,
+        a "More results" link to the next page is added.
+
+        Adds the keyword, qid, rank, and session_id of each result 
+        to the accumulating log string. Does not write it out. 
+        That's done in writeResult()
+
+        Returns the rendered results, without the "More results"
+        link, which repeats this request's arguments, so they can
+        be cached and reused for other requests with the same
+        keywords. Returns None if they exceed
+        MAX_CACHEABLE_RESULT_BYTES.
         
-        Adds the keyword, qid, rank, and session_id to the accumulating
-        log string. Does not write it out. That's done in writeResult()
+        @param rows: Results from query to MySQL, best first
+        @type rows: RowBatches
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
+        @param session_id: unique id used in log to know the answers
+                 that were given in response to a single request.
+        @type session_id: string
+        @param uid: user ID created by browser or retrieved there from cookie.
+        @type uid: string
+        @param flush_rows: number of results between flushes; 0 for none
+        @type flush_rows: int
+        @param firstRank: rank of the first result; greater than 1 for
+                 pages after the first
+        @type firstRank: int
+        @param pageSize: maximum number of results to write; None for all
+        @type pageSize: {int | None}
+        @param after: cursor of the previous page, if any
+        @type after: {PageCursor | None}
+        @return: question IDs in rank order, and the rendered HTML
+        @rtype: {RenderedResults | None}
+        '''
+        # Turn the keywords array and rank integer into strings
+        # to make final log string construction easier
+        # in writeResult(). resultTuple[2] is the question ID:
+        keywords_str = str(keywords)
+        questionIds = []
+        fragments   = []
+        fragmentBytes = 0
+        cacheable   = True
+        page = RankedRows(rows, firstRank, pageSize, after)
+        while True:
+            batch = yield page.nextBatch()
+            if len(batch) == 0:
+                break
+            for (rank, resultTuple) in batch:
+                questionIds.append(resultTuple[2])
+                self.response_records.append([keywords_str, resultTuple[2], session_id, str(rank), uid])
+                if self.testing:
+                    continue
+                renderStart = time.time()
+                fragment = self.renderWebResult(resultTuple, rank)
+                if cacheable:
+                    fragmentBytes += len(fragment)
+                    if fragmentBytes > ForumArchiveServer.MAX_CACHEABLE_RESULT_BYTES:
+                        cacheable = False
+                        fragments = []
+                    else:
+                        fragments.append(fragment)
+                self.write(fragment)
+                self.renderSeconds += time.time() - renderStart
+                if flush_rows > 0 and (rank - firstRank + 1) % flush_rows == 0:
+                    yield self.timedFlush()
+        if page.nextPage is not None and not self.testing:
+            renderStart = time.time()
+            self.write(self.renderMoreResultsLink(page.nextPage, uid))
+            self.renderSeconds += time.time() - renderStart
+        if not cacheable:
+            raise gen.Return(None)
+        raise gen.Return(RenderedResults(questionIds, SplicedText(''.join(fragments), []), page.nextPage))
+
+    def renderWebResult(self, resultTuple, rank):
+        '''
+        HTML for one question/answer result. The question and answer are
+        rendered once per question_id, and kept in the fragment 
+        cache, if there is one; only the rank is filled in here.
         
-        @param web_page: Web page constructed so far
-        @type web_page: str
         @param resultTuple: Result from query to MySQL
         @type resultTuple: (string,string,string)
-        @param keywords: The keyword(s) passed from the browser.
-        @type keywords: [string]
         @param rank: Rank of this result in the session
         @type rank: int
+        @return: web page fragment for one question/answer result
+        @rtype: str 
+        '''
+        fragment_cache = self.settings.get('fragment_cache')
+        question_id = resultTuple[2]
+        fragment = None if fragment_cache is None else fragment_cache.get(question_id)
+        if fragment is None:
+            fragment = renderFragment(resultTuple)
+            if fragment_cache is not None:
+                fragment_cache.put(question_id, fragment, len(fragment))
+        return fragment.fill(rank=str(rank))
+
+    def renderMoreResultsLink(self, nextPage, uid):
+        '''
+        HTML for a link to the next page of results. The link
+        repeats this request's arguments, with the 'after' cursor
+        for the next page. Rendered for every request, since the
+        arguments, such as req, differ between requests whose
+        results are cached under the same key.
+
+        @param nextPage: cursor pointing at the last result on this page
+        @type nextPage: PageCursor
+        @param uid: user ID created by browser or retrieved there from cookie.
+        @type uid: string
+        @return: web page fragment
+        @rtype: str
+        '''
+        args = [(name, values) for (name, values) in sorted(self.request.arguments.items())
+                if name not in ('after', 'uid')]
+        args.append(('after', [nextPage.encode()]))
+        args.append(('uid', [utf8(uid)]))
+        url = '%s?%s' % (self.request.path, urllib.urlencode(args, doseq=True))
+        return '<div class="more_results"><a href="%s">More results</a></div>\n' % xhtml_escape(url)
+
+    def addWebResults(self, rendered, keywords, session_id, uid, firstRank=1):
+        '''
+        Writes previously rendered results, and a "More results"
+        link with this request's arguments, to the browser.
+        Keywords is an array of keywords that are were requested from
+        the browser. The questionIDs and keywords are used for logging.
+        
+        Adds the keyword, qid, rank, and session_id of each result
+        to the accumulating log string. Does not write it out. 
+        That's done in writeResult()
+        
+        @param rendered: results from writeWebResults(), possibly cached
+        @type rendered: RenderedResults
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
         @param session_id: unique id used in log to know the answers
                  that were given in response to a single request.
         @type session_id: string
         @param uid: user ID created by browser or retrieved there from cookie.
         @type uid: string
-        @return: web page fragment with HTML for one question/answer result added
-        @rtype: str 
+        @param firstRank: rank of the first result
+        @type firstRank: int
+        '''
+
+        self.addResponseRecords(rendered.questionIds, keywords, session_id, uid, firstRank)
+        if not self.testing:
+            renderStart = time.time()
+            self.write(rendered.body.fill())
+            if rendered.nextPage is not None:
+                self.write(self.renderMoreResultsLink(rendered.nextPage, uid))
+            self.renderSeconds += time.time() - renderStart
+
+    def addResponseRecords(self, questionIds, keywords, session_id, uid, firstRank=1):
         '''
+        Adds the keyword, qid, rank, and session_id of each result
+        to the accumulating log string. Does not write it out. 
+        That's done in logResponseRecords()
 
+        @param questionIds: question IDs of the results, in rank order
+        @type questionIds: [str]
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
+        @param session_id: unique id used in log to know the answers
+                 that were given in response to a single request.
+        @type session_id: string
+        @param uid: user ID created by browser or retrieved there from cookie.
+        @type uid: string
+        @param firstRank: rank of the first result
+        @type firstRank: int
+        '''
         # Turn the keywords array and rank integer into strings
         # to make final log string construction easier
-        # in writeResult(). resultTuple[2] is the question ID:
-        self.response_records.append([str(keywords), resultTuple[2], session_id, str(rank), uid])
-        
-        if not self.testing:
-            (question, answer) = (resultTuple[0], resultTuple[1])
-            question = "<pre class=\"prettyprint\">" + question + "</pre>"
-            answer = "<pre class=\"prettyprint\">" + answer + "</pre>"
-            web_page += RESULT_TEMPLATE.generate(question=question, 
-                                                 answer=answer,
-                                                 session_id=session_id,
-                                                 rank=rank,
-                                                 uid=uid
-                                                )
-            return web_page
+        # in logResponseRecords():
+        keywords_str = str(keywords)
+        for (rank, question_id) in enumerate(questionIds, firstRank):
+            self.response_records.append([keywords_str, question_id, session_id, str(rank), uid])
+
+    @gen.coroutine
+    def renderJsonResults(self, rows, firstRank=1, pageSize=None, after=None):
+        '''
+        Compact JSON for one page of results:
+
+            {"results": [{"rank": 1, "question_id": "...", 
+                          "question": "...", "answer": "..."}, ...],
+             "next": "<cursor for the 'after' argument>" or null}
+
+        Holds nothing specific to the request, so the text
+        can be cached, and its ETag stays the same until the
+        archive changes.
+
+        @param rows: Results from query to MySQL, best first
+        @type rows: RowBatches
+        @param firstRank: rank of the first result
+        @type firstRank: int
+        @param pageSize: maximum number of results; None for all
+        @type pageSize: {int | None}
+        @param after: cursor of the previous page, if any
+        @type after: {PageCursor | None}
+        @return: question IDs in rank order, and the JSON text
+        @rtype: RenderedResults
+        '''
+        questionIds = []
+        results = []
+        page = RankedRows(rows, firstRank, pageSize, after)
+        while True:
+            batch = yield page.nextBatch()
+            if len(batch) == 0:
+                break
+            renderStart = time.time()
+            for (rank, resultTuple) in batch:
+                questionIds.append(resultTuple[2])
+                results.append({'rank'        : rank,
+                                'question_id' : resultTuple[2],
+                                'question'    : resultTuple[0],
+                                'answer'      : resultTuple[1]
+                                })
+            self.renderSeconds += time.time() - renderStart
+        renderStart = time.time()
+        nextToken = None if page.nextPage is None else page.nextPage.encode()
+        body = json.dumps({'results' : results, 'next' : nextToken}, separators=(',', ':'))
+        self.renderSeconds += time.time() - renderStart
+        # Without gaps, but like HTML results it can keep its
+        # deflate segments:
+        raise gen.Return(RenderedResults(questionIds, SplicedText(body, []), None))
+
+    def writeJsonResults(self, rendered, keywords, session_id, uid, firstRank=1):
+        '''
+        Writes JSON results from renderJsonResults(), and logs
+        them like HTML results. The session_id, which feedback
+        refers to, goes out in the X-Session-Id header, so that
+        the body, and thereby the ETag, is the same for all
+        requests for a page. A client that sends the ETag in
+        If-None-Match gets a 304 response without body. Large
+        results are sent gzipped, from their deflate segments.
+
+        @param rendered: results from renderJsonResults(), possibly cached
+        @type rendered: RenderedResults
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
+        @param session_id: unique id used in log to know the answers
+                 that were given in response to a single request.
+        @type session_id: string
+        @param uid: user ID created by browser or retrieved there from cookie.
+        @type uid: string
+        @param firstRank: rank of the first result
+        @type firstRank: int
+        '''
+        self.addResponseRecords(rendered.questionIds, keywords, session_id, uid, firstRank)
+        self.logResponseRecords()
+        self.useEtag = True
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.set_header('X-Session-Id', session_id)
+        renderStart = time.time()
+        if self.sendsGzipped(len(rendered.body)):
+            compress_level = self.settings['compress_level']
+            self.set_header('Content-Encoding', 'gzip')
+            self.write(gzipPieces(splicedPieces(rendered.body, compress_level), compress_level))
+        else:
+            self.write(rendered.body.fill())
+        self.renderSeconds += time.time() - renderStart
+
+    def compute_etag(self):
+        '''
+        Called by Tornado when finishing a response. HTML result
+        pages differ in every response, because they carry the
+        session_id, so only JSON results get an ETag.
+        '''
+        if not self.useEtag:
+            return None
+        return super(ForumArchiveServer, self).compute_etag()
         
-    def writeResult(self, web_page):
+    def writeResult(self, session_id, uid):
         '''
-        Given a web page fragment with head, and all HTML for
-        each keyword-matching result, add Javascript and closing
-        body/html tags. Write the result back to the browser.
+        Called after the head, and all HTML for each 
+        keyword-matching result were written. Writes the 
+        Javascript and closing body/html tags to the browser.
         
         Also: writes all the responses too the log: keyword, qid, 
         rank, and session_id. 
-        
-        @param web_page: web page fragment
-        @type web_page: str
+
+        @param session_id: session_id of this response
+        @type session_id: string
+        @param uid: user ID created by browser or retrieved there from cookie.
+        @type uid: string
+        '''
+        self.logResponseRecords()
+        self.write(self.feedbackFields(session_id, uid))
+        self.write(ForumArchiveServer.RESULT_WEB_PAGE_JS_AND_FOOTER)
+
+    def feedbackFields(self, session_id, uid):
+        '''
+        Script that sets the session_id and uid, which the
+        feedback forms of a result page send along with the
+        rank of their result.
+
+        @param session_id: session_id of this response
+        @type session_id: string
+        @param uid: user ID created by browser or retrieved there from cookie.
+        @type uid: string
+        @return: Web page fragment
+        @rtype: str
+        '''
+        # json.dumps() makes JavaScript string literals; escaping
+        # '<' keeps them from closing the script element:
+        return '<script type="text/javascript">var feedbackSessionId = %s; var feedbackUid = %s;</script>\n' %\
+            (json.dumps(session_id).replace('<', '\\u003c'),
+             json.dumps(utf8(uid).decode('utf-8', 'replace')).replace('<', '\\u003c'))
+
+    def logResponseRecords(self):
+        '''
+        Writes the response records that addResponseRecords()
+        accumulated to the log.
         '''
         # The self.response_records is an array of arrays:
         #
@@ -394,10 +1003,16 @@ class ForumArchiveServer(RequestHandler):
         #
         # Turn that into: 'foo,bar,fum\n   blue,green,yellow'
 
+        if self.warmup:
+            return
+        log_writer = self.settings.get('log_writer')
+        if log_writer is not None:
+            # The writer thread does the formatting:
+            if self.loglevel >= ForumArchiveServer.LOG_LEVEL_INFO:
+                log_writer.logResponses(self.response_records)
+            return
         response_log_str = '\n   ' + '\n   '.join([','.join(one_record) for one_record in self.response_records])
         self.logInfo(response_log_str)
-        web_page += ForumArchiveServer.RESULT_WEB_PAGE_JS_AND_FOOTER
-        self.write(web_page)
         
     def writeError(self, msg):
         '''
@@ -409,6 +1024,7 @@ class ForumArchiveServer(RequestHandler):
         :type msg: String
         '''
         self.logDebug("Sending err to browser: %s" % msg)
+        self.failed = True
         if not self.testing:
             try:
                 self.write(ForumArchiveServer.ERR_HTML_PAGE % (urllib.quote(msg)) + '\n')
@@ -417,95 +1033,780 @@ class ForumArchiveServer(RequestHandler):
             except IOError as e:
                 self.logErr('IOError while writing error to browser; msg attempted to write; "%s" (%s)' % (msg, `e`))
 
-    def ensureOpenMySQLDb(self):
-        '''
-        Finds MySQL password in ~/.ssh, and opens the MySQL db.
-        '''
-        try:
-            home_dir = os.path.expanduser('~')
-            with open(os.path.join(home_dir, '.ssh/mysql'), 'r') as fd:
-                self.mySQLPwd = fd.readline().strip()
-                self.mysqlDb = MySQLDB(user=self.currUser, passwd=self.mySQLPwd, db=self.defaultDb)
-        except Exception:
-            try:
-                # Try w/o a pwd:
-                self.mySQLPwd = None
-                self.mysqlDb = MySQLDB(user=self.currUser, db=self.defaultDb)
-            except Exception as e:
-                # Remember the error msg for later:
-                self.dbError = `e`;
-                self.mysqlDb = None
-        return self.mysqlDb
-
 #**********
 # class LandingPageServer(tornado.web.RequestHandler):
 #     def get(self):
 #         self.w
 #**********
 
+# ====================================  Utilities ================
+
+def reloadArchive(keyword_index, result_cache, db_pool, query_executor, materialized_results=None, fragment_cache=None,
+                  warmup=None):
+    '''
+    Called after a new archive was loaded into the db, or
+    periodically. Rebuilds the in-memory keyword index, if
+    there is one, and re-checks the freshness of the
+    materialized results, if they are used, in query_executor
+    threads. The result cache is invalidated once each is
+    complete. Lookups keep using the old index content until
+    then.
+
+    @param keyword_index: the index to rebuild, if any
+    @type keyword_index: {KeywordIndex | None}
+    @param result_cache: cache of rendered results, if any
+    @type result_cache: {LRUCache | None}
+    @param db_pool: connection pool
+    @type db_pool: MySQLConnectionPool
+    @param query_executor: thread pool in which to run the load
+    @type query_executor: concurrent.futures.ThreadPoolExecutor
+    @param materialized_results: materialized lookup results to
+        refresh, if any
+    @type materialized_results: {MaterializedResults | None}
+    @param fragment_cache: cache of rendered posts, if any; 
+        invalidated right away, since post bodies may have changed
+    @type fragment_cache: {LRUCache | None}
+    @param warmup: if provided, called on the IOLoop once the
+        caches were invalidated, to fill them again
+    @type warmup: {callable | None}
+    @return: future that resolves to the number of keywords 
+        loaded, or None if there is no index
+    @rtype: {concurrent.futures.Future | None}
+    '''
+    if fragment_cache is not None:
+        fragment_cache.invalidate()
+    # Reloads after which the result cache is invalidated:
+    reloads = []
+    if materialized_results is not None:
+        def reportRefresh(future):
+            if future.exception() is not None:
+                sys.stderr.write('%s error: Could not check materialized results: %s\n' %\
+                                 (datetime.datetime.now(), `future.exception()`))
+            elif not future.result():
+                sys.stderr.write('%s error: Materialized results are stale; using live lookups.\n' %\
+                                 datetime.datetime.now())
+            if result_cache is not None:
+                result_cache.invalidate()
+        refresh = query_executor.submit(db_pool.withConnection, materialized_results.refresh)
+        refresh.add_done_callback(reportRefresh)
+        reloads.append(refresh)
+
+    if keyword_index is None:
+        if result_cache is not None:
+            result_cache.invalidate()
+        future = None
+    else:
+        def reportLoad(future):
+            if future.exception() is not None:
+                sys.stderr.write('%s error: Could not load keyword index: %s\n' %\
+                                 (datetime.datetime.now(), `future.exception()`))
+            else:
+                sys.stdout.write('%s info: Keyword index loaded %s keywords.\n' %\
+                                 (datetime.datetime.now(), future.result()))
+            if result_cache is not None:
+                result_cache.invalidate()
+        future = query_executor.submit(db_pool.withConnection, keyword_index.load)
+        future.add_done_callback(reportLoad)
+        reloads.append(future)
+
+    if warmup is not None:
+        @gen.coroutine
+        def warmAfterReloads():
+            # The IOLoop hears of a reload after its done
+            # callback above ran, i.e. after the invalidation:
+            for reload in reloads:
+                try:
+                    yield reload
+                except Exception:
+                    # Reported by the done callback:
+                    pass
+            yield warmup()
+        tornado.ioloop.IOLoop.current().add_callback(warmAfterReloads)
+    return future
+
+def checkMaterialized(materialized_results, result_cache, db_pool, query_executor):
+    '''
+    Periodic freshness check of the materialized results, in
+    a query_executor thread. Unlike reloadArchive(), only
+    invalidates the result cache if the materialization
+    became stale, or was rebuilt.
+
+    @param materialized_results: materialized lookup results to check
+    @type materialized_results: MaterializedResults
+    @param result_cache: cache of rendered results, if any
+    @type result_cache: {LRUCache | None}
+    @param db_pool: connection pool
+    @type db_pool: MySQLConnectionPool
+    @param query_executor: thread pool in which to run the check
+    @type query_executor: concurrent.futures.ThreadPoolExecutor
+    @return: future that resolves to whether the materialization is fresh
+    @rtype: concurrent.futures.Future
+    '''
+    previousState = materialized_results.state()
+    def reportCheck(future):
+        if future.exception() is not None:
+            sys.stderr.write('%s error: Could not check materialized results: %s\n' %\
+                             (datetime.datetime.now(), `future.exception()`))
+            return
+        if materialized_results.state() == previousState:
+            return
+        if not future.result():
+            sys.stderr.write('%s error: Materialized results are stale; using live lookups.\n' %\
+                             datetime.datetime.now())
+        if result_cache is not None:
+            result_cache.invalidate()
+    future = query_executor.submit(db_pool.withConnection, materialized_results.refresh)
+    future.add_done_callback(reportCheck)
+    return future
+
+def renderFragment(resultTuple):
+    '''
+    Render the template for one question/answer result,
+    with gaps for the fields that differ between requests.
+
+    @param resultTuple: (<questionText>,<answerText>,<questionId>, ...)
+    @type resultTuple: tuple
+    @return: the rendered result, with gaps for FRAGMENT_FIELDS
+    @rtype: SplicedText
+    '''
+    question = "<pre class=\"prettyprint\">" + resultTuple[0] + "</pre>"
+    answer = "<pre class=\"prettyprint\">" + resultTuple[1] + "</pre>"
+    return SplicedText(RESULT_TEMPLATE.generate(question=question, 
+                                                answer=answer,
+                                                rank=placeholder('rank')
+                                                ),
+                       FRAGMENT_FIELDS)
+
+def warmFragmentCache(fragment_cache, search_backend, numPosts):
+    '''
+    Render the numPosts best-ranked posts into the fragment
+    cache. Blocks; run it in a query_executor thread.
+
+    @param fragment_cache: cache of rendered results by question_id
+    @type fragment_cache: LRUCache
+    @param search_backend: source of the posts
+    @type search_backend: SearchBackend
+    @param numPosts: number of posts to render
+    @type numPosts: int
+    @return: number of fragments rendered
+    @rtype: int
+    '''
+    generation = fragment_cache.generation
+    numRendered = 0
+    for resultTuple in search_backend.bestPosts(numPosts):
+        fragment = renderFragment(resultTuple)
+        fragment_cache.put(resultTuple[2], fragment, len(fragment), generation)
+        numRendered += 1
+    return numRendered
+
 # ====================================  Main ================
 
+# Values of --search-backend:
+SEARCH_BACKENDS = ['mysql', 'sqlite', 'snapshot']
+
+# Values of --log-level:
+LOG_LEVELS = {'none'  : ForumArchiveServer.LOG_LEVEL_NONE,
+              'error' : ForumArchiveServer.LOG_LEVEL_ERR,
+              'info'  : ForumArchiveServer.LOG_LEVEL_INFO,
+              'debug' : ForumArchiveServer.LOG_LEVEL_DEBUG
+              }
+
+def makeApplication(db_pool, 
+                    query_executor, 
+                    keyword_index=None, 
+                    result_cache=None, 
+                    stream_flush_rows=0,
+                    row_batch_size=0,
+                    page_size=DEFAULT_PAGE_SIZE,
+                    log_writer=None,
+                    log_level=ForumArchiveServer.LOG_LEVEL_DEBUG,
+                    feedback_writer=None,
+                    feedback_scores=None,
+                    rank_blend=None,
+                    rerank_depth=0,
+                    materialized_results=None,
+                    search_backend=None,
+                    fragment_cache=None,
+                    static_dir=None,
+                    compress_level=0,
+                    compress_min_bytes=1024,
+                    metrics=None):
+    '''
+    Create the Tornado application with its request handlers.
+    FAQ lookups go to search_backend; without one, they go to
+    a MySQLSearchBackend made from the lookup arguments
+    keyword_index, row_batch_size, feedback_scores, rank_blend,
+    rerank_depth, and materialized_results.
+
+    @param db_pool: connection pool shared by all requests
+    @type db_pool: MySQLConnectionPool
+    @param query_executor: bounded thread pool that runs the 
+        blocking MySQL calls off the IOLoop thread
+    @type query_executor: concurrent.futures.ThreadPoolExecutor
+    @param keyword_index: if provided, FAQ lookups are answered
+        from this in-memory index once it is loaded
+    @type keyword_index: {KeywordIndex | None}
+    @param result_cache: if provided, rendered results are
+        cached by normalized keyword list
+    @type result_cache: {LRUCache | None}
+    @param stream_flush_rows: if positive, result pages are streamed:
+        the head is sent before the query runs, and the output is 
+        flushed after every stream_flush_rows results
+    @type stream_flush_rows: int
+    @param row_batch_size: if positive, result rows are read from the
+        db through an unbuffered cursor, row_batch_size rows at a time;
+        else all rows are read before rendering starts
+    @type row_batch_size: int
+    @param page_size: results per page unless a request asks for
+        another pageSize
+    @type page_size: int
+    @param log_writer: if provided, log entries are written by this
+        writer's background thread; else synchronously to stdout/stderr
+    @type log_writer: {AsyncLogWriter | None}
+    @param log_level: one of the ForumArchiveServer.LOG_LEVEL_xxx constants
+    @type log_level: int
+    @param feedback_writer: if provided, feedback is stored in the 
+        ForumFeedback table through this writer
+    @type feedback_writer: {FeedbackWriter | None}
+    @param feedback_scores: if provided, feedback updates these scores,
+        and the best rerank_depth results of each lookup are re-ranked
+        by them
+    @type feedback_scores: {FeedbackScores | None}
+    @param rank_blend: weights for re-ranking; None for the defaults
+    @type rank_blend: {RankBlend | None}
+    @param rerank_depth: number of best results that are re-ranked
+    @type rerank_depth: int
+    @param materialized_results: if provided, single-keyword lookups
+        are answered from the materialized results while they are fresh
+    @type materialized_results: {MaterializedResults | None}
+    @param search_backend: if provided, answers the FAQ lookups
+    @type search_backend: {SearchBackend | None}
+    @param fragment_cache: if provided, the rendered question and
+        answer of each post are cached by question_id
+    @type fragment_cache: {LRUCache | None}
+    @param static_dir: if provided, static files are served from
+        this output of static_assets.py, precompressed and with
+        long-lived caching; else from the source directory
+    @type static_dir: {str | None}
+    @param compress_level: if positive, /serveFaqs responses are
+        gzipped at this zlib level for browsers that accept it, and
+        cached results keep their compressed form
+    @type compress_level: int
+    @param compress_min_bytes: responses written in one piece are
+        only compressed if they have at least this many bytes
+    @type compress_min_bytes: int
+    @param metrics: if provided, requests are measured, and the
+        metrics, with those of the caches and db_pool, are served
+        at /metrics
+    @type metrics: {ServerMetrics | None}
+    @return: the application, ready to listen()
+    @rtype: tornado.web.Application
+    '''
+    if search_backend is None:
+        search_backend = MySQLSearchBackend(db_pool,
+                                            query_executor,
+                                            keyword_index,
+                                            materialized_results,
+                                            row_batch_size,
+                                            feedback_scores,
+                                            rank_blend,
+                                            rerank_depth)
+    if static_dir is None:
+        staticHandler = tornado.web.StaticFileHandler
+        staticDir = '.'
+        resultPageHeader = ForumArchiveServer.RESULT_WEB_PAGE_HEADER
+    else:
+        staticHandler = PrecompressedStaticHandler
+        staticDir = static_dir
+        resultPageHeader = ForumArchiveServer.RESULT_WEB_PAGE_HEADER.replace(
+            RESULT_STYLE_SHEET, loadManifest(static_dir).get(RESULT_STYLE_SHEET, RESULT_STYLE_SHEET))
+    transforms = None
+    if compress_level > 0:
+        transforms = [resultCompression(compress_level, compress_min_bytes)]
+    handlers = [(r"/serveFaqs", ForumArchiveServer)]
+    if metrics is not None:
+        metrics.watchCache('result', result_cache)
+        metrics.watchCache('fragment', fragment_cache)
+        metrics.watchPool(db_pool)
+        handlers.append((r"/metrics", MetricsHandler))
+    handlers.extend([(r"/css/(.*)", staticHandler, {"path": os.path.join(staticDir, 'css')},),
+                     (r"/wordclouds/(.*)", staticHandler, {"path": os.path.join(staticDir, 'wordclouds')},),
+                     (r"/(.*)", staticHandler, 
+                              {"path": staticDir, "default_filename": "index.html"},),
+                     ])
+    return tornado.web.Application(handlers,
+                                   transforms=transforms,
+                                   db_pool=db_pool,
+                                   query_executor=query_executor,
+                                   search_backend=search_backend,
+                                   result_cache=result_cache,
+                                   fragment_cache=fragment_cache,
+                                   stream_flush_rows=stream_flush_rows,
+                                   page_size=page_size,
+                                   log_writer=log_writer,
+                                   log_level=log_level,
+                                   feedback_writer=feedback_writer,
+                                   feedback_scores=feedback_scores,
+                                   result_page_header=resultPageHeader,
+                                   compress_level=compress_level,
+                                   compress_min_bytes=compress_min_bytes,
+                                   metrics=metrics
+                                   )
+
 def main(argv=None):
     '''Command line options.'''
 
     if argv is None:
         argv = sys.argv[1:]
     try:
-
-        # MAIN BODY #
-        application = tornado.web.Application([(r"/serveFaqs", ForumArchiveServer),
-                                               (r"/css/(.*)", tornado.web.StaticFileHandler, {"path": "./css"},),
-                                               (r"/wordclouds/(.*)", tornado.web.StaticFileHandler, {"path": "./wordclouds"},),
-                                               (r"/(.*)", tornado.web.StaticFileHandler, 
-                                                        {"path": "./", "default_filename": "index.html"},),
-                                               ])
-    
-        # To find the SSL certificate location, we assume
-        # that it is stored in dir '.ssl' in the current
-        # user's home dir.
-        # We'll build string up to, and excl. '.crt'/'.key' in (for example):
-        #     "/home/paepcke/.ssl/mono.stanford.edu.crt"
-        # and "/home/paepcke/.ssl/mono.stanford.edu.key"
-        # The home dir and fully qual. domain name
-        # will vary by the machine this code runs on:
-        # We assume the cert and key files are called
-        # <fqdn>.crt and <fqdn>.key:
-    
-        homeDir = os.path.expanduser("~")
-        thisFQDN = socket.getfqdn()
-    
-        ## The ugly commented code below is for SSL operation if ever neccesary.
-        
-        sslRoot = '%s/.ssl/%s' % (homeDir, thisFQDN)
-        #*********
-        # For self signed certificate:
-        #sslRoot = '/home/paepcke/.ssl/server'
-        #*********
-    
-        sslArgsDict = {
-         #******"certfile": sslRoot + '_stanford_edu_cert.cer',
-         "certfile": os.path.join(homeDir, '.ssl/Taffy', 'taffy_stanford_edu_cert.cer'),
-         #******"keyfile":  sslRoot + '.stanford.edu.key',
-         "keyfile":  os.path.join(homeDir, '.ssl/Taffy', 'taffy.stanford.edu.key')
-         }
-    
-        #******http_server = tornado.httpserver.HTTPServer(application,ssl_options=sslArgsDict)
-        http_server = tornado.httpserver.HTTPServer(application) #@UnusedVariable
-    
-        #******application.listen(8080, ssl_options=sslArgsDict)
-        application.listen(8080)
-    
-        sys.stdout.write('Starting ForumArchiveServer.\n')
+        parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                         description='Serve forum archive entries on the Web.')
+        parser.add_argument('--db',
+                            default='ForumArchive',
+                            help='MySQL database holding ForumPosts and ForumKeywords (default: %(default)s)')
+        parser.add_argument('--pool-min',
+                            type=int,
+                            default=2,
+                            help='MySQL connections opened at startup, and kept open (default: %(default)s)')
+        parser.add_argument('--pool-max',
+                            type=int,
+                            default=10,
+                            help='Maximum number of simultaneous MySQL connections (default: %(default)s)')
+        parser.add_argument('--pool-health-check-seconds',
+                            type=float,
+                            default=MySQLConnectionPool.DEFAULT_HEALTH_CHECK_INTERVAL,
+                            help='Pooled MySQL connections idle for longer than this are pinged before use. '
+                                 '0 pings on every checkout, which costs a round trip per request; with larger '
+                                 'values, requests fail on connections that MySQL dropped sooner '
+                                 '(default: %(default)s)')
+        parser.add_argument('--query-threads',
+                            type=int,
+                            default=10,
+                            help='Threads running MySQL queries concurrently (default: %(default)s)')
+        parser.add_argument('--search-backend',
+                            choices=SEARCH_BACKENDS,
+                            default='mysql',
+                            help="Where lookups run: 'mysql' matches ForumKeywords; 'sqlite' searches "
+                                 "the question and answer text in --fulltext-index; 'snapshot' matches "
+                                 "the keywords of the --snapshot file. The latter two need no MySQL "
+                                 "server when used with --no-feedback-table (default: %(default)s)")
+        parser.add_argument('--fulltext-index',
+                            default='forum_archive.sqlite',
+                            help='Full-text index written by sqlite_search.py, for --search-backend sqlite '
+                                 '(default: %(default)s)')
+        parser.add_argument('--snapshot',
+                            default='forum_archive.snap',
+                            help='Archive snapshot written by archive_snapshot.py, for --search-backend '
+                                 'snapshot (default: %(default)s)')
+        parser.add_argument('--keyword-index',
+                            action='store_true',
+                            help='Answer lookups from an in-memory index of ForumKeywords loaded at startup')
+        parser.add_argument('--keyword-index-refresh',
+                            type=float,
+                            default=0,
+                            help='Minutes between keyword index reloads; 0 for none (default: %(default)s)')
+        parser.add_argument('--materialized-results',
+                            action='store_true',
+                            help='Answer single-keyword lookups from the tables built by materialized_results.py')
+        parser.add_argument('--materialized-refresh',
+                            type=float,
+                            default=1,
+                            help='Minutes between checks that the materialized results still match the '
+                                 'archive; stale results make lookups fall back to live queries. Each check '
+                                 'sums the ranking columns of ForumPosts. 0 for none (default: %(default)s)')
+        parser.add_argument('--result-cache-size',
+                            type=int,
+                            default=500,
+                            help='Number of keyword lists whose rendered results are cached; '
+                                 '0 disables the cache (default: %(default)s)')
+        parser.add_argument('--result-cache-ttl',
+                            type=float,
+                            default=3600,
+                            help='Seconds a cached result stays valid (default: %(default)s)')
+        parser.add_argument('--fragment-cache-size',
+                            type=int,
+                            default=5000,
+                            help='Number of rendered question/answer results kept for reuse in any '
+                                 'result page; 0 for none (default: %(default)s)')
+        parser.add_argument('--fragment-cache-mb',
+                            type=float,
+                            default=64,
+                            help='Memory budget of the rendered question/answer results (default: %(default)s)')
+        parser.add_argument('--fragment-cache-warmup',
+                            type=int,
+                            default=0,
+                            help='Number of best-ranked posts rendered into the fragment cache at '
+                                 'startup (default: %(default)s)')
+        parser.add_argument('--warm-wordclouds',
+                            action='store_true',
+                            help='At startup, and after each archive reload, look up all keywords '
+                                 'of the wordcloud maps, so that their results are cached')
+        parser.add_argument('--warmup-concurrency',
+                            type=int,
+                            default=4,
+                            help='Wordcloud keywords looked up at a time while warming up (default: %(default)s)')
+        parser.add_argument('--static-dir',
+                            help='Serve static files from this output of static_assets.py, precompressed '
+                                 'and with long-lived caching; default: from the source directory')
+        parser.add_argument('--compress-level',
+                            type=int,
+                            default=6,
+                            help='Gzip level of /serveFaqs responses, for browsers that accept it; '
+                                 '0 for no compression (default: %(default)s)')
+        parser.add_argument('--compress-min-bytes',
+                            type=int,
+                            default=1024,
+                            help='Smallest response that is compressed, unless streamed (default: %(default)s)')
+        parser.add_argument('--no-metrics',
+                            action='store_true',
+                            help='Do not measure requests, nor serve /metrics')
+        parser.add_argument('--stream-flush-rows',
+                            type=int,
+                            default=10,
+                            help='Stream result pages, flushing after this many results; '
+                                 '0 sends each page in one piece (default: %(default)s)')
+        parser.add_argument('--row-batch-size',
+                            type=int,
+                            default=200,
+                            help='Read result rows through a server-side cursor, this many at a time; '
+                                 '0 reads all rows before rendering (default: %(default)s)')
+        parser.add_argument('--page-size',
+                            type=int,
+                            default=DEFAULT_PAGE_SIZE,
+                            help='Results per page unless a request gives pageSize (default: %(default)s)')
+        parser.add_argument('--log-file',
+                            help='File to which to write the log; default: stdout. With several '
+                                 'workers each writes to <file>.<workerNum>')
+        parser.add_argument('--log-format',
+                            choices=LOG_FORMATS,
+                            default='text',
+                            help='Log line format (default: %(default)s)')
+        parser.add_argument('--log-level',
+                            choices=sorted(LOG_LEVELS.keys()),
+                            default='debug',
+                            help='Least important messages to log (default: %(default)s)')
+        parser.add_argument('--log-max-mb',
+                            type=float,
+                            default=0,
+                            help='Rotate --log-file when it grows beyond this many MB; '
+                                 '0 for never (default: %(default)s)')
+        parser.add_argument('--log-backups',
+                            type=int,
+                            default=5,
+                            help='Number of rotated log files to keep (default: %(default)s)')
+        parser.add_argument('--log-queue-size',
+                            type=int,
+                            default=10000,
+                            help='Log entries that may wait for the disk (default: %(default)s)')
+        parser.add_argument('--log-full-policy',
+                            choices=FULL_POLICIES,
+                            default='drop',
+                            help='When the log queue is full, drop new entries, or make '
+                                 'requests wait up to %s seconds before dropping them. Waiting stalls '
+                                 'the whole server, not just the request (default: %%(default)s)' %\
+                                 AsyncLogWriter.BLOCK_TIMEOUT)
+        parser.add_argument('--log-flush-interval',
+                            type=float,
+                            default=1.0,
+                            help='Maximum seconds before a log entry is flushed (default: %(default)s)')
+        parser.add_argument('--no-feedback-table',
+                            action='store_true',
+                            help='Only log feedback, rather than also storing it in table ForumFeedback')
+        parser.add_argument('--feedback-batch-size',
+                            type=int,
+                            default=200,
+                            help='Maximum feedback rows inserted by one INSERT (default: %(default)s)')
+        parser.add_argument('--feedback-queue-size',
+                            type=int,
+                            default=10000,
+                            help='Feedback clicks that may wait to be inserted (default: %(default)s)')
+        parser.add_argument('--rerank-depth',
+                            type=int,
+                            default=0,
+                            help='Re-rank this many best results of each lookup by the feedback '
+                                 'students gave; 0 for no feedback-aware ranking. Needs --workers 1, '
+                                 'because feedback is matched to the results of sessions in memory '
+                                 '(default: %(default)s)')
+        parser.add_argument('--rank-blend',
+                            default=RankBlend.DEFAULT_SPEC,
+                            help='Weights of the re-ranking components (default: %(default)s)')
+        parser.add_argument('--feedback-scores',
+                            help='Snapshot file of the feedback scores; loaded at startup')
+        parser.add_argument('--feedback-snapshot-minutes',
+                            type=float,
+                            default=5,
+                            help='Minutes between snapshots of the feedback scores (default: %(default)s)')
+        parser.add_argument('--rerank-refresh-seconds',
+                            type=float,
+                            default=30,
+                            help='Seconds after which cached re-ranked results make way for rankings '
+                                 'with the newest feedback (default: %(default)s)')
+        parser.add_argument('--workers',
+                            type=int,
+                            default=1,
+                            help='Number of server processes sharing the listening socket; '
+                                 '0 for one per CPU. Pool and cache sizes are per process (default: %(default)s)')
+        parser.add_argument('--max-restarts',
+                            type=int,
+                            default=100,
+                            help='With several workers: number of times crashed workers are '
+                                 'restarted before the server gives up (default: %(default)s)')
+        args = parser.parse_args(argv)
+        if args.page_size < 1 or args.page_size > MAX_PAGE_SIZE:
+            parser.error('--page-size must be between 1 and %s' % MAX_PAGE_SIZE)
+        if args.workers < 0:
+            parser.error('--workers must not be negative')
+        if args.rerank_depth > 0 and args.workers != 1:
+            # Feedback would mostly reach a worker that did not
+            # serve the session, and could not be attributed:
+            parser.error('--rerank-depth needs --workers 1')
+        if args.search_backend == 'sqlite' and not os.path.exists(args.fulltext_index):
+            parser.error("--fulltext-index: no index at '%s'; create one with sqlite_search.py" % args.fulltext_index)
+        if args.compress_level < 0 or args.compress_level > 9:
+            parser.error('--compress-level must be between 0 and 9')
+        if args.static_dir is not None and not os.path.isdir(args.static_dir):
+            parser.error("--static-dir: no directory '%s'; create it with static_assets.py" % args.static_dir)
+        if args.search_backend == 'snapshot' and not os.path.exists(args.snapshot):
+            parser.error("--snapshot: no snapshot at '%s'; create one with archive_snapshot.py" % args.snapshot)
         try:
-            tornado.ioloop.IOLoop.instance().start()
-        except Exception as e:
-            print("Error inside Tornado ioloop; continuing: %s" % `e`)
-                
+            RankBlend(args.rank_blend)
+        except ValueError as e:
+            parser.error('--rank-blend: %s' % str(e))
+
+        # Bind before forking, so that all workers accept
+        # connections on the same socket:
+        sockets = bind_sockets(8080)
+        if args.workers != 1:
+            # The parent process only supervises. Reloading the
+            # archive is done by each worker on its own, when 
+            # kill -HUP is sent to the whole process group:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            # Worker exits and restarts are reported through
+            # Tornado's logger:
+            enable_pretty_logging()
+            # Returns only in the workers. The parent waits
+            # for workers to exit, and starts a new worker
+            # for each one that dies with an error:
+            fork_processes(args.workers, max_restarts=args.max_restarts)
+        serve(args, sockets)
     
     except Exception, e:
         sys.stderr.write('Could not start ForumArchiveServer.')
         return 2
 
+def serve(args, sockets):
+    '''
+    Run one server process until its IOLoop stops. With
+    several workers this runs after the fork, so that each
+    worker has its own MySQL connections, thread pool, 
+    keyword index, result cache, and IOLoop.
+
+    @param args: parsed command line options
+    @type args: argparse.Namespace
+    @param sockets: listening sockets from bind_sockets()
+    @type sockets: [socket.socket]
+    '''
+    # Log entries are written by a background thread:
+    workerId = task_id()
+    logPath = args.log_file
+    if logPath is not None and workerId is not None:
+        logPath = '%s.%s' % (logPath, workerId)
+    log_writer = AsyncLogWriter(path=logPath,
+                                logFormat=args.log_format,
+                                maxQueueSize=args.log_queue_size,
+                                flushInterval=args.log_flush_interval,
+                                maxFileBytes=int(args.log_max_mb * 1024 * 1024) if args.log_max_mb > 0 else None,
+                                backupCount=args.log_backups,
+                                fullPolicy=args.log_full_policy)
+
+    # Each worker serves its own metrics:
+    if args.no_metrics:
+        metrics = None
+    else:
+        metrics = ServerMetrics(None if workerId is None else {'worker' : str(workerId)})
+
+    # Read the MySQL pwd once, rather than on every request,
+    # and create the connection pool shared by all requests:
+    db_pool = MySQLConnectionPool(user=getpass.getuser(),
+                                  passwd=readMySQLPwd(),
+                                  db=args.db,
+                                  minSize=args.pool_min,
+                                  maxSize=args.pool_max,
+                                  healthCheckInterval=args.pool_health_check_seconds,
+                                  metrics=metrics)
+    try:
+        if args.search_backend == 'mysql' or not args.no_feedback_table:
+            db_pool.fill()
+    except Exception as e:
+        # Connections will be opened on demand
+        # once the db is reachable:
+        sys.stderr.write('Could not pre-open MySQL connections: %s\n' % `e`)
+
+    query_executor = ThreadPoolExecutor(max_workers=args.query_threads)
+
+    if args.rerank_depth > 0:
+        scoresPath = args.feedback_scores
+        feedback_scores = FeedbackScores(scoresPath)
+        try:
+            feedback_scores.load()
+        except Exception as e:
+            sys.stderr.write('Could not load feedback scores from %s: %s\n' % (scoresPath, `e`))
+        if args.feedback_snapshot_minutes > 0:
+            tornado.ioloop.PeriodicCallback(lambda: query_executor.submit(feedback_scores.snapshot),
+                                            args.feedback_snapshot_minutes * 60 * 1000).start()
+        if args.rerank_refresh_seconds > 0:
+            # Cheap; runs on the IOLoop:
+            tornado.ioloop.PeriodicCallback(feedback_scores.advanceEpoch,
+                                            args.rerank_refresh_seconds * 1000).start()
+    else:
+        feedback_scores = None
+
+    if args.no_feedback_table:
+        feedback_writer = None
+    else:
+        feedback_writer = FeedbackWriter(db_pool,
+                                         maxQueueSize=args.feedback_queue_size,
+                                         batchSize=args.feedback_batch_size)
+
+    # Lookups of the other backends need no MySQL; the keyword
+    # index and the materialized results only serve MySQL lookups:
+    if args.search_backend == 'sqlite':
+        search_backend = SQLiteSearchBackend(args.fulltext_index, query_executor)
+    elif args.search_backend == 'snapshot':
+        # Mapped after the fork; the workers share the
+        # snapshot's pages in the page cache:
+        search_backend = SnapshotSearchBackend(args.snapshot, query_executor)
+    else:
+        search_backend = None
+    keyword_index = KeywordIndex() if args.keyword_index and search_backend is None else None
+    if args.result_cache_size > 0:
+        result_cache = LRUCache(maxEntries=args.result_cache_size, ttl=args.result_cache_ttl)
+    else:
+        result_cache = None
+    if args.fragment_cache_size > 0:
+        fragment_cache = LRUCache(maxEntries=args.fragment_cache_size, 
+                                  ttl=None, 
+                                  maxBytes=int(args.fragment_cache_mb * 1024 * 1024))
+    else:
+        fragment_cache = None
+    materialized_results = MaterializedResults() if args.materialized_results and search_backend is None else None
+
+    application = makeApplication(db_pool, 
+                                  query_executor, 
+                                  keyword_index, 
+                                  result_cache, 
+                                  args.stream_flush_rows,
+                                  args.row_batch_size,
+                                  args.page_size,
+                                  log_writer,
+                                  LOG_LEVELS[args.log_level],
+                                  feedback_writer,
+                                  feedback_scores,
+                                  RankBlend(args.rank_blend),
+                                  args.rerank_depth,
+                                  materialized_results,
+                                  search_backend,
+                                  fragment_cache,
+                                  args.static_dir,
+                                  args.compress_level,
+                                  args.compress_min_bytes,
+                                  metrics)
+
+    # The wordcloud keywords are looked up once the reloads
+    # below are complete, since these invalidate the cache:
+    if args.warm_wordclouds:
+        warmup = CacheWarmup(application, query_executor, concurrency=args.warmup_concurrency).warm
+    else:
+        warmup = None
+    if keyword_index is not None or materialized_results is not None or warmup is not None:
+        reloadArchive(keyword_index, result_cache, db_pool, query_executor, materialized_results, warmup=warmup)
+    if keyword_index is not None and args.keyword_index_refresh > 0:
+        tornado.ioloop.PeriodicCallback(lambda: reloadArchive(keyword_index, result_cache, db_pool, query_executor,
+                                                              warmup=warmup),
+                                        args.keyword_index_refresh * 60 * 1000).start()
+    if materialized_results is not None and args.materialized_refresh > 0:
+        tornado.ioloop.PeriodicCallback(lambda: checkMaterialized(materialized_results, result_cache,
+                                                                  db_pool, query_executor),
+                                        args.materialized_refresh * 60 * 1000).start()
+    # kill -HUP after loading a new archive reloads the
+    # keyword index, re-checks the materialized results, 
+    # invalidates the result and fragment caches, and warms
+    # them up again:
+    signal.signal(signal.SIGHUP, lambda signum, frame: 
+                  tornado.ioloop.IOLoop.instance().add_callback_from_signal(reloadArchive, 
+                                                                            keyword_index,
+                                                                            result_cache,
+                                                                            db_pool, 
+                                                                            query_executor,
+                                                                            materialized_results,
+                                                                            fragment_cache,
+                                                                            warmup))
+
+    if fragment_cache is not None and args.fragment_cache_warmup > 0:
+        def reportWarmup(future):
+            if future.exception() is not None:
+                sys.stderr.write('%s error: Could not warm up fragment cache: %s\n' %\
+                                 (datetime.datetime.now(), `future.exception()`))
+            else:
+                sys.stdout.write('%s info: Fragment cache warmed up with %s posts.\n' %\
+                                 (datetime.datetime.now(), future.result()))
+        query_executor.submit(warmFragmentCache, 
+                              fragment_cache, 
+                              application.settings['search_backend'], 
+                              args.fragment_cache_warmup).add_done_callback(reportWarmup)
+
+    # To find the SSL certificate location, we assume
+    # that it is stored in dir '.ssl' in the current
+    # user's home dir.
+    # We'll build string up to, and excl. '.crt'/'.key' in (for example):
+    #     "/home/paepcke/.ssl/mono.stanford.edu.crt"
+    # and "/home/paepcke/.ssl/mono.stanford.edu.key"
+    # The home dir and fully qual. domain name
+    # will vary by the machine this code runs on:
+    # We assume the cert and key files are called
+    # <fqdn>.crt and <fqdn>.key:
+
+    homeDir = os.path.expanduser("~")
+    thisFQDN = socket.getfqdn()
+
+    ## The ugly commented code below is for SSL operation if ever neccesary.
+    
+    sslRoot = '%s/.ssl/%s' % (homeDir, thisFQDN)
+    #*********
+    # For self signed certificate:
+    #sslRoot = '/home/paepcke/.ssl/server'
+    #*********
+
+    sslArgsDict = {
+     #******"certfile": sslRoot + '_stanford_edu_cert.cer',
+     "certfile": os.path.join(homeDir, '.ssl/Taffy', 'taffy_stanford_edu_cert.cer'),
+     #******"keyfile":  sslRoot + '.stanford.edu.key',
+     "keyfile":  os.path.join(homeDir, '.ssl/Taffy', 'taffy.stanford.edu.key')
+     }
+
+    #******http_server = tornado.httpserver.HTTPServer(application,ssl_options=sslArgsDict)
+    http_server = tornado.httpserver.HTTPServer(application)
+    http_server.add_sockets(sockets)
+
+    if workerId is None:
+        sys.stdout.write('Starting ForumArchiveServer.\n')
+    else:
+        sys.stdout.write('Starting ForumArchiveServer worker %s (pid %s).\n' % (workerId, os.getpid()))
+    sys.stdout.flush()
+    try:
+        tornado.ioloop.IOLoop.instance().start()
+    except Exception as e:
+        print("Error inside Tornado ioloop; continuing: %s" % `e`)
+    finally:
+        query_executor.shutdown(wait=False)
+        if feedback_writer is not None:
+            feedback_writer.close()
+        if feedback_scores is not None:
+            feedback_scores.snapshot()
+        application.settings['search_backend'].close()
+        db_pool.close()
+        log_writer.close()
+
 
 if __name__ == "__main__":
 
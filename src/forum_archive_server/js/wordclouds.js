@@ -44,6 +44,14 @@ function cloudClick(area) {
   var linkTarget = area.href
   area.setAttribute("href", linkTarget + "&uid=" + uid);
 }
+
+// Pages of wordcloud_build.py listen on the map,
+// rather than on each of its areas:
+function mapClick(event) {
+  if (event.target.tagName == "AREA") {
+    cloudClick(event.target);
+  }
+}
                                  
 
 var uid   = checkCookie("uid");
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+In-memory inverted index from ForumKeywords keywords to
+the question_ids of the ForumPosts they were extracted from.
+Loaded once from MySQL, then answers FAQ lookups without
+scanning ForumKeywords. Only the question/answer bodies
+still come from the db, fetched by primary key.
+
+Each keyword's postings list is pre-sorted by the same
+order the SQL lookup uses:
+
+    answer_type DESC, unique_views DESC, total_no_upvotes DESC, question_id
+
+so results are produced by merging the already sorted lists,
+as query_planner.rankCandidates() describes.
+
+@author:     Andreas Paepcke
+
+'''
+
+import heapq
+import threading
+
+from ngram_index import SubstringIndex
+from query_planner import planTerms, rankCandidates
+
+
+class KeywordIndex(object):
+
+    # =========================== Constants ==================
+
+    LOAD_QUERY = '''SELECT keyword, question_id, answer_type, unique_views, total_no_upvotes
+                      FROM ForumKeywords JOIN ForumPosts
+                        ON question_id = id
+                 '''
+
+    # Number of question_ids per primary key lookup
+    # of question/answer bodies:
+    FETCH_CHUNK_SIZE = 500
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self):
+        # keyword --> [(sortKey, question_id)], sorted:
+        self.postings = {}
+        # Resolves substrings to keywords of the vocabulary:
+        self.substringIndex = SubstringIndex([])
+        self.loaded = False
+        # Serializes concurrent reloads; lookups never block,
+        # because load() swaps in complete new structures:
+        self.loadLock = threading.Lock()
+
+    #-----------------------
+    # load
+    #---------------
+
+    def load(self, mysqlDb):
+        '''
+        (Re)build the index from ForumKeywords and ForumPosts.
+        Safe to call while lookups are served from the old
+        index content: the new postings replace the old ones
+        in a single assignment when complete.
+
+        @param mysqlDb: open connection
+        @type mysqlDb: MySQLDB
+        @return: number of distinct keywords loaded
+        @rtype: int
+        '''
+        with self.loadLock:
+            postings = {}
+            for (keyword, question_id, answer_type, unique_views, total_no_upvotes) in mysqlDb.query(KeywordIndex.LOAD_QUERY):
+                sortKey = (descending(answer_type), descending(unique_views), descending(total_no_upvotes))
+                postings.setdefault(keyword, []).append((sortKey, question_id))
+            for postingsList in postings.values():
+                postingsList.sort()
+            self.setPostings(postings)
+            self.loaded = True
+            return len(postings)
+
+    #-----------------------
+    # setPostings
+    #---------------
+
+    def setPostings(self, postings):
+        '''
+        Install a complete keyword-to-postings dict.
+
+        @param postings: keyword --> sorted [(sortKey, question_id)]
+        @type postings: {str : [(tuple, str)]}
+        '''
+        # Assign the vocabulary first: a lookup that catches
+        # old postings and new vocabulary just finds fewer
+        # postings for keywords that are new:
+        self.substringIndex = SubstringIndex(postings.keys())
+        self.postings = postings
+
+    #-----------------------
+    # isLoaded
+    #---------------
+
+    def isLoaded(self):
+        return self.loaded
+
+    #-----------------------
+    # termPostings
+    #---------------
+
+    def termPostings(self, terms):
+        '''
+        Postings of each term of a request: the merged, sorted
+        postings of all index keywords that contain the term,
+        ignoring case, as LOCATE does in MySQL's default
+        collations.
+
+        @param terms: terms from query_planner.planTerms()
+        @type terms: [str]
+        @return: per term, its (sortKey, question_id) pairs in rank order
+        @rtype: [iterable]
+        '''
+        postings = self.postings
+        substringIndex = self.substringIndex
+        return [heapq.merge(*[postings[keyword] for keyword in substringIndex.matches(term) if keyword in postings])
+                for term in terms]
+
+    #-----------------------
+    # plan
+    #---------------
+
+    def plan(self, keywords, match='any', withCounts=False):
+        '''
+        The (sortKey, question_id) pairs of the posts matching
+        the keywords, once per post, in the order of 
+        query_planner.rankCandidates(); with withCounts, paired
+        with the number of terms each post matches.
+        '''
+        return rankCandidates(self.termPostings(planTerms(keywords)), match, withCounts)
+
+    #-----------------------
+    # lookup
+    #---------------
+
+    def lookup(self, keywords, match='any'):
+        '''
+        Return question_ids of posts matching the keywords,
+        best first; see query_planner.py.
+
+        @param keywords: keywords from the request
+        @type keywords: [str]
+        @param match: 'any' or 'all' of the keywords
+        @type match: str
+        @return: question_ids in rank order
+        @rtype: [str]
+        '''
+        return [question_id for (_sortKey, question_id) in self.plan(keywords, match)]
+
+    #-----------------------
+    # lookupWithColumns
+    #---------------
+
+    def lookupWithColumns(self, keywords, match='any'):
+        '''
+        Like lookup(), but with the ranking columns of each
+        question, and the number of terms it matches, for
+        re-ranking.
+
+        @param keywords: keywords from the request
+        @type keywords: [str]
+        @param match: 'any' or 'all' of the keywords
+        @type match: str
+        @return: (question_id, answer_type, unique_views, total_no_upvotes,
+            numMatched) tuples in rank order
+        @rtype: [(str, int, int, int, int)]
+        '''
+        return [(question_id, ascending(answer_type), ascending(unique_views), ascending(total_no_upvotes), numMatched)
+                for (numMatched, ((answer_type, unique_views, total_no_upvotes), question_id))
+                in self.plan(keywords, match, withCounts=True)]
+
+    #-----------------------
+    # fetchPosts
+    #---------------
+
+    def fetchPosts(self, mysqlDb, questionIds):
+        '''
+        Fetch question and answer texts by primary key.
+
+        @param mysqlDb: open connection
+        @type mysqlDb: MySQLDB
+        @param questionIds: question_ids in rank order, possibly repeated
+        @type questionIds: [str]
+        @return: (question, answer, question_id) tuples in the
+            order of questionIds
+        @rtype: [(str,str,str)]
+        '''
+        distinctIds = list(set(questionIds))
+        bodies = {}
+        cursor = mysqlDb.connection.cursor()
+        try:
+            for start in range(0, len(distinctIds), KeywordIndex.FETCH_CHUNK_SIZE):
+                chunk = distinctIds[start:start + KeywordIndex.FETCH_CHUNK_SIZE]
+                cursor.execute('SELECT id, question, answer FROM ForumPosts WHERE id IN (%s)' %\
+                               ','.join(['%s'] * len(chunk)),
+                               chunk)
+                for (question_id, question, answer) in cursor.fetchall():
+                    bodies[question_id] = (question, answer, question_id)
+        finally:
+            cursor.close()
+        return [bodies[question_id] for question_id in questionIds if question_id in bodies]
+
+# ====================================  Utilities ================
+
+def descending(value):
+    '''
+    Sort key component that orders numbers largest first,
+    and NULLs last, as MySQL does for ORDER BY ... DESC.
+    '''
+    if value is None:
+        return (1, 0)
+    return (0, -value)
+
+def ascending(sortKeyComponent):
+    '''
+    Inverse of descending(): the column value; None for NULL.
+    '''
+    if sortKeyComponent[0] == 1:
+        return None
+    return -sortKeyComponent[1]
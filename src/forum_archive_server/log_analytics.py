@@ -0,0 +1,486 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Usage statistics from forum archive server logs. Reads
+the logs line by line, so memory does not grow with the
+size of the logs; only with the number of distinct keywords
+and questions, and the sessions in the join window.
+
+Feedback clicks are joined to the response records they
+refer to by session_id and rank. Response records are
+remembered for the most recent --session-window sessions;
+feedback on older sessions counts as unmatched.
+
+Understands both log formats of log_writer.py, and the
+header lines of the start script:
+
+    text:  <time> info:
+              <keywords>,<question_id>,<session_id>,<rank>,<uid>
+              ...
+           <time> info: Feedback: <Not|Partial|Completely>,<session_id>,<rank>,<uid>
+    json:  {"type": "response", "keywords": [...], "question_id": ..., ...}
+           {"type": "message", "message": "Feedback: ...", ...}
+
+Writes three tables to the output directory, as CSV, or
+as Parquet files if pyarrow is installed:
+
+    keywords   one row per keyword list: requests, results shown,
+               and feedback counts
+    questions  one row per question: times shown, mean rank, and
+               feedback counts
+    ranks      one row per rank: results shown and feedback counts
+
+Several log files are read in parallel by a process pool.
+Feedback that a file's own responses do not explain is
+matched against the most recent sessions of all files,
+which covers sessions that straddle a log rotation. Only
+the --carry-window most recent sessions, and earliest
+unmatched clicks, of each file take part in that; later
+unmatched clicks are counted as unmatched right away.
+
+@author:     Andreas Paepcke
+
+'''
+
+import argparse
+from collections import OrderedDict
+import csv
+import gzip
+import json
+import multiprocessing
+import os
+import sys
+
+from feedback_store import FEEDBACK_VALUES, parseFeedback
+from log_writer import parseKeywords
+
+
+FEEDBACK_PREFIX = 'Feedback: '
+
+# Sessions, and unmatched feedback clicks, per log file
+# that are joined across files:
+DEFAULT_CARRY_WINDOW = 1000
+
+class UsageStats(object):
+    '''
+    Counters accumulated from one or more logs. Instances
+    from different processes are combined with merge().
+    '''
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self):
+        # keywords --> [requests, impressions, feedbackRankSum, <count per FEEDBACK_VALUES>]
+        self.keywords = {}
+        # question_id --> [impressions, rankSum, <count per FEEDBACK_VALUES>]
+        self.questions = {}
+        # rank --> [impressions, <count per FEEDBACK_VALUES>]
+        self.ranks = {}
+        self.numFeedback = 0
+        self.numUnmatchedFeedback = 0
+        self.numBadLines = 0
+
+    #-----------------------
+    # addRequest
+    #---------------
+
+    def addRequest(self, keywords):
+        self.keywordCounts(keywords)[0] += 1
+
+    #-----------------------
+    # addResponse
+    #---------------
+
+    def addResponse(self, keywords, question_id, rank):
+        self.keywordCounts(keywords)[1] += 1
+        questionCounts = self.questions.setdefault(question_id, [0, 0] + [0] * len(FEEDBACK_VALUES))
+        questionCounts[0] += 1
+        questionCounts[1] += rank
+        self.ranks.setdefault(rank, [0] + [0] * len(FEEDBACK_VALUES))[0] += 1
+
+    #-----------------------
+    # addFeedback
+    #---------------
+
+    def addFeedback(self, feedback, keywords, question_id, rank):
+        '''
+        Count feedback that was joined to its response.
+        '''
+        valueIndex = FEEDBACK_VALUES.index(feedback)
+        self.numFeedback += 1
+        keywordCounts = self.keywordCounts(keywords)
+        keywordCounts[2] += rank
+        keywordCounts[3 + valueIndex] += 1
+        self.questions.setdefault(question_id, [0, 0] + [0] * len(FEEDBACK_VALUES))[2 + valueIndex] += 1
+        self.ranks.setdefault(rank, [0] + [0] * len(FEEDBACK_VALUES))[1 + valueIndex] += 1
+
+    #-----------------------
+    # keywordCounts
+    #---------------
+
+    def keywordCounts(self, keywords):
+        return self.keywords.setdefault(keywords, [0, 0, 0] + [0] * len(FEEDBACK_VALUES))
+
+    #-----------------------
+    # merge
+    #---------------
+
+    def merge(self, other):
+        '''
+        Add the counts of other to this instance.
+        '''
+        for (mine, theirs) in ((self.keywords, other.keywords),
+                               (self.questions, other.questions),
+                               (self.ranks, other.ranks)):
+            for (key, counts) in theirs.items():
+                if key in mine:
+                    mine[key] = [a + b for (a, b) in zip(mine[key], counts)]
+                else:
+                    mine[key] = list(counts)
+        self.numFeedback += other.numFeedback
+        self.numUnmatchedFeedback += other.numUnmatchedFeedback
+        self.numBadLines += other.numBadLines
+
+    #-----------------------
+    # tables
+    #---------------
+
+    def tables(self):
+        '''
+        The statistics as tables.
+
+        @return: table name --> (column names, rows)
+        @rtype: {str : ([str], [list])}
+        '''
+        feedbackColumns = [value.lower() for value in FEEDBACK_VALUES]
+        keywordRows = []
+        for (keywords, counts) in sorted(self.keywords.items()):
+            numFeedback = sum(counts[3:])
+            keywordRows.append([keywords, counts[0], counts[1], numFeedback] + counts[3:] +
+                               [meanOf(counts[2], numFeedback)])
+        questionRows = []
+        for (question_id, counts) in sorted(self.questions.items()):
+            questionRows.append([question_id, counts[0], meanOf(counts[1], counts[0]), sum(counts[2:])] + counts[2:])
+        rankRows = []
+        for (rank, counts) in sorted(self.ranks.items()):
+            numFeedback = sum(counts[1:])
+            rankRows.append([rank, counts[0], numFeedback] + counts[1:] + [meanOf(numFeedback, counts[0])])
+        return {'keywords'  : (['keywords', 'requests', 'impressions', 'feedback'] + feedbackColumns +
+                               ['mean_feedback_rank'],
+                               keywordRows),
+                'questions' : (['question_id', 'impressions', 'mean_rank', 'feedback'] + feedbackColumns,
+                               questionRows),
+                'ranks'     : (['rank', 'impressions', 'feedback'] + feedbackColumns + ['feedback_rate'],
+                               rankRows)
+                }
+
+class LogReader(object):
+    '''
+    Reads one log, and joins its feedback to its responses.
+    '''
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, sessionWindow=100000, maxUnmatched=None):
+        '''
+        @param sessionWindow: number of most recent sessions whose
+            response records are kept for joining feedback
+        @type sessionWindow: int
+        @param maxUnmatched: number of feedback clicks without a known
+            session that are kept in self.unmatched; further ones are
+            only counted in stats.numUnmatchedFeedback. None keeps all.
+        @type maxUnmatched: {int | None}
+        '''
+        self.sessionWindow = sessionWindow
+        self.maxUnmatched = maxUnmatched
+        self.stats = UsageStats()
+        # session_id --> {rank : (keywords, question_id)}, oldest first:
+        self.sessions = OrderedDict()
+        # Earliest feedback whose session is not in self.sessions:
+        self.unmatched = []
+
+    #-----------------------
+    # readFile
+    #---------------
+
+    def readFile(self, path):
+        '''
+        Read one log file; gzipped if its name ends with .gz.
+        '''
+        logFile = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'r')
+        try:
+            self.readLines(logFile)
+        finally:
+            logFile.close()
+
+    #-----------------------
+    # readLines
+    #---------------
+
+    def readLines(self, lines):
+        # True while reading the response records of a text log entry:
+        inResponseBlock = False
+        for line in lines:
+            line = line.rstrip('\r\n')
+            if line.startswith('{'):
+                inResponseBlock = False
+                self.readJsonLine(line)
+            elif line.startswith('   ') and inResponseBlock:
+                self.readResponseRecord(line.strip())
+            else:
+                (_timestamp, _sep, msg) = line.partition(' info: ')
+                inResponseBlock = len(_sep) > 0 and len(msg.strip()) == 0
+                if len(_sep) > 0 and msg.startswith(FEEDBACK_PREFIX):
+                    self.readFeedback(msg[len(FEEDBACK_PREFIX):])
+
+    #-----------------------
+    # readJsonLine
+    #---------------
+
+    def readJsonLine(self, line):
+        try:
+            record = json.loads(line)
+            if record.get('type') == 'response':
+                self.addResponse(','.join(record['keywords']),
+                                 str(record['question_id']),
+                                 record['session_id'],
+                                 int(record['rank']))
+            elif record.get('message', '').startswith(FEEDBACK_PREFIX):
+                self.readFeedback(record['message'][len(FEEDBACK_PREFIX):])
+        except (ValueError, KeyError, TypeError):
+            self.stats.numBadLines += 1
+
+    #-----------------------
+    # readResponseRecord
+    #---------------
+
+    def readResponseRecord(self, record):
+        '''
+        Parse <keywords>,<question_id>,<session_id>,<rank>,<uid>.
+        The keywords contain commas, so the record is split from
+        the right.
+        '''
+        try:
+            (keywords_str, question_id, session_id, rank, _uid) = record.rsplit(',', 4)
+            self.addResponse(','.join(parseKeywords(keywords_str)), question_id, session_id, int(rank))
+        except ValueError:
+            self.stats.numBadLines += 1
+
+    #-----------------------
+    # readFeedback
+    #---------------
+
+    def readFeedback(self, value):
+        try:
+            (feedback, session_id, rank, _uid) = parseFeedback(value)
+        except ValueError:
+            # Early logs have no uid:
+            try:
+                (feedback, session_id, rank, _uid) = parseFeedback(value + ',')
+            except ValueError:
+                self.stats.numBadLines += 1
+                return
+        self.addFeedback(feedback, session_id, rank)
+
+    #-----------------------
+    # addResponse
+    #---------------
+
+    def addResponse(self, keywords, question_id, session_id, rank):
+        responses = self.sessions.get(session_id)
+        if responses is None:
+            self.stats.addRequest(keywords)
+            responses = self.sessions[session_id] = {}
+            if len(self.sessions) > self.sessionWindow:
+                self.sessions.popitem(last=False)
+        responses[rank] = (keywords, question_id)
+        self.stats.addResponse(keywords, question_id, rank)
+
+    #-----------------------
+    # addFeedback
+    #---------------
+
+    def addFeedback(self, feedback, session_id, rank):
+        response = self.sessions.get(session_id, {}).get(rank)
+        if response is None:
+            if self.maxUnmatched is not None and len(self.unmatched) >= self.maxUnmatched:
+                self.stats.numUnmatchedFeedback += 1
+            else:
+                self.unmatched.append((feedback, session_id, rank))
+            return
+        (keywords, question_id) = response
+        self.stats.addFeedback(feedback, keywords, question_id, rank)
+
+# ====================================  Utilities ================
+
+def meanOf(total, count):
+    if count == 0:
+        return None
+    return round(float(total) / count, 4)
+
+def analyzeFile(args):
+    '''
+    Process pool task: read one log file. Only the carryWindow
+    earliest unmatched feedback clicks, and most recent sessions,
+    are returned for joining across files, which bounds what
+    goes back to the parent process.
+
+    @param args: log file path, session window size, and carry window size
+    @type args: (str, int, int)
+    @return: the file's statistics, its unmatched feedback,
+        and the response records of its most recent sessions
+    @rtype: (UsageStats, [tuple], [(str, dict)])
+    '''
+    (path, sessionWindow, carryWindow) = args
+    reader = LogReader(sessionWindow, carryWindow)
+    reader.readFile(path)
+    while len(reader.sessions) > carryWindow:
+        reader.sessions.popitem(last=False)
+    return (reader.stats, reader.unmatched, list(reader.sessions.items()))
+
+def analyzeLogs(paths, sessionWindow=100000, processes=1, carryWindow=DEFAULT_CARRY_WINDOW):
+    '''
+    Read the log files, in parallel if processes > 1, and
+    combine their statistics.
+
+    @param paths: log files
+    @type paths: [str]
+    @param sessionWindow: sessions per file kept for joining feedback
+    @type sessionWindow: int
+    @param processes: number of processes reading files
+    @type processes: int
+    @param carryWindow: most recent sessions, and earliest unmatched
+        feedback clicks, per file that are joined across files
+    @type carryWindow: int
+    @return: combined statistics
+    @rtype: UsageStats
+    '''
+    tasks = [(path, sessionWindow, carryWindow) for path in paths]
+    if processes > 1 and len(paths) > 1:
+        pool = multiprocessing.Pool(min(processes, len(paths)))
+        try:
+            results = pool.map(analyzeFile, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [analyzeFile(task) for task in tasks]
+
+    stats = UsageStats()
+    recentSessions = {}
+    unmatched = []
+    for (fileStats, fileUnmatched, fileSessions) in results:
+        stats.merge(fileStats)
+        unmatched.extend(fileUnmatched)
+        recentSessions.update(fileSessions)
+    # Feedback in one file on a session logged in another:
+    for (feedback, session_id, rank) in unmatched:
+        response = recentSessions.get(session_id, {}).get(rank)
+        if response is None:
+            stats.numUnmatchedFeedback += 1
+        else:
+            stats.addFeedback(feedback, response[0], response[1], rank)
+    return stats
+
+def writeTables(stats, outDir, outFormat='csv'):
+    '''
+    Write each table of stats to <outDir>/<table>.csv or
+    <outDir>/<table>.parquet.
+
+    @return: paths of the files written
+    @rtype: [str]
+    '''
+    if outFormat == 'parquet':
+        requireParquet()
+        import pyarrow
+        import pyarrow.parquet
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    paths = []
+    for (tableName, (columns, rows)) in sorted(stats.tables().items()):
+        path = os.path.join(outDir, '%s.%s' % (tableName, outFormat))
+        if outFormat == 'parquet':
+            table = pyarrow.Table.from_arrays([pyarrow.array([row[i] for row in rows]) for i in range(len(columns))],
+                                              columns)
+            pyarrow.parquet.write_table(table, path)
+        else:
+            with open(path, 'wb') as csvFile:
+                writer = csv.writer(csvFile)
+                writer.writerow(columns)
+                writer.writerows(rows)
+        paths.append(path)
+    return paths
+
+def requireParquet():
+    '''
+    Check that Parquet files can be written.
+
+    @raise ValueError: if pyarrow is not installed
+    '''
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet output requires the pyarrow package.")
+
+# ====================================  Main ================
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     description='Keyword, question, rank, and feedback statistics '
+                                                 'from forum archive server logs.')
+    parser.add_argument('logFiles',
+                        nargs='+',
+                        help='Server log files; may be gzipped')
+    parser.add_argument('--out-dir',
+                        default='.',
+                        help='Directory for the keywords, questions, and ranks tables (default: %(default)s)')
+    parser.add_argument('--format',
+                        choices=['csv', 'parquet'],
+                        default='csv',
+                        help='Output file format; parquet requires pyarrow (default: %(default)s)')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Log files read in parallel (default: %(default)s)')
+    parser.add_argument('--session-window',
+                        type=int,
+                        default=100000,
+                        help='Most recent sessions per file kept for joining feedback (default: %(default)s)')
+    parser.add_argument('--carry-window',
+                        type=int,
+                        default=DEFAULT_CARRY_WINDOW,
+                        help='Most recent sessions, and earliest unmatched feedback clicks, per file '
+                             'that are joined across files; covers sessions that straddle a log '
+                             'rotation (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    try:
+        # Before reading the logs, which can take a while:
+        if args.format == 'parquet':
+            requireParquet()
+    except ValueError as e:
+        sys.stderr.write('%s\n' % str(e))
+        return 2
+    stats = analyzeLogs(args.logFiles, args.session_window, args.processes, args.carry_window)
+    try:
+        paths = writeTables(stats, args.out_dir, args.format)
+    except ValueError as e:
+        sys.stderr.write('%s\n' % str(e))
+        return 2
+    sys.stdout.write('Wrote %s\n' % ', '.join(paths))
+    sys.stdout.write('%s feedback clicks joined; %s unmatched; %s unreadable lines.\n' %\
+                     (stats.numFeedback, stats.numUnmatchedFeedback, stats.numBadLines))
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Asynchronous log writer. Request handlers only put log
+entries into a bounded in-memory queue; a background thread
+formats them, and writes them in batches: the output is
+flushed once flushBytes bytes are pending, or flushInterval
+seconds after the oldest pending entry, whichever comes first.
+
+When the queue is full, because the disk falls behind, the
+'drop' policy discards new entries, and later logs how many
+were lost; the 'block' policy makes the caller wait for room,
+for at most blockTimeout seconds, and then drops the entry.
+Callers on the IOLoop stall the whole server while they wait.
+
+Two formats:
+
+    text   The traditional log lines. The response records of
+           one request form one entry:
+               <time> info:
+                  <keywords>,<question_id>,<session_id>,<rank>,<uid>
+                  ...
+    json   One JSON object per line. Each response record is
+           its own line, with type 'response', and the fields
+           of RESPONSE_FIELDS.
+
+When writing to a file, the file can be rotated once it
+exceeds maxFileBytes: <path> becomes <path>.1, <path>.1
+becomes <path>.2, and so on, up to backupCount backups.
+
+@author:     Andreas Paepcke
+
+'''
+
+import ast
+import datetime
+import json
+import os
+import Queue
+import sys
+import threading
+import time
+
+
+# Fields of a response record, in order:
+RESPONSE_FIELDS = ['keywords', 'question_id', 'session_id', 'rank', 'uid']
+
+LOG_FORMATS   = ['text', 'json']
+FULL_POLICIES = ['drop', 'block']
+
+class AsyncLogWriter(object):
+
+    # =========================== Constants ==================
+
+    # Seconds the 'block' policy waits for room in the queue:
+    BLOCK_TIMEOUT = 1.0
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self,
+                 path=None,
+                 logFormat='text',
+                 maxQueueSize=10000,
+                 flushBytes=64 * 1024,
+                 flushInterval=1.0,
+                 maxFileBytes=None,
+                 backupCount=5,
+                 fullPolicy='drop',
+                 blockTimeout=BLOCK_TIMEOUT):
+        '''
+        Starts the background writer thread.
+
+        @param path: file to append to; None for stdout
+        @type path: {str | None}
+        @param logFormat: 'text' or 'json'
+        @type logFormat: str
+        @param maxQueueSize: number of entries that may wait to be written
+        @type maxQueueSize: int
+        @param flushBytes: pending bytes that cause a flush
+        @type flushBytes: int
+        @param flushInterval: maximum seconds an entry waits to be flushed
+        @type flushInterval: float
+        @param maxFileBytes: rotate the file when it grows beyond
+            this size; None never rotates. Ignored for stdout.
+        @type maxFileBytes: {int | None}
+        @param backupCount: number of rotated files to keep
+        @type backupCount: int
+        @param fullPolicy: 'drop' or 'block'; what to do when the
+            queue is full
+        @type fullPolicy: str
+        @param blockTimeout: with the 'block' policy, seconds to
+            wait for room before dropping an entry
+        @type blockTimeout: float
+        '''
+        if logFormat not in LOG_FORMATS:
+            raise ValueError("Log format must be one of %s; got '%s'" % (LOG_FORMATS, logFormat))
+        if fullPolicy not in FULL_POLICIES:
+            raise ValueError("Full-queue policy must be one of %s; got '%s'" % (FULL_POLICIES, fullPolicy))
+        self.path = path
+        self.format = self.formatJson if logFormat == 'json' else self.formatText
+        self.flushBytes = flushBytes
+        self.flushInterval = flushInterval
+        self.maxFileBytes = maxFileBytes
+        self.backupCount = backupCount
+        self.block = fullPolicy == 'block'
+        self.blockTimeout = blockTimeout
+
+        self.queue = Queue.Queue(maxsize=maxQueueSize)
+        self.statsLock = threading.Lock()
+        self.numDropped = 0
+        self.numReportedDropped = 0
+        self.numWritten = 0
+        self.numFlushes = 0
+        self.numRotations = 0
+
+        self.out = self.openOutput()
+        self.thread = threading.Thread(target=self.run, name='AsyncLogWriter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    #-----------------------
+    # log
+    #---------------
+
+    def log(self, level, msg):
+        '''
+        Queue a message.
+
+        @param level: 'info', 'debug', 'error'
+        @type level: str
+        @param msg: the message
+        @type msg: str
+        '''
+        self.enqueue((datetime.datetime.now(), level, msg, None))
+
+    #-----------------------
+    # logResponses
+    #---------------
+
+    def logResponses(self, responseRecords):
+        '''
+        Queue the response records of one request.
+
+        @param responseRecords: one list of strings per result,
+            in the order of RESPONSE_FIELDS
+        @type responseRecords: [[str]]
+        '''
+        self.enqueue((datetime.datetime.now(), 'info', None, responseRecords))
+
+    #-----------------------
+    # enqueue
+    #---------------
+
+    def enqueue(self, entry):
+        try:
+            if self.block:
+                self.queue.put(entry, timeout=self.blockTimeout)
+            else:
+                self.queue.put_nowait(entry)
+        except Queue.Full:
+            with self.statsLock:
+                self.numDropped += 1
+
+    #-----------------------
+    # close
+    #---------------
+
+    def close(self, timeout=10):
+        '''
+        Write all queued entries, and stop the writer thread.
+        '''
+        # None tells the writer thread to finish:
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    #-----------------------
+    # stats
+    #---------------
+
+    def stats(self):
+        '''
+        @return: dict with keys queued, written, dropped,
+            flushes, and rotations
+        @rtype: {str : int}
+        '''
+        with self.statsLock:
+            return {'queued'    : self.queue.qsize(),
+                    'written'   : self.numWritten,
+                    'dropped'   : self.numDropped,
+                    'flushes'   : self.numFlushes,
+                    'rotations' : self.numRotations
+                    }
+
+    # ---------------------------- Writer thread -----------------
+
+    #-----------------------
+    # run
+    #---------------
+
+    def run(self):
+        '''
+        Body of the writer thread.
+        '''
+        pending = []
+        pendingBytes = 0
+        # Time by which pending output must be flushed:
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.time())
+            try:
+                entry = self.queue.get(timeout=timeout)
+            except Queue.Empty:
+                entry = False
+            if entry:
+                try:
+                    text = self.format(entry)
+                except Exception as e:
+                    # One malformed entry must not stop the thread,
+                    # on which blocked callers would wait forever:
+                    sys.stderr.write('%s error: Could not format log entry: %s\n' % (datetime.datetime.now(), `e`))
+                    text = None
+                if text is not None:
+                    pending.append(text)
+                    pendingBytes += len(text)
+                    if deadline is None:
+                        deadline = time.time() + self.flushInterval
+            if entry is None or pendingBytes >= self.flushBytes or \
+               (deadline is not None and time.time() >= deadline):
+                dropNote = self.dropNote()
+                if dropNote is not None:
+                    pending.append(dropNote)
+                if len(pending) > 0:
+                    self.writeOut(pending)
+                    with self.statsLock:
+                        self.numWritten += len(pending)
+                        self.numFlushes += 1
+                pending = []
+                pendingBytes = 0
+                deadline = None
+            if entry is None:
+                if self.path is not None:
+                    self.out.close()
+                return
+
+    #-----------------------
+    # writeOut
+    #---------------
+
+    def writeOut(self, texts):
+        '''
+        Write and flush texts, rotating the file first if
+        it would grow beyond maxFileBytes. Errors are reported
+        on stderr, and the texts are lost.
+        '''
+        data = ''.join(texts)
+        try:
+            if self.path is not None and self.maxFileBytes is not None and \
+               self.out.tell() > 0 and self.out.tell() + len(data) > self.maxFileBytes:
+                self.rotate()
+            self.out.write(data)
+            self.out.flush()
+        except Exception as e:
+            sys.stderr.write('%s error: Could not write log: %s\n' % (datetime.datetime.now(), `e`))
+
+    #-----------------------
+    # rotate
+    #---------------
+
+    def rotate(self):
+        self.out.close()
+        for i in range(self.backupCount - 1, 0, -1):
+            if os.path.exists('%s.%s' % (self.path, i)):
+                os.rename('%s.%s' % (self.path, i), '%s.%s' % (self.path, i + 1))
+        if self.backupCount > 0:
+            os.rename(self.path, '%s.1' % self.path)
+        else:
+            os.remove(self.path)
+        self.out = self.openOutput()
+        with self.statsLock:
+            self.numRotations += 1
+
+    #-----------------------
+    # openOutput
+    #---------------
+
+    def openOutput(self):
+        if self.path is None:
+            return sys.stdout
+        return open(self.path, 'a')
+
+    #-----------------------
+    # dropNote
+    #---------------
+
+    def dropNote(self):
+        '''
+        Log entry about entries dropped since the last note;
+        None if there were none.
+        '''
+        with self.statsLock:
+            numNew = self.numDropped - self.numReportedDropped
+            self.numReportedDropped = self.numDropped
+        if numNew == 0:
+            return None
+        return self.format((datetime.datetime.now(), 'error',
+                            'Log queue full: dropped %s log entries.' % numNew, None))
+
+    #-----------------------
+    # formatText
+    #---------------
+
+    def formatText(self, entry):
+        (timestamp, level, msg, responseRecords) = entry
+        if responseRecords is not None:
+            msg = '\n   ' + '\n   '.join([','.join([utf8Text(field) for field in one_record])
+                                           for one_record in responseRecords])
+        return '%s %s: %s\n' % (timestamp, level, utf8Text(msg))
+
+    #-----------------------
+    # formatJson
+    #---------------
+
+    def formatJson(self, entry):
+        (timestamp, level, msg, responseRecords) = entry
+        timestamp = timestamp.isoformat()
+        if responseRecords is None:
+            return json.dumps({'time' : timestamp, 'level' : level, 'type' : 'message',
+                               'message' : unicodeText(msg)}) + '\n'
+        lines = []
+        for one_record in responseRecords:
+            # json.dumps() fails on str that is not UTF-8, such as
+            # a uid or keyword sent by a misbehaving client:
+            record = dict(zip(RESPONSE_FIELDS, [unicodeText(field) for field in one_record]))
+            record['keywords'] = [unicodeText(keyword) for keyword in parseKeywords(record['keywords'])]
+            record['rank'] = int(record['rank'])
+            record.update({'time' : timestamp, 'level' : level, 'type' : 'response'})
+            lines.append(json.dumps(record) + '\n')
+        return ''.join(lines)
+
+# ====================================  Utilities ================
+
+def unicodeText(value):
+    '''
+    Value as unicode; str is decoded as UTF-8, with
+    undecodable bytes replaced.
+    '''
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, unicode):
+        return value
+    return unicode(value)
+
+def utf8Text(value):
+    '''
+    Value as a UTF-8 str, so that str and unicode values
+    can be joined, and written to a file.
+    '''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def parseKeywords(keywords_str):
+    '''
+    Keyword list from the str(keywords) form in which response
+    records carry it, e.g. "['conv', 'matrix']". Strings that
+    are not in that form are returned as a one-element list.
+
+    @param keywords_str: keywords field of a response record
+    @type keywords_str: str
+    @return: the keywords
+    @rtype: [str]
+    '''
+    try:
+        keywords = ast.literal_eval(keywords_str)
+    except (ValueError, SyntaxError):
+        return [keywords_str]
+    if not isinstance(keywords, list):
+        return [keywords_str]
+    return keywords
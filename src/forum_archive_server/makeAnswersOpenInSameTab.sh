@@ -14,6 +14,10 @@
 #
 # Can safely be run many times.
 #
+# Superseded by wordcloud_build.py, whose pages need no
+# patching; running this script on them restores the
+# pages from index.htmlORIG.
+#
 #------------------------------------------------
 
 # Find paths to index.html below the 'wordclouds' directory
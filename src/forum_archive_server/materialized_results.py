@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Materialized FAQ lookup results. The archive only changes
+when a new course term is loaded, so rather than joining and
+sorting ForumKeywords and ForumPosts for every request, an
+offline job stores the ranked question_ids of every keyword:
+
+    ForumKeywordResults          (keyword, position, question_id)
+                                  primary key (keyword, position)
+    ForumKeywordResultsKeywords  (keyword, num_results, complete)
+    ForumKeywordResultsPosts     (question_id) of the posts with
+                                  keywords that builds covered
+    ForumKeywordResultsState     fingerprint of the archive the
+                                  materialization was built from
+
+The results of a keyword are those of a single-keyword request:
+all posts with a keyword that contains it, once each, in the
+order of the keyword index (see query_planner.py). Keywords are stored in
+lower case. At most maxResults results are stored per keyword;
+'complete' tells whether that was all of them.
+
+Run as a script, this module builds the tables. By default
+the build is incremental: only keywords that match keywords
+of posts that no build covered yet are recomputed. Use --full
+after covered posts changed, e.g. their view counts; an
+incremental build notices such changes by the sums of their
+ranking columns, and then leaves the materialization marked
+stale.
+
+The server's MaterializedResults reads the tables with an
+indexed equality lookup. It compares the stored fingerprint
+with that of the live tables when it is refreshed, and when
+they differ, or a request is not covered, lookups fall back
+to the live query.
+
+@author:     Andreas Paepcke
+
+'''
+
+import argparse
+import datetime
+import getpass
+import os
+import sys
+import threading
+
+from db_pool import MySQLConnectionPool, readMySQLPwd
+from keyword_index import KeywordIndex
+
+
+CREATE_TABLES = ['''CREATE TABLE IF NOT EXISTS ForumKeywordResults (
+                        keyword     VARCHAR(255) NOT NULL,
+                        position    INT NOT NULL,
+                        question_id VARCHAR(255) NOT NULL,
+                        PRIMARY KEY (keyword, position),
+                        INDEX (question_id)
+                    )''',
+                 '''CREATE TABLE IF NOT EXISTS ForumKeywordResultsKeywords (
+                        keyword     VARCHAR(255) NOT NULL PRIMARY KEY,
+                        num_results INT NOT NULL,
+                        complete    TINYINT NOT NULL
+                    )''',
+                 '''CREATE TABLE IF NOT EXISTS ForumKeywordResultsPosts (
+                        question_id VARCHAR(255) NOT NULL PRIMARY KEY
+                    )''',
+                 '''CREATE TABLE IF NOT EXISTS ForumKeywordResultsState (
+                        id          INT NOT NULL PRIMARY KEY,
+                        fingerprint VARCHAR(255) NOT NULL,
+                        built       DATETIME NOT NULL
+                    )'''
+                 ]
+
+class MaterializedResults(object):
+    '''
+    Server side: decides which lookups the materialization
+    can answer, and builds their queries.
+    '''
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self):
+        # Lower case keyword --> (num_results, complete):
+        self.keywords = {}
+        self.fresh = False
+        # Stored fingerprint of the fresh materialization:
+        self.fingerprint = None
+        self.lock = threading.Lock()
+
+    #-----------------------
+    # refresh
+    #---------------
+
+    def refresh(self, mysqlDb):
+        '''
+        Check whether the materialization matches the live
+        tables, and if so, load the list of its keywords.
+        Safe to call while lookups are served.
+
+        @param mysqlDb: open connection
+        @type mysqlDb: MySQLDB
+        @return: whether lookups can use the materialization
+        @rtype: bool
+        '''
+        with self.lock:
+            try:
+                stored = list(mysqlDb.query('SELECT fingerprint FROM ForumKeywordResultsState WHERE id = 1'))
+            except Exception:
+                # Never built:
+                stored = []
+            if len(stored) == 0 or stored[0][0] != archiveFingerprint(mysqlDb):
+                (self.fresh, self.fingerprint) = (False, None)
+                return False
+            if self.fresh and stored[0][0] == self.fingerprint:
+                # Unchanged since the last refresh:
+                return True
+            keywords = {}
+            for (keyword, num_results, complete) in \
+                    mysqlDb.query('SELECT keyword, num_results, complete FROM ForumKeywordResultsKeywords'):
+                keywords[keyword.lower()] = (num_results, bool(complete))
+            self.keywords = keywords
+            (self.fresh, self.fingerprint) = (True, stored[0][0])
+            return True
+
+    #-----------------------
+    # state
+    #---------------
+
+    def state(self):
+        '''
+        What the last refresh() found: whether the materialization
+        is fresh, and the fingerprint it was built with.
+        '''
+        with self.lock:
+            return (self.fresh, self.fingerprint)
+
+    #-----------------------
+    # covers
+    #---------------
+
+    def covers(self, keywords, offset, limit):
+        '''
+        Whether the materialization holds the results of a
+        request for keywords, from offset to offset + limit.
+        Only single-keyword requests are covered.
+        '''
+        if not self.fresh:
+            return False
+        keyword = keywords[0].lower()
+        if any(other.lower() != keyword for other in keywords[1:]):
+            return False
+        entry = self.keywords.get(keyword)
+        if entry is None:
+            return False
+        (num_results, complete) = entry
+        return complete or offset + limit <= num_results
+
+    #-----------------------
+    # buildQuery
+    #---------------
+
+    def buildQuery(self, keyword, offset, limit):
+        '''
+        Query for results offset+1 through offset+limit of keyword.
+        Result rows are (<questionText>,<answerText>,<questionId>).
+
+        @return: the query with %s placeholders, and its parameters
+        @rtype: (str, list)
+        '''
+        query = '''SELECT question, answer, question_id
+                     FROM ForumKeywordResults JOIN ForumPosts
+                       ON question_id = id
+                    WHERE keyword = %s
+                      AND position > %s
+                    ORDER BY position
+                    LIMIT %s
+                '''
+        return (query, [keyword.lower(), offset, limit])
+
+class ResultsBuilder(object):
+    '''
+    Offline side: computes and stores the ranked results.
+    '''
+
+    # Rows per INSERT statement:
+    INSERT_BATCH_SIZE = 1000
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, maxResults=1000):
+        '''
+        @param maxResults: maximum number of results stored per keyword
+        @type maxResults: int
+        '''
+        self.maxResults = maxResults
+
+    #-----------------------
+    # build
+    #---------------
+
+    def build(self, mysqlDb, full=False):
+        '''
+        Bring the materialization up to date with the live tables.
+
+        @param mysqlDb: open connection
+        @type mysqlDb: MySQLDB
+        @param full: recompute all keywords, rather than only
+            those affected by new posts
+        @type full: bool
+        @return: number of keywords recomputed
+        @rtype: int
+        '''
+        cursor = mysqlDb.connection.cursor()
+        try:
+            for createTable in CREATE_TABLES:
+                cursor.execute(createTable)
+            cursor.execute('SELECT fingerprint FROM ForumKeywordResultsState WHERE id = 1')
+            previous = cursor.fetchall()
+            if len(previous) > 0:
+                lastSums = fingerprintField(previous[0][0], 'materialized')
+            else:
+                # Never built, or a build was interrupted:
+                lastSums = 'None/None/None'
+            # An incremental build only adds posts; it is up to date if
+            # the materialized ones are as they were at the last build:
+            upToDate = full or materializedSums(mysqlDb) == lastSums
+            # Mark as stale while the tables change:
+            cursor.execute('DELETE FROM ForumKeywordResultsState')
+            mysqlDb.connection.commit()
+
+            keywordIndex = KeywordIndex()
+            keywordIndex.load(mysqlDb)
+            # Lower case keyword --> its results:
+            vocabulary = set(keyword.lower() for keyword in keywordIndex.postings.keys())
+            if full:
+                cursor.execute('DELETE FROM ForumKeywordResults')
+                cursor.execute('DELETE FROM ForumKeywordResultsKeywords')
+                cursor.execute('DELETE FROM ForumKeywordResultsPosts')
+                targets = vocabulary
+            else:
+                targets = self.affectedKeywords(mysqlDb, vocabulary)
+
+            for keyword in sorted(targets):
+                self.storeKeyword(cursor, keyword, keywordIndex.lookup([keyword]))
+            self.storeCoveredPosts(mysqlDb, cursor, keywordIndex)
+            if upToDate:
+                cursor.execute('INSERT INTO ForumKeywordResultsState (id, fingerprint, built) VALUES (1, %s, %s)',
+                               (archiveFingerprint(mysqlDb), datetime.datetime.now()))
+            else:
+                sys.stderr.write('%s warning: Materialized posts changed since the last build; '
+                                 'results stay stale until a build with --full.\n' % datetime.datetime.now())
+            mysqlDb.connection.commit()
+            return len(targets)
+        finally:
+            cursor.close()
+
+    #-----------------------
+    # affectedKeywords
+    #---------------
+
+    def affectedKeywords(self, mysqlDb, vocabulary):
+        '''
+        Keywords whose results include posts that no build
+        covered: since the first request keyword matches every
+        keyword containing it, these are all substrings, in the
+        vocabulary, of the new posts' keywords.
+        '''
+        newKeywords = set()
+        for (keyword,) in mysqlDb.query('''SELECT DISTINCT k.keyword
+                                              FROM ForumKeywords k LEFT JOIN ForumKeywordResultsPosts p
+                                                ON p.question_id = k.question_id
+                                             WHERE p.question_id IS NULL
+                                        '''):
+            newKeywords.add(keyword.lower())
+        affected = set()
+        for keyword in newKeywords:
+            for start in range(len(keyword)):
+                for end in range(start + 1, len(keyword) + 1):
+                    if keyword[start:end] in vocabulary:
+                        affected.add(keyword[start:end])
+        return affected
+
+    #-----------------------
+    # storeCoveredPosts
+    #---------------
+
+    def storeCoveredPosts(self, mysqlDb, cursor, keywordIndex):
+        '''
+        Record the posts of keywordIndex as covered, including
+        those beyond the maxResults of every keyword, so that
+        later incremental builds do not take them for new posts.
+        '''
+        covered = set(question_id for (question_id,) in mysqlDb.query('SELECT question_id FROM ForumKeywordResultsPosts'))
+        newPosts = set()
+        for postingsList in keywordIndex.postings.values():
+            newPosts.update(question_id for (_sortKey, question_id) in postingsList if question_id not in covered)
+        newPosts = sorted(newPosts)
+        for start in range(0, len(newPosts), ResultsBuilder.INSERT_BATCH_SIZE):
+            chunk = newPosts[start:start + ResultsBuilder.INSERT_BATCH_SIZE]
+            cursor.execute('INSERT INTO ForumKeywordResultsPosts (question_id) VALUES ' + ','.join(['(%s)'] * len(chunk)),
+                           chunk)
+
+    #-----------------------
+    # storeKeyword
+    #---------------
+
+    def storeKeyword(self, cursor, keyword, questionIds):
+        '''
+        Replace the stored results of keyword.
+        '''
+        cursor.execute('DELETE FROM ForumKeywordResults WHERE keyword = %s', (keyword,))
+        cursor.execute('DELETE FROM ForumKeywordResultsKeywords WHERE keyword = %s', (keyword,))
+        stored = questionIds[:self.maxResults]
+        for start in range(0, len(stored), ResultsBuilder.INSERT_BATCH_SIZE):
+            chunk = stored[start:start + ResultsBuilder.INSERT_BATCH_SIZE]
+            params = []
+            for (position, question_id) in enumerate(chunk, start + 1):
+                params.extend([keyword, position, question_id])
+            cursor.execute('INSERT INTO ForumKeywordResults (keyword, position, question_id) VALUES ' +\
+                           ','.join(['(%s,%s,%s)'] * len(chunk)),
+                           params)
+        cursor.execute('INSERT INTO ForumKeywordResultsKeywords (keyword, num_results, complete) VALUES (%s,%s,%s)',
+                       (keyword, len(stored), 1 if len(stored) == len(questionIds) else 0))
+
+# ====================================  Utilities ================
+
+def archiveFingerprint(mysqlDb):
+    '''
+    Summary of ForumPosts and ForumKeywords that changes when
+    posts or keywords are added or removed, or the ranking
+    columns change. Includes the materializedSums().
+    '''
+    ((numPosts, views, upvotes, answerTypes),) = \
+        list(mysqlDb.query('''SELECT COUNT(*), SUM(unique_views), SUM(total_no_upvotes), SUM(answer_type)
+                                FROM ForumPosts'''))
+    ((numKeywords,),) = list(mysqlDb.query('SELECT COUNT(*) FROM ForumKeywords'))
+    # The version changes with the results a build stores:
+    return 'v4,posts=%s,views=%s,upvotes=%s,types=%s,keywords=%s,materialized=%s' %\
+        (numPosts, views, upvotes, answerTypes, numKeywords, materializedSums(mysqlDb))
+
+def materializedSums(mysqlDb):
+    '''
+    Sums of the ranking columns of the posts that builds
+    covered, as '<views>/<upvotes>/<types>'.
+    '''
+    ((views, upvotes, answerTypes),) = \
+        list(mysqlDb.query('''SELECT SUM(unique_views), SUM(total_no_upvotes), SUM(answer_type)
+                                FROM ForumPosts
+                               WHERE id IN (SELECT question_id FROM ForumKeywordResultsPosts)'''))
+    return '%s/%s/%s' % (views, upvotes, answerTypes)
+
+def fingerprintField(fingerprint, name):
+    '''
+    Value of the name=value field of an archiveFingerprint();
+    None if there is none.
+    '''
+    for field in fingerprint.split(','):
+        (fieldName, _equals, value) = field.partition('=')
+        if fieldName == name:
+            return value
+    return None
+
+# ====================================  Main ================
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     description='Build the materialized keyword results '
+                                                 'of the forum archive server.')
+    parser.add_argument('--db',
+                        default='ForumArchive',
+                        help='MySQL database holding ForumPosts and ForumKeywords (default: %(default)s)')
+    parser.add_argument('--full',
+                        action='store_true',
+                        help='Recompute all keywords, rather than only those matching new posts')
+    parser.add_argument('--max-results',
+                        type=int,
+                        default=1000,
+                        help='Maximum number of results stored per keyword (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    db_pool = MySQLConnectionPool(user=getpass.getuser(),
+                                  passwd=readMySQLPwd(),
+                                  db=args.db,
+                                  minSize=0,
+                                  maxSize=1)
+    try:
+        numKeywords = db_pool.withConnection(ResultsBuilder(args.max_results).build, args.full)
+    finally:
+        db_pool.close()
+    sys.stdout.write('%s info: Materialized results of %s keywords.\n' % (datetime.datetime.now(), numKeywords))
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
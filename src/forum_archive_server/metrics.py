@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Request metrics of the server, served at /metrics in the
+Prometheus text format:
+
+    forum_archive_stage_seconds{stage}    histogram of the time
+                                          requests spend in each stage
+    forum_archive_requests_total{req}     requests by req type
+    forum_archive_errors_total{req}       error responses by req type
+    forum_archive_results                 histogram of the number of
+                                          results per lookup
+
+plus the counters of the result and fragment caches and of
+the MySQL connection pool, which are read from their stats()
+when /metrics is requested. The stages are:
+
+    acquire   checking out a MySQL connection from the pool
+    query     fetching result rows in a query_executor thread;
+              includes the checkout for that fetch
+    render    turning results into HTML or JSON, and filling
+              in cached results
+    write     flushing and finishing the response
+
+Recording an observation takes a lock and a binary search,
+so it may be done on every request. With several workers,
+each worker keeps and serves its own metrics, labeled with
+its worker number.
+
+@author:     Andreas Paepcke
+
+'''
+
+import bisect
+import threading
+
+from tornado.web import RequestHandler
+
+
+# Upper bounds of the latency buckets, in seconds:
+STAGE_BUCKETS  = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+STAGES         = ['acquire', 'query', 'render', 'write']
+
+# Upper bounds of the buckets of results per lookup:
+RESULT_BUCKETS = [0, 1, 2, 5, 10, 20, 50, 100]
+
+# Values of the req label; other req values are counted as 'other':
+REQUEST_TYPES  = ['getFaqs', 'getFaqsJson', 'demo', 'feedback', 'other']
+
+CONTENT_TYPE   = 'text/plain; version=0.0.4; charset=utf-8'
+
+class ServerMetrics(object):
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, constLabels=None):
+        '''
+        @param constLabels: labels added to every sample, such as
+            the worker number
+        @type constLabels: {{str : str} | None}
+        '''
+        self.constLabels = sorted((constLabels or {}).items())
+        self.lock = threading.Lock()
+        self.stageSeconds = dict((stage, Histogram(STAGE_BUCKETS)) for stage in STAGES)
+        self.numResults = Histogram(RESULT_BUCKETS)
+        self.numRequests = dict((requestType, 0) for requestType in REQUEST_TYPES)
+        self.numErrors = dict((requestType, 0) for requestType in REQUEST_TYPES)
+        # (name, object with stats()) of the caches, and the pool:
+        self.caches = []
+        self.db_pool = None
+
+    #-----------------------
+    # observeStage
+    #---------------
+
+    def observeStage(self, stage, seconds):
+        '''
+        Record the time a request spent in stage, one of STAGES.
+        '''
+        with self.lock:
+            self.stageSeconds[stage].observe(seconds)
+
+    #-----------------------
+    # observeResults
+    #---------------
+
+    def observeResults(self, numResults):
+        '''
+        Record the number of results of a lookup.
+        '''
+        with self.lock:
+            self.numResults.observe(numResults)
+
+    #-----------------------
+    # countRequest
+    #---------------
+
+    def countRequest(self, requestType):
+        with self.lock:
+            self.numRequests[requestTypeLabel(requestType)] += 1
+
+    #-----------------------
+    # countError
+    #---------------
+
+    def countError(self, requestType):
+        with self.lock:
+            self.numErrors[requestTypeLabel(requestType)] += 1
+
+    #-----------------------
+    # watchCache
+    #---------------
+
+    def watchCache(self, name, cache):
+        '''
+        Report the stats() of cache, an LRUCache, under
+        the label cache=name. Does nothing if cache is None.
+        '''
+        if cache is not None:
+            self.caches.append((name, cache))
+
+    #-----------------------
+    # watchPool
+    #---------------
+
+    def watchPool(self, db_pool):
+        '''
+        Report the stats() of db_pool, a MySQLConnectionPool.
+        '''
+        self.db_pool = db_pool
+
+    #-----------------------
+    # exposition
+    #---------------
+
+    def exposition(self):
+        '''
+        All metrics in the Prometheus text format.
+
+        @return: the text for /metrics
+        @rtype: str
+        '''
+        lines = []
+        with self.lock:
+            addHeader(lines, 'forum_archive_stage_seconds', 'histogram',
+                      'Time requests spent in each stage.')
+            for stage in STAGES:
+                self.stageSeconds[stage].addSamples(lines, 'forum_archive_stage_seconds',
+                                                    self.constLabels + [('stage', stage)])
+            addHeader(lines, 'forum_archive_results', 'histogram', 'Number of results per lookup.')
+            self.numResults.addSamples(lines, 'forum_archive_results', self.constLabels)
+            for (name, counts, help) in [('forum_archive_requests_total', self.numRequests, 'Requests by req type.'),
+                                         ('forum_archive_errors_total', self.numErrors, 'Error responses by req type.')]:
+                addHeader(lines, name, 'counter', help)
+                for requestType in REQUEST_TYPES:
+                    addSample(lines, name, self.constLabels + [('req', requestType)], counts[requestType])
+
+        # The caches and the pool have locks of their own:
+        cacheStats = [(name, cache.stats()) for (name, cache) in self.caches]
+        if len(cacheStats) > 0:
+            for (stat, kind, help) in [('hits', 'counter', 'Cache lookups that found an entry.'),
+                                       ('misses', 'counter', 'Cache lookups that found no live entry.'),
+                                       ('evictions', 'counter', 'Entries evicted to stay within budget.'),
+                                       ('entries', 'gauge', 'Entries in the cache.'),
+                                       ('bytes', 'gauge', 'Bytes counted against the cache budget.')]:
+                name = 'forum_archive_cache_%s%s' % (stat, '_total' if kind == 'counter' else '')
+                addHeader(lines, name, kind, help)
+                for (cacheName, stats) in cacheStats:
+                    addSample(lines, name, self.constLabels + [('cache', cacheName)], stats[stat])
+            addHeader(lines, 'forum_archive_cache_hit_ratio', 'gauge', 'Hits per lookup since startup.')
+            for (cacheName, stats) in cacheStats:
+                numLookups = stats['hits'] + stats['misses']
+                addSample(lines, 'forum_archive_cache_hit_ratio', self.constLabels + [('cache', cacheName)],
+                          float(stats['hits']) / numLookups if numLookups > 0 else 0.0)
+
+        if self.db_pool is not None:
+            stats = self.db_pool.stats()
+            addHeader(lines, 'forum_archive_db_pool_connections', 'gauge', 'MySQL connections by state.')
+            for (state, stat) in [('open', 'open'), ('idle', 'idle'), ('in_use', 'inUse'), ('max', 'maxSize')]:
+                addSample(lines, 'forum_archive_db_pool_connections', self.constLabels + [('state', state)],
+                          stats[stat])
+            for (stat, help) in [('checkouts', 'Connections checked out.'),
+                                 ('waits', 'Checkouts that found all connections busy.'),
+                                 ('timeouts', 'Checkouts that gave up waiting.'),
+                                 ('reconnects', 'Connections re-opened after a failed health check.')]:
+                name = 'forum_archive_db_pool_%s_total' % stat
+                addHeader(lines, name, 'counter', help)
+                addSample(lines, name, self.constLabels, stats[stat])
+        lines.append('')
+        return '\n'.join(lines)
+
+class Histogram(object):
+    '''
+    Counts of observations by bucket, with their sum.
+    Not locked; ServerMetrics holds its lock while
+    calling these.
+    '''
+
+    def __init__(self, buckets):
+        '''
+        @param buckets: upper bounds of the buckets, ascending
+        @type buckets: [float]
+        '''
+        self.buckets = buckets
+        # The last count is of the observations above all bounds:
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def addSamples(self, lines, name, labels):
+        '''
+        Append the cumulative bucket counts, the sum, and the
+        count to lines.
+        '''
+        cumulative = 0
+        for (bound, count) in zip(self.buckets, self.counts):
+            cumulative += count
+            addSample(lines, name + '_bucket', labels + [('le', formatValue(bound))], cumulative)
+        cumulative += self.counts[-1]
+        addSample(lines, name + '_bucket', labels + [('le', '+Inf')], cumulative)
+        addSample(lines, name + '_sum', labels, self.sum)
+        addSample(lines, name + '_count', labels, cumulative)
+
+class MetricsHandler(RequestHandler):
+    '''
+    Serves the exposition() of the application's metrics.
+    '''
+
+    def get(self):
+        self.set_header('Content-Type', CONTENT_TYPE)
+        self.write(self.settings['metrics'].exposition())
+
+# ====================================  Utilities ================
+
+def requestTypeLabel(requestType):
+    return requestType if requestType in REQUEST_TYPES else 'other'
+
+def addHeader(lines, name, kind, help):
+    lines.append('# HELP %s %s' % (name, help))
+    lines.append('# TYPE %s %s' % (name, kind))
+
+def addSample(lines, name, labels, value):
+    if len(labels) > 0:
+        name += '{%s}' % ','.join('%s="%s"' % (label, escapeLabelValue(labelValue))
+                                  for (label, labelValue) in labels)
+    lines.append('%s %s' % (name, formatValue(value)))
+
+def escapeLabelValue(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatValue(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
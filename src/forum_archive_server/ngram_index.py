@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Character n-gram index over the distinct keyword vocabulary
+of ForumKeywords. Resolves a substring to all keywords that
+contain it, with the semantics of the SQL lookup's
+
+    LOCATE('<substring>', keyword) > 0
+
+so that "conv" finds both "convolution" and "convnet".
+
+All grams of length 1 through gramLength are indexed. A
+substring of at most gramLength characters is therefore
+answered by a single dict lookup. Longer substrings intersect
+the postings of their grams, starting with the shortest, and
+verify the few surviving candidates.
+
+Like MySQL's default (_ci) collations, matching ignores
+case unless caseSensitive is set.
+
+@author:     Andreas Paepcke
+
+'''
+
+
+class SubstringIndex(object):
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, vocabulary, gramLength=3, caseSensitive=False):
+        '''
+        Build the index.
+
+        @param vocabulary: keywords to index; duplicates are ignored
+        @type vocabulary: iterable of str
+        @param gramLength: longest gram to index
+        @type gramLength: int
+        @param caseSensitive: if False, matching ignores case
+        @type caseSensitive: bool
+        '''
+        if gramLength < 1:
+            raise ValueError("gramLength must be at least 1; got %s" % gramLength)
+        self.gramLength = gramLength
+        self.caseSensitive = caseSensitive
+
+        self.keywords = sorted(set(vocabulary))
+        self.folded = [self.fold(keyword) for keyword in self.keywords]
+
+        # Folded keyword --> ids of keywords that equal
+        # it under the collation:
+        self.equal = {}
+        # gram --> ascending list of keyword ids:
+        self.grams = {}
+        for (keywordId, folded) in enumerate(self.folded):
+            self.equal.setdefault(folded, []).append(keywordId)
+            gramsOfKeyword = set()
+            for length in range(1, min(gramLength, len(folded)) + 1):
+                for start in range(len(folded) - length + 1):
+                    gramsOfKeyword.add(folded[start:start + length])
+            for gram in gramsOfKeyword:
+                self.grams.setdefault(gram, []).append(keywordId)
+
+    #-----------------------
+    # __len__
+    #---------------
+
+    def __len__(self):
+        return len(self.keywords)
+
+    #-----------------------
+    # fold
+    #---------------
+
+    def fold(self, keyword):
+        '''
+        Normalize a keyword or substring for comparison.
+        '''
+        return keyword if self.caseSensitive else keyword.lower()
+
+    #-----------------------
+    # matches
+    #---------------
+
+    def matches(self, substring):
+        '''
+        All keywords that contain substring.
+
+        @param substring: the string to locate
+        @type substring: str
+        @return: matching keywords
+        @rtype: set(str)
+        '''
+        return set(self.keywords[keywordId] for keywordId in self.matchingIds(self.fold(substring)))
+
+    #-----------------------
+    # equals
+    #---------------
+
+    def equals(self, keyword):
+        '''
+        All keywords that equal the given one under
+        the collation, i.e. SQL's keyword = '<keyword>'.
+
+        @param keyword: keyword to look up
+        @type keyword: str
+        @return: equal keywords from the vocabulary
+        @rtype: set(str)
+        '''
+        return set(self.keywords[keywordId] for keywordId in self.equal.get(self.fold(keyword), []))
+
+    #-----------------------
+    # matchingIds
+    #---------------
+
+    def matchingIds(self, folded):
+        '''
+        Ids of keywords containing the already folded substring.
+        '''
+        if len(folded) == 0:
+            # LOCATE('', keyword) is 1 for every keyword:
+            return range(len(self.keywords))
+        if len(folded) <= self.gramLength:
+            return self.grams.get(folded, [])
+
+        n = self.gramLength
+        gramPostings = []
+        for start in range(len(folded) - n + 1):
+            postings = self.grams.get(folded[start:start + n])
+            if postings is None:
+                # Some gram occurs in no keyword:
+                return []
+            gramPostings.append(postings)
+        gramPostings.sort(key=len)
+        candidates = set(gramPostings[0])
+        for postings in gramPostings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates.intersection_update(postings)
+        # All grams present does not guarantee that they are
+        # adjacent in the right order, so verify:
+        return sorted(keywordId for keywordId in candidates if folded in self.folded[keywordId])
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Paging through FAQ lookup results. A result page shows
+at most pageSize results; its "More results" link carries
+a PageCursor in the 'after' URL argument.
+
+The cursor holds the rank of the last result shown, so
+that ranks stay globally correct across pages, and, when
+the results came from the SQL lookup, the sort key of
+that last result. The SQL lookup then continues with a
+keyset condition on
+
+    (numMatched, answer_type, unique_views, total_no_upvotes, question_id)
+
+which keeps deep pages as cheap as the first one. The cursor
+also counts the results shown so far whose sort key equals
+the last one; the lookup continues at or after the sort key,
+and skips that many rows. Without a sort key the rank serves
+as an offset.
+
+RankedRows cuts a page out of the result rows, and assigns
+the ranks, for both the HTML and the JSON result pages.
+
+@author:     Andreas Paepcke
+
+'''
+
+import base64
+import json
+
+from tornado import gen
+
+
+# Results per page unless the request asks for another size:
+DEFAULT_PAGE_SIZE = 20
+# Largest page size a request may ask for:
+MAX_PAGE_SIZE = 200
+
+class PageCursor(object):
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, rank, sortKey=None, ties=1):
+        '''
+        @param rank: rank of the last result shown so far
+        @type rank: int
+        @param sortKey: (numMatched, answer_type, unique_views,
+            total_no_upvotes, question_id) of that result; None if unknown
+        @type sortKey: {tuple | None}
+        @param ties: number of results shown so far with that sortKey
+        @type ties: int
+        '''
+        self.rank = rank
+        self.sortKey = None if sortKey is None else tuple(sortKey)
+        self.ties = ties
+
+    #-----------------------
+    # encode
+    #---------------
+
+    def encode(self):
+        '''
+        Cursor as a URL-safe string.
+        '''
+        if self.sortKey is None:
+            return str(self.rank)
+        return '%s.%s.%s' % (self.rank, self.ties, base64.urlsafe_b64encode(json.dumps(self.sortKey)))
+
+    #-----------------------
+    # decode
+    #---------------
+
+    @classmethod
+    def decode(cls, token):
+        '''
+        Inverse of encode().
+
+        @param token: string from an 'after' URL argument
+        @type token: str
+        @return: the cursor
+        @rtype: PageCursor
+        @raise ValueError: if token is not a valid cursor
+        '''
+        parts = token.split('.')
+        rank = int(parts[0])
+        if rank < 0:
+            raise ValueError("Negative rank in page cursor '%s'" % token)
+        if len(parts) == 1:
+            return PageCursor(rank)
+        if len(parts) != 3:
+            raise ValueError("Bad page cursor '%s'" % token)
+        (ties, sortKeyStr) = (int(parts[1]), parts[2])
+        if ties < 1:
+            raise ValueError("Bad tie count in page cursor '%s'" % token)
+        try:
+            sortKey = json.loads(base64.urlsafe_b64decode(str(sortKeyStr)))
+        except (TypeError, ValueError):
+            raise ValueError("Bad sort key in page cursor '%s'" % token)
+        if not isinstance(sortKey, list) or len(sortKey) != 5:
+            raise ValueError("Bad sort key in page cursor '%s'" % token)
+        return PageCursor(rank, sortKey, ties)
+
+    #-----------------------
+    # __eq__
+    #---------------
+
+    def __eq__(self, other):
+        return isinstance(other, PageCursor) and \
+            (self.rank, self.sortKey, self.ties) == (other.rank, other.sortKey, other.ties)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'PageCursor(%s, %s, %s)' % (self.rank, self.sortKey, self.ties)
+
+class RankedRows(object):
+    '''
+    Reads one page of results from a RowBatches source that
+    was asked for pageSize + 1 rows, and numbers them with
+    their global ranks. Once the page is read, nextPage is
+    the cursor for the following page, or None if this was
+    the last one.
+    '''
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, rows, firstRank=1, pageSize=None, after=None):
+        '''
+        @param rows: result rows, best first
+        @type rows: RowBatches
+        @param firstRank: rank of the first row
+        @type firstRank: int
+        @param pageSize: maximum number of rows on the page; None for all
+        @type pageSize: {int | None}
+        @param after: cursor of the previous page, if any
+        @type after: {PageCursor | None}
+        '''
+        self.rows = rows
+        self.firstRank = firstRank
+        self.pageSize = pageSize
+        self.rank = firstRank - 1
+        self.nextPage = None
+        # Sort key of the last row, and the number of rows
+        # shown so far with that key:
+        if after is not None and after.sortKey is not None:
+            (self.lastSortKey, self.ties) = (after.sortKey, after.ties)
+        else:
+            (self.lastSortKey, self.ties) = (None, 0)
+
+    #-----------------------
+    # nextBatch
+    #---------------
+
+    @gen.coroutine
+    def nextBatch(self):
+        '''
+        Next batch of (rank, resultTuple) pairs; [] when the
+        page is complete.
+        '''
+        if self.nextPage is not None:
+            raise gen.Return([])
+        batch = yield self.rows.nextBatch()
+        ranked = []
+        for resultTuple in batch:
+            if self.pageSize is not None and self.rank - self.firstRank + 1 >= self.pageSize:
+                # There are more results than fit on this page:
+                self.nextPage = PageCursor(self.rank, self.lastSortKey, self.ties)
+                break
+            self.rank += 1
+            sortKey = sortKeyOf(resultTuple)
+            if sortKey is not None and sortKey == self.lastSortKey:
+                self.ties += 1
+            else:
+                (self.lastSortKey, self.ties) = (sortKey, 1)
+            ranked.append((self.rank, resultTuple))
+        raise gen.Return(ranked)
+
+# ====================================  Utilities ================
+
+def sortKeyOf(resultTuple):
+    '''
+    Keyset paging sort key of a result row from the SQL lookup
+    (see query_planner.buildPlanQuery()): (numMatched, answer_type,
+    unique_views, total_no_upvotes, question_id). None for rows
+    that do not carry the ranking columns.
+    '''
+    if resultTuple is None or len(resultTuple) < 7:
+        return None
+    return (resultTuple[6], resultTuple[3], resultTuple[4], resultTuple[5], resultTuple[2])
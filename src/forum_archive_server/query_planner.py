@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Plans FAQ lookups for one or more request keywords. Every
+request keyword is a term that matches the posts with a
+ForumKeywords keyword containing it, ignoring case, as
+LOCATE does. The terms are combined with set semantics:
+
+    any   posts matching at least one term (union)
+    all   posts matching every term (intersection)
+
+Each post is a candidate once, however many of its keywords
+match. Candidates are ordered by the number of terms they
+match, best first, then by the ranking columns:
+
+    answer_type DESC, unique_views DESC, total_no_upvotes DESC
+
+with NULLs last, and ties broken by ascending question_id.
+rankCandidates() does this for postings that are already
+in rank order, as in the keyword index, in time linear in
+the number of postings; buildPlanQuery() does it in SQL.
+
+@author:     Andreas Paepcke
+
+'''
+
+import heapq
+
+
+MATCH_MODES = ['any', 'all']
+
+# Stands in for NULL ranking columns in keyset comparisons;
+# below any INT value, as NULLs sort last in DESC order:
+NULL_RANK = -2147483648
+
+# ====================================  Utilities ================
+
+def planTerms(keywords):
+    '''
+    The distinct terms of a request, in case-folded form,
+    in the order they were first given.
+
+    @param keywords: keywords from the request
+    @type keywords: [str]
+    @return: the terms
+    @rtype: [str]
+    '''
+    terms = []
+    for keyword in keywords:
+        term = keyword.lower()
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+def rankCandidates(termPostings, match='any', withCounts=False):
+    '''
+    Combine the postings of the terms of a request.
+
+    Postings items identify a post, and sort in rank order,
+    best first; e.g. (sortKey, question_id) pairs. Items of
+    a term may repeat, when several of a post's keywords
+    match the term.
+
+    @param termPostings: per term, an iterable of its postings
+        items in rank order
+    @type termPostings: [iterable]
+    @param match: 'any' or 'all'
+    @type match: str
+    @param withCounts: if True, return (numMatched, item) pairs
+    @type withCounts: bool
+    @return: the distinct items of the matching posts, ordered
+        by number of matched terms, then rank
+    @rtype: [<item>]
+    '''
+    if match not in MATCH_MODES:
+        raise ValueError("Match mode must be one of %s; got '%s'" % (MATCH_MODES, match))
+    termPostings = [list(postings) for postings in termPostings]
+    numTerms = len(termPostings)
+    # item --> number of terms it matches:
+    numMatched = {}
+    for postings in termPostings:
+        previous = None
+        for item in postings:
+            # Repeats of an item within a term are adjacent:
+            if item != previous:
+                numMatched[item] = numMatched.get(item, 0) + 1
+                previous = item
+    minMatched = numTerms if match == 'all' else 1
+    # Walk all postings in rank order once, dealing each
+    # item into the bucket of its match count:
+    buckets = [[] for _count in range(numTerms + 1)]
+    previous = None
+    for item in heapq.merge(*termPostings):
+        if item != previous:
+            count = numMatched[item]
+            if count >= minMatched:
+                buckets[count].append(item)
+            previous = item
+    candidates = []
+    for count in range(numTerms, 0, -1):
+        if withCounts:
+            candidates.extend((count, item) for item in buckets[count])
+        else:
+            candidates.extend(buckets[count])
+    return candidates
+
+def buildPlanQuery(keywords, limit, match='any', after=None):
+    '''
+    The SQL lookup of the posts matching the keywords, best
+    first. All keywords are passed as query parameters.
+    Result rows are:
+
+       (<questionText>,<answerText>,<questionId>,
+        <answer_type>,<unique_views>,<total_no_upvotes>,<numMatched>)
+
+    @param keywords: keywords from the request
+    @type keywords: [str]
+    @param limit: maximum number of rows
+    @type limit: int
+    @param match: 'any' or 'all'
+    @type match: str
+    @param after: continue after the result this cursor points to
+    @type after: {PageCursor | None}
+    @return: the query with %s placeholders, and its parameters
+    @rtype: (str, list)
+    '''
+    if match not in MATCH_MODES:
+        raise ValueError("Match mode must be one of %s; got '%s'" % (MATCH_MODES, match))
+    terms = planTerms(keywords)
+    # One row per term a post matches; the term numbers
+    # are generated, the terms are parameters:
+    termQueries = ['SELECT DISTINCT question_id, %d AS term FROM ForumKeywords WHERE LOCATE(%%s, keyword) > 0' % termNum
+                   for termNum in range(len(terms))]
+    params = list(terms)
+    query = '''SELECT question, answer, question_id,
+                      answer_type, unique_views, total_no_upvotes, numMatched
+                 FROM (SELECT question_id, COUNT(*) AS numMatched
+                         FROM (%s) AS termMatches
+                        GROUP BY question_id
+            ''' % '\n                               UNION ALL\n                               '.join(termQueries)
+    if match == 'all':
+        query += '''
+                       HAVING COUNT(*) = %s'''
+        params.append(len(terms))
+    query += ''') AS candidates
+                 JOIN ForumPosts
+                   ON question_id = id'''
+    if after is not None and after.sortKey is not None:
+        # Keyset paging: continue at the last result shown. The
+        # ranking columns descend, question_id ascends, and NULL
+        # would make the row comparisons NULL:
+        rankColumns = '''(numMatched,
+                          COALESCE(answer_type, %d),
+                          COALESCE(unique_views, %d),
+                          COALESCE(total_no_upvotes, %d))''' % ((NULL_RANK,) * 3)
+        query += '''
+                WHERE %s < (%%s, %%s, %%s, %%s)
+                   OR (%s = (%%s, %%s, %%s, %%s) AND question_id >= %%s)''' % (rankColumns, rankColumns)
+        rankValues = [NULL_RANK if value is None else value for value in after.sortKey[:4]]
+        params.extend(rankValues + rankValues + [after.sortKey[4]])
+        offset = after.ties
+    else:
+        offset = 0 if after is None else after.rank
+    query += '''
+                ORDER BY numMatched DESC,
+                         answer_type DESC,
+                         unique_views DESC,
+                         total_no_upvotes DESC,
+                         question_id
+                LIMIT %s OFFSET %s
+            '''
+    params.extend([limit, offset])
+    return (query, params)
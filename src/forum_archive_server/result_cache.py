@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Bounded cache for rendered FAQ lookup results, plus
+the machinery for personalizing cached pages.
+
+The wordclouds send the same few hundred keywords over
+and over. LRUCache remembers the rendered results for each
+normalized keyword list, evicting least recently used entries
+when the entry or byte budget is exceeded, and entries that
+are older than their time-to-live.
+
+Rendered results are stored as SplicedText: the HTML with
+gaps for fields that differ between uses, such as the rank of
+a cached question/answer. Those are filled in after the cache
+lookup. The fixed parts may also be kept compressed; see
+compression.py.
+
+@author:     Andreas Paepcke
+
+'''
+
+from collections import OrderedDict, namedtuple
+import threading
+import time
+
+from compression import deflateSegment
+
+
+# Rendered results of one lookup. questionIds are in rank
+# order, and are what writeResult() logs; body is a SplicedText;
+# nextPage is the PageCursor of the next page, if any, whose
+# link is rendered for each request:
+RenderedResults = namedtuple('RenderedResults', ['questionIds', 'body', 'nextPage'])
+
+class LRUCache(object):
+
+    # =============================== Methods ========================
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, maxEntries=500, ttl=3600, maxBytes=None):
+        '''
+        @param maxEntries: maximum number of cached entries
+        @type maxEntries: int
+        @param ttl: seconds after which an entry expires; None for never
+        @type ttl: {float | None}
+        @param maxBytes: maximum total of the sizes passed to put();
+            None for no byte limit
+        @type maxBytes: {int | None}
+        '''
+        if maxEntries < 1:
+            raise ValueError("maxEntries must be at least 1; got %s" % maxEntries)
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+
+        # key --> (expirationTime, size, value), least recently used first:
+        self.entries = OrderedDict()
+        self.totalBytes = 0
+        self.lock = threading.Lock()
+
+        # Incremented by invalidate(), so that results looked
+        # up before an invalidation are not cached after it:
+        self.generation = 0
+
+        self.numHits = 0
+        self.numMisses = 0
+        self.numEvictions = 0
+        self.numExpirations = 0
+
+    #-----------------------
+    # get
+    #---------------
+
+    def get(self, key):
+        '''
+        Return the value cached for key, or None.
+        '''
+        with self.lock:
+            try:
+                (expirationTime, size, value) = self.entries.pop(key)
+            except KeyError:
+                self.numMisses += 1
+                return None
+            if expirationTime is not None and time.time() >= expirationTime:
+                self.totalBytes -= size
+                self.numExpirations += 1
+                self.numMisses += 1
+                return None
+            # Re-insert as most recently used:
+            self.entries[key] = (expirationTime, size, value)
+            self.numHits += 1
+            return value
+
+    #-----------------------
+    # put
+    #---------------
+
+    def put(self, key, value, size=0, generation=None):
+        '''
+        Cache value under key, evicting least recently used
+        entries as needed to stay within the budgets. Values
+        larger than maxBytes by themselves are not cached.
+        Nor are values computed before the most recent
+        invalidate(), as indicated by generation.
+
+        @param key: cache key
+        @type key: <hashable>
+        @param value: value to cache
+        @type value: <any>
+        @param size: size of value in bytes, counted against maxBytes
+        @type size: int
+        @param generation: value of self.generation read before
+            value was computed; None to cache unconditionally
+        @type generation: {int | None}
+        '''
+        if self.maxBytes is not None and size > self.maxBytes:
+            return
+        expirationTime = None if self.ttl is None else time.time() + self.ttl
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.totalBytes -= old[1]
+            self.entries[key] = (expirationTime, size, value)
+            self.totalBytes += size
+            while len(self.entries) > self.maxEntries or \
+                  (self.maxBytes is not None and self.totalBytes > self.maxBytes):
+                (_key, (_expirationTime, evictedSize, _value)) = self.entries.popitem(last=False)
+                self.totalBytes -= evictedSize
+                self.numEvictions += 1
+
+    #-----------------------
+    # invalidate
+    #---------------
+
+    def invalidate(self):
+        '''
+        Drop all entries, e.g. after a new archive was loaded.
+        '''
+        with self.lock:
+            self.entries.clear()
+            self.totalBytes = 0
+            self.generation += 1
+
+    #-----------------------
+    # __len__
+    #---------------
+
+    def __len__(self):
+        return len(self.entries)
+
+    #-----------------------
+    # stats
+    #---------------
+
+    def stats(self):
+        '''
+        @return: dict with keys entries, bytes, hits, misses,
+            evictions, and expirations
+        @rtype: {str : int}
+        '''
+        with self.lock:
+            return {'entries'     : len(self.entries),
+                    'bytes'       : self.totalBytes,
+                    'hits'        : self.numHits,
+                    'misses'      : self.numMisses,
+                    'evictions'   : self.numEvictions,
+                    'expirations' : self.numExpirations
+                    }
+
+class SplicedText(object):
+    '''
+    Text with named gaps. Created from a string in which
+    the gaps are marked by placeholder(name). fill() then
+    joins the fixed parts with per-use values, which is far
+    cheaper than rendering the text again.
+    '''
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, text, fieldNames):
+        '''
+        @param text: text containing placeholder(name) markers
+        @type text: str
+        @param fieldNames: names of the fields whose markers
+            are to become gaps
+        @type fieldNames: [str]
+        '''
+        # Alternating fixed parts and field names:
+        # [part, name, part, name, ..., part]
+        pieces = [text]
+        for fieldName in fieldNames:
+            marker = placeholder(fieldName)
+            newPieces = []
+            for (i, piece) in enumerate(pieces):
+                if i % 2 == 1:
+                    # Already a field name:
+                    newPieces.append(piece)
+                    continue
+                parts = piece.split(marker)
+                newPieces.append(parts[0])
+                for part in parts[1:]:
+                    newPieces.append(fieldName)
+                    newPieces.append(part)
+            pieces = newPieces
+        self.parts = pieces[0::2]
+        self.fieldNames = pieces[1::2]
+        self.length = sum(len(part) for part in self.parts)
+        # Set by deflated():
+        self.deflatedParts = None
+
+    #-----------------------
+    # fill
+    #---------------
+
+    def fill(self, **values):
+        '''
+        Return the text with each gap replaced by the
+        value given for its field.
+        '''
+        result = [self.parts[0]]
+        for (fieldName, part) in zip(self.fieldNames, self.parts[1:]):
+            result.append(values[fieldName])
+            result.append(part)
+        return ''.join(result)
+
+    #-----------------------
+    # deflated
+    #---------------
+
+    def deflated(self, level=6):
+        '''
+        The fixed parts as deflate segments, for gzipPieces().
+        They are compressed on the first call only; later calls
+        return the same segments, whatever their level.
+
+        @param level: zlib compression level
+        @type level: int
+        @return: a deflate segment per part
+        @rtype: [str]
+        '''
+        if self.deflatedParts is None:
+            self.deflatedParts = [deflateSegment(part, level) for part in self.parts]
+        return self.deflatedParts
+
+    #-----------------------
+    # deflatedLength
+    #---------------
+
+    def deflatedLength(self):
+        '''
+        Size of the deflate segments; 0 until deflated() is called.
+        '''
+        if self.deflatedParts is None:
+            return 0
+        return sum(len(segment) for segment in self.deflatedParts)
+
+    #-----------------------
+    # __len__
+    #---------------
+
+    def __len__(self):
+        '''
+        Length of the fixed parts.
+        '''
+        return self.length
+
+# ====================================  Utilities ================
+
+def placeholder(fieldName):
+    '''
+    Marker for a gap in text that becomes a SplicedText.
+    Uses characters that cannot occur in HTML.
+    '''
+    return '\x00%s\x00' % fieldName
+
+def normalizeKeywords(keywords):
+    '''
+    Cache key for a list of request keywords. Each keyword
+    is a term of the lookup (see query_planner.py), so their
+    order and repetition do not matter. Case is folded, as
+    in MySQL's default collations.
+
+    @param keywords: keywords from the request
+    @type keywords: [str]
+    @return: hashable cache key
+    @rtype: (str)
+    '''
+    return tuple(sorted(set(keyword.lower() for keyword in keywords)))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Sources of FAQ lookup result rows, delivered in batches.
+Each source's nextBatch() is a coroutine that runs the blocking
+db work in the query_executor thread pool, and resolves to
+a list of (<questionText>,<answerText>,<questionId>) tuples;
+an empty list once all rows were delivered. close() returns
+any checked out connection to the pool.
+
+    QueryRows         runs the query, and delivers all its rows
+                      as a single batch.
+    StreamedQueryRows reads the query's rows through an unbuffered,
+                      server-side cursor, batchSize rows at a time,
+                      so that memory stays bounded no matter how
+                      many posts match.
+    IndexedPostRows   plans the lookup with the keyword index, then
+                      fetches the bodies of the posts it found,
+                      batchSize posts at a time. Planning also runs
+                      in the thread pool: a short term walks much
+                      of the index.
+
+@author:     Andreas Paepcke
+
+'''
+
+import time
+
+from MySQLdb.cursors import SSCursor
+from tornado import gen
+
+
+class RowBatches(object):
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, db_pool, query_executor):
+        '''
+        @param db_pool: pool from which to check out connections
+        @type db_pool: MySQLConnectionPool
+        @param query_executor: thread pool for the blocking db calls
+        @type query_executor: concurrent.futures.ThreadPoolExecutor
+        '''
+        self.db_pool = db_pool
+        self.query_executor = query_executor
+        self.done = False
+        # If set, the time of each fetch is recorded
+        # as stage 'query':
+        self.metrics = None
+        self.numFetches = 0
+
+    #-----------------------
+    # nextBatch
+    #---------------
+
+    @gen.coroutine
+    def nextBatch(self):
+        '''
+        Next batch of result rows; [] when all were delivered.
+        '''
+        if self.done:
+            raise gen.Return([])
+        if self.metrics is None:
+            batch = yield self.query_executor.submit(self.fetchInThread)
+        else:
+            batch = yield self.query_executor.submit(self.timedFetchInThread)
+        if len(batch) == 0:
+            self.done = True
+        raise gen.Return(batch)
+
+    #-----------------------
+    # timedFetchInThread
+    #---------------
+
+    def timedFetchInThread(self):
+        '''
+        fetchInThread(), timed. Excludes the wait for
+        a query_executor thread. Fetches after the first are
+        only recorded if they return rows; the empty one at
+        the end of the rows does no db work for most sources.
+        '''
+        startTime = time.time()
+        batch = self.fetchInThread()
+        self.numFetches += 1
+        if self.numFetches == 1 or len(batch) > 0:
+            self.metrics.observeStage('query', time.time() - startTime)
+        return batch
+
+    #-----------------------
+    # fetchInThread
+    #---------------
+
+    def fetchInThread(self):
+        '''
+        Called in a query_executor thread to fetch the next batch.
+        '''
+        raise NotImplementedError("Subclasses must implement fetchInThread()")
+
+    #-----------------------
+    # close
+    #---------------
+
+    def close(self):
+        '''
+        Release db resources. Safe to call more than once, and
+        before all batches were read.
+        '''
+        self.done = True
+
+class QueryRows(RowBatches):
+
+    def __init__(self, db_pool, query_executor, query, params=None, transform=None):
+        '''
+        @param transform: if provided, called in the query_executor
+            thread with the list of all rows; its result is delivered
+            instead of the rows
+        @type transform: {function | None}
+        '''
+        super(QueryRows, self).__init__(db_pool, query_executor)
+        self.query = query
+        self.params = params
+        self.transform = transform
+        self.delivered = False
+
+    def fetchInThread(self):
+        if self.delivered:
+            return []
+        self.delivered = True
+        rows = self.db_pool.withConnection(drainQuery, self.query, self.params)
+        if self.transform is not None:
+            rows = self.transform(rows)
+        return rows
+
+class StreamedQueryRows(RowBatches):
+
+    def __init__(self, db_pool, query_executor, query, params, batchSize):
+        super(StreamedQueryRows, self).__init__(db_pool, query_executor)
+        self.query = query
+        self.params = params
+        self.batchSize = batchSize
+        self.mysqlDb = None
+        self.cursor = None
+
+    def fetchInThread(self):
+        if self.cursor is None:
+            # The connection stays checked out until
+            # all rows were read, or close() is called:
+            self.mysqlDb = self.db_pool.acquire()
+            try:
+                self.cursor = self.mysqlDb.connection.cursor(SSCursor)
+                self.cursor.execute(self.query, self.params)
+            except Exception:
+                self.closeInThread()
+                raise
+        batch = list(self.cursor.fetchmany(self.batchSize))
+        if len(batch) == 0:
+            self.closeInThread()
+        return batch
+
+    def close(self):
+        super(StreamedQueryRows, self).close()
+        if self.mysqlDb is not None:
+            # Closing an unbuffered cursor before all rows were read
+            # makes the driver skip the rest; keep that off the IOLoop:
+            self.query_executor.submit(self.closeInThread)
+
+    def closeInThread(self):
+        (cursor, mysqlDb) = (self.cursor, self.mysqlDb)
+        (self.cursor, self.mysqlDb) = (None, None)
+        if mysqlDb is None:
+            return
+        broken = False
+        try:
+            if cursor is not None:
+                cursor.close()
+        except Exception:
+            broken = True
+        self.db_pool.release(mysqlDb, discard=broken)
+
+class IndexedPostRows(RowBatches):
+
+    def __init__(self, db_pool, query_executor, keyword_index, planQuestionIds, batchSize):
+        '''
+        @param keyword_index: index that plans the lookup
+        @type keyword_index: KeywordIndex
+        @param planQuestionIds: function returning the question_ids
+            of the results in rank order; called in the first fetch
+        @type planQuestionIds: callable
+        @param batchSize: posts per batch; 0 for all in one batch
+        @type batchSize: int
+        '''
+        super(IndexedPostRows, self).__init__(db_pool, query_executor)
+        self.keyword_index = keyword_index
+        self.planQuestionIds = planQuestionIds
+        self.questionIds = None
+        self.batchSize = batchSize
+        self.nextPos = 0
+
+    def fetchInThread(self):
+        if self.questionIds is None:
+            self.questionIds = self.planQuestionIds()
+            if self.batchSize <= 0:
+                self.batchSize = max(1, len(self.questionIds))
+        # Posts deleted since the index was loaded yield
+        # no rows; an empty batch would end the results:
+        batch = []
+        while len(batch) == 0 and self.nextPos < len(self.questionIds):
+            batchIds = self.questionIds[self.nextPos:self.nextPos + self.batchSize]
+            self.nextPos += len(batchIds)
+            batch = self.db_pool.withConnection(self.keyword_index.fetchPosts, batchIds)
+        return batch
+
+# ====================================  Utilities ================
+
+def drainQuery(mysqlDb, query, params=None):
+    '''
+    Run query, and return all its result rows as a list.
+    Query parameters are marked by %s, as in MySQLdb.
+    '''
+    if params is None:
+        return list(mysqlDb.query(query))
+    cursor = mysqlDb.connection.cursor()
+    try:
+        cursor.execute(query, params)
+        return list(cursor.fetchall())
+    finally:
+        cursor.close()
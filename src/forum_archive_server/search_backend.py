@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Search backends answer the FAQ lookups of the server. Each
+backend's lookup() returns a RowBatches source (see
+row_batches.py) of result rows, best first, beginning with:
+
+    (<questionText>,<answerText>,<questionId>, ...)
+
+Rows with exactly three columns make page cursors count
+ranks; the MySQL backend's SQL lookup appends the columns of
+its sort key, for keyset paging (see paging.py).
+
+    MySQLSearchBackend   the ForumKeywords/ForumPosts lookup planned
+                         by query_planner.py, optionally through
+                         the keyword index, the materialized
+                         results, and feedback re-ranking.
+    SQLiteSearchBackend  full-text search over question and answer
+                         bodies in an embedded SQLite FTS5 index;
+                         see sqlite_search.py.
+    SnapshotSearchBackend the keyword lookup over a memory-mapped,
+                         read-only snapshot of the archive; see
+                         archive_snapshot.py.
+
+@author:     Andreas Paepcke
+
+'''
+
+from feedback_scores import RankBlend
+from query_planner import buildPlanQuery
+from row_batches import IndexedPostRows, QueryRows, StreamedQueryRows, drainQuery
+
+
+class SearchBackend(object):
+
+    #-----------------------
+    # lookup
+    #---------------
+
+    def lookup(self, keywords, limit, after=None, match='any'):
+        '''
+        Find the posts matching the keywords, best first.
+
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
+        @param limit: maximum number of rows to deliver
+        @type limit: int
+        @param after: continue after the result this cursor points to
+        @type after: {PageCursor | None}
+        @param match: whether posts must match 'any' or 'all' keywords
+        @type match: str
+        @return: source of (<questionText>,<answerText>,<questionId>, ...) tuples
+        @rtype: RowBatches
+        '''
+        raise NotImplementedError("Subclasses must implement lookup()")
+
+    #-----------------------
+    # bestPosts
+    #---------------
+
+    def bestPosts(self, numPosts):
+        '''
+        The best-ranked posts regardless of keywords, for
+        warming caches. Blocks; called in a query_executor thread.
+
+        @param numPosts: maximum number of posts
+        @type numPosts: int
+        @return: (<questionText>,<answerText>,<questionId>) tuples
+        @rtype: [tuple]
+        '''
+        return []
+
+    #-----------------------
+    # close
+    #---------------
+
+    def close(self):
+        '''
+        Release resources held by the backend.
+        '''
+        pass
+
+class MySQLSearchBackend(SearchBackend):
+
+    BEST_POSTS_QUERY = '''SELECT question, answer, id
+                            FROM ForumPosts
+                           ORDER BY answer_type DESC,
+                                    unique_views DESC,
+                                    total_no_upvotes DESC,
+                                    id
+                           LIMIT %s
+                       '''
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self,
+                 db_pool,
+                 query_executor,
+                 keyword_index=None,
+                 materialized_results=None,
+                 row_batch_size=0,
+                 feedback_scores=None,
+                 rank_blend=None,
+                 rerank_depth=0):
+        '''
+        @param db_pool: connection pool shared by all requests
+        @type db_pool: MySQLConnectionPool
+        @param query_executor: thread pool for the blocking db calls
+        @type query_executor: concurrent.futures.ThreadPoolExecutor
+        @param keyword_index: if provided, lookups are answered from
+            this in-memory index once it is loaded
+        @type keyword_index: {KeywordIndex | None}
+        @param materialized_results: if provided, single-keyword lookups
+            are answered from the materialized results while they are fresh
+        @type materialized_results: {MaterializedResults | None}
+        @param row_batch_size: if positive, rows are delivered in batches
+            of this size; else all rows come as one batch
+        @type row_batch_size: int
+        @param feedback_scores: if provided, the best rerank_depth results
+            of each lookup are re-ranked by these scores
+        @type feedback_scores: {FeedbackScores | None}
+        @param rank_blend: weights for re-ranking; None for the defaults
+        @type rank_blend: {RankBlend | None}
+        @param rerank_depth: number of best results that are re-ranked
+        @type rerank_depth: int
+        '''
+        self.db_pool = db_pool
+        self.query_executor = query_executor
+        self.keyword_index = keyword_index
+        self.materialized_results = materialized_results
+        self.row_batch_size = row_batch_size
+        self.feedback_scores = feedback_scores
+        self.rank_blend = rank_blend or RankBlend()
+        self.rerank_depth = rerank_depth
+
+    #-----------------------
+    # lookup
+    #---------------
+
+    def lookup(self, keywords, limit, after=None, match='any'):
+        '''
+        Find the posts matching the keywords, best first, as
+        planned by query_planner.py. The rows are delivered in
+        batches of row_batch_size rows; if that is 0, all rows
+        come as one batch.
+
+        Rows from the SQL lookup carry the columns of the sort
+        key after the question ID, so that page cursors can be
+        built from them:
+
+           (<questionText>,<answerText>,<questionId>,
+            <answer_type>,<unique_views>,<total_no_upvotes>,<numMatched>)
+
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
+        @param limit: maximum number of rows to deliver
+        @type limit: int
+        @param after: continue after the result this cursor points to
+        @type after: {PageCursor | None}
+        @param match: whether posts must match 'any' or 'all' keywords
+        @type match: str
+        @return: source of (<questionText>,<answerText>,<questionId>, ...) tuples
+        @rtype: RowBatches
+        '''
+        keyword_index = self.keyword_index
+        offset = 0 if after is None else after.rank
+        if self.feedback_scores is not None and offset < self.rerank_depth:
+            return self.lookupReranked(keywords, limit, offset, match)
+        materialized_results = self.materialized_results
+        if materialized_results is not None and (after is None or after.sortKey is None) and \
+           materialized_results.covers(keywords, offset, limit):
+            # Precomputed ranking; an indexed equality lookup.
+            # Pages of sort key cursors stay on the live query,
+            # whose order of ties may differ. With a single term,
+            # 'any' and 'all' are the same:
+            (query, params) = materialized_results.buildQuery(keywords[0], offset, limit)
+            return QueryRows(self.db_pool, self.query_executor, query, params)
+        if keyword_index is not None and keyword_index.isLoaded():
+            # Matching posts come from memory; only their
+            # bodies are fetched from the db by primary key:
+            def planQuestionIds():
+                # Runs in a query_executor thread:
+                return keyword_index.lookup(keywords, match)[offset:offset + limit]
+            return IndexedPostRows(self.db_pool, self.query_executor, keyword_index, planQuestionIds,
+                                   self.row_batch_size)
+
+        (query, params) = buildPlanQuery(keywords, limit, match, after)
+        if self.row_batch_size > 0:
+            return StreamedQueryRows(self.db_pool, self.query_executor, query, params, self.row_batch_size)
+        return QueryRows(self.db_pool, self.query_executor, query, params)
+
+    #-----------------------
+    # bestPosts
+    #---------------
+
+    def bestPosts(self, numPosts):
+        return self.db_pool.withConnection(drainQuery, MySQLSearchBackend.BEST_POSTS_QUERY, [numPosts])
+
+    #-----------------------
+    # lookupReranked
+    #---------------
+
+    def lookupReranked(self, keywords, limit, offset, match='any'):
+        '''
+        Like lookup(), but the best rerank_depth results are
+        re-ranked by the feedback scores, blended with the ranking
+        columns as rank_blend says. Results beyond rerank_depth
+        keep their order. Uses no SQL beyond that of the lookup
+        itself.
+
+        The rows are (<questionText>,<answerText>,<questionId>),
+        so that page cursors use ranks rather than sort keys.
+
+        @param keywords: The keyword(s) passed from the browser.
+        @type keywords: [string]
+        @param limit: maximum number of rows to deliver
+        @type limit: int
+        @param offset: number of best results to skip
+        @type offset: int
+        @param match: whether posts must match 'any' or 'all' keywords
+        @type match: str
+        @return: source of (<questionText>,<answerText>,<questionId>) tuples
+        @rtype: RowBatches
+        '''
+        keyword_index = self.keyword_index
+        feedback_scores = self.feedback_scores
+        blend = self.rank_blend
+        depth = self.rerank_depth
+        numCandidates = max(depth, offset + limit)
+
+        if keyword_index is not None and keyword_index.isLoaded():
+            def planQuestionIds():
+                # Runs in a query_executor thread:
+                candidates = keyword_index.lookupWithColumns(keywords, match)[:numCandidates]
+                questionIds = feedback_scores.rerank(keywords[0],
+                                                     [candidate + (candidate[0],) for candidate in candidates[:depth]],
+                                                     blend)
+                questionIds.extend([candidate[0] for candidate in candidates[depth:]])
+                return questionIds[offset:offset + limit]
+            return IndexedPostRows(self.db_pool,
+                                   self.query_executor,
+                                   keyword_index,
+                                   planQuestionIds,
+                                   self.row_batch_size)
+
+        def rerankRows(rows):
+            # Runs in a query_executor thread:
+            ranked = feedback_scores.rerank(keywords[0],
+                                            [(row[2], row[3], row[4], row[5], row[6], row[:3]) for row in rows[:depth]],
+                                            blend)
+            ranked.extend([row[:3] for row in rows[depth:]])
+            return ranked[offset:offset + limit]
+        (query, params) = buildPlanQuery(keywords, numCandidates, match)
+        return QueryRows(self.db_pool, self.query_executor, query, params, transform=rerankRows)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Search backend over an embedded SQLite FTS5 index of the
+question and answer bodies of ForumPosts. It needs no MySQL
+server, and does not use ForumKeywords: each request keyword
+matches the words of the bodies that start with it, and the
+results are ranked by BM25, with matches in the question
+counting QUESTION_WEIGHT times those in the answer. Ties
+are broken by the ranking columns of the MySQL lookup.
+
+The index is a single file, written once from MySQL by
+running this module as a script:
+
+    sqlite_search.py --db ForumArchive forum_archive.sqlite
+
+The export writes to a temporary file, and renames it when
+complete, so a running server never sees a partial index.
+
+@author:     Andreas Paepcke
+
+'''
+
+import argparse
+import datetime
+import getpass
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+from db_pool import MySQLConnectionPool, readMySQLPwd
+from row_batches import RowBatches
+from search_backend import SearchBackend
+
+
+CREATE_TABLE = '''CREATE VIRTUAL TABLE ForumPostsText USING fts5(
+                      question,
+                      answer,
+                      question_id UNINDEXED,
+                      answer_type UNINDEXED,
+                      unique_views UNINDEXED,
+                      total_no_upvotes UNINDEXED,
+                      tokenize = 'unicode61'
+                  )'''
+
+EXPORT_QUERY = '''SELECT question, answer, id, answer_type, unique_views, total_no_upvotes
+                    FROM ForumPosts'''
+
+# BM25 weight of question matches relative to answer matches:
+QUESTION_WEIGHT = 2.0
+
+class SQLiteSearchBackend(SearchBackend):
+
+    LOOKUP_QUERY = '''SELECT question, answer, question_id
+                        FROM ForumPostsText
+                       WHERE ForumPostsText MATCH ?
+                       ORDER BY bm25(ForumPostsText, %s, 1.0),
+                                answer_type DESC,
+                                unique_views DESC,
+                                total_no_upvotes DESC,
+                                question_id
+                       LIMIT ? OFFSET ?
+                   ''' % QUESTION_WEIGHT
+
+    BEST_POSTS_QUERY = '''SELECT question, answer, question_id
+                            FROM ForumPostsText
+                           ORDER BY answer_type DESC,
+                                    unique_views DESC,
+                                    total_no_upvotes DESC,
+                                    question_id
+                           LIMIT ?
+                       '''
+
+    #-----------------------
+    # Constructor
+    #---------------
+
+    def __init__(self, path, query_executor):
+        '''
+        @param path: index file written by exportArchive()
+        @type path: str
+        @param query_executor: thread pool in which the searches run
+        @type query_executor: concurrent.futures.ThreadPoolExecutor
+        @raise IOError: if there is no index at path
+        '''
+        if not os.path.exists(path):
+            raise IOError("No full-text index at '%s'; create one with sqlite_search.py" % path)
+        self.path = path
+        self.query_executor = query_executor
+        # One connection per query_executor thread:
+        self.local = threading.local()
+        self.connections = []
+        self.connectionsLock = threading.Lock()
+
+    #-----------------------
+    # lookup
+    #---------------
+
+    def lookup(self, keywords, limit, after=None, match='any'):
+        '''
+        Find the posts whose bodies contain words that start
+        with any, or all, of the keywords, best first. Rows are
+        (<questionText>,<answerText>,<questionId>), so page
+        cursors count ranks.
+        '''
+        offset = 0 if after is None else after.rank
+        return FullTextRows(self, matchExpression(keywords, match), limit, offset)
+
+    #-----------------------
+    # search
+    #---------------
+
+    def search(self, expression, limit, offset):
+        '''
+        Run a search in the calling thread.
+
+        @param expression: FTS5 query; None matches nothing
+        @type expression: {str | None}
+        @return: (<questionText>,<answerText>,<questionId>) tuples
+        @rtype: [tuple]
+        '''
+        if expression is None:
+            return []
+        return self.connection().execute(SQLiteSearchBackend.LOOKUP_QUERY, (expression, limit, offset)).fetchall()
+
+    #-----------------------
+    # bestPosts
+    #---------------
+
+    def bestPosts(self, numPosts):
+        return self.connection().execute(SQLiteSearchBackend.BEST_POSTS_QUERY, (numPosts,)).fetchall()
+
+    #-----------------------
+    # connection
+    #---------------
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.local.connection = connection
+            with self.connectionsLock:
+                self.connections.append(connection)
+        return connection
+
+    #-----------------------
+    # close
+    #---------------
+
+    def close(self):
+        with self.connectionsLock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+
+class FullTextRows(RowBatches):
+
+    def __init__(self, backend, expression, limit, offset):
+        super(FullTextRows, self).__init__(None, backend.query_executor)
+        self.backend = backend
+        self.expression = expression
+        self.limit = limit
+        self.offset = offset
+        self.delivered = False
+
+    def fetchInThread(self):
+        if self.delivered:
+            return []
+        self.delivered = True
+        return self.backend.search(self.expression, self.limit, self.offset)
+
+# ====================================  Utilities ================
+
+def matchExpression(keywords, match='any'):
+    '''
+    FTS5 query that matches words starting with any, or all,
+    of the keywords. Keywords of several words match as phrases;
+    punctuation is dropped, as the tokenizer drops it.
+
+    @param keywords: The keyword(s) passed from the browser.
+    @type keywords: [string]
+    @param match: 'any' or 'all'
+    @type match: str
+    @return: the query; None if no keyword contains a word
+    @rtype: {str | None}
+    '''
+    terms = []
+    for keyword in keywords:
+        if isinstance(keyword, str):
+            keyword = keyword.decode('utf-8', 'replace')
+        words = re.findall(r'\w+', keyword, re.UNICODE)
+        if len(words) > 0:
+            terms.append('"%s"*' % ' '.join(words))
+    if len(terms) == 0:
+        return None
+    return (' AND ' if match == 'all' else ' OR ').join(terms)
+
+def exportArchive(mysqlDb, path, batchSize=1000):
+    '''
+    Write the full-text index of all ForumPosts to path,
+    replacing any index there.
+
+    @param mysqlDb: open connection
+    @type mysqlDb: MySQLDB
+    @param path: index file to write
+    @type path: str
+    @param batchSize: rows per insert
+    @type batchSize: int
+    @return: number of posts exported
+    @rtype: int
+    '''
+    tmpPath = path + '.tmp'
+    if os.path.exists(tmpPath):
+        os.remove(tmpPath)
+    connection = sqlite3.connect(tmpPath)
+    numPosts = 0
+    try:
+        connection.execute(CREATE_TABLE)
+        insert = 'INSERT INTO ForumPostsText VALUES (?,?,?,?,?,?)'
+        batch = []
+        for row in mysqlDb.query(EXPORT_QUERY):
+            # sqlite3 refuses 8-bit str; hand it unicode:
+            batch.append([unicodeText(value) for value in row])
+            if len(batch) >= batchSize:
+                connection.executemany(insert, batch)
+                numPosts += len(batch)
+                batch = []
+        connection.executemany(insert, batch)
+        numPosts += len(batch)
+        # Merge the index segments for faster searches:
+        connection.execute("INSERT INTO ForumPostsText (ForumPostsText) VALUES ('optimize')")
+        connection.commit()
+    finally:
+        connection.close()
+    os.rename(tmpPath, path)
+    return numPosts
+
+def unicodeText(value):
+    '''
+    A db value for sqlite3: str is decoded as UTF-8, with
+    undecodable bytes replaced; other values are returned
+    unchanged.
+    '''
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return value
+
+# ====================================  Main ================
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     description='Export ForumPosts into the SQLite full-text index '
+                                                 'used by --search-backend sqlite.')
+    parser.add_argument('--db',
+                        default='ForumArchive',
+                        help='MySQL database holding ForumPosts (default: %(default)s)')
+    parser.add_argument('path',
+                        help='Index file to write')
+    args = parser.parse_args(argv)
+
+    db_pool = MySQLConnectionPool(user=getpass.getuser(),
+                                  passwd=readMySQLPwd(),
+                                  db=args.db,
+                                  minSize=0,
+                                  maxSize=1)
+    try:
+        numPosts = db_pool.withConnection(exportArchive, args.path)
+    finally:
+        db_pool.close()
+    sys.stdout.write('%s info: Exported %s posts to %s.\n' % (datetime.datetime.now(), numPosts, args.path))
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Static assets prepared for serving: the landing page, the
+style sheets, scripts, and wordclouds are copied into one
+directory by running this module as a script:
+
+    static_assets.py --out-dir static
+
+and served from there with --static-dir static. Each asset
+other than an HTML page also gets a copy whose name carries
+a hash of its content:
+
+    css/landing.css  -->  css/landing.3f2a9c01b7de.css
+
+References to assets in the pages and style sheets are
+rewritten to those names. Since their content never changes,
+hashed names are sent with an immutable Cache-Control, so
+browsers do not even revalidate them; pages are revalidated
+by ETag on every hit. The hashed name of each asset is listed
+in the manifest assets.json.
+
+Next to each file go a gzip variant <file>.gz, and a brotli
+variant <file>.br if requested, unless they are not smaller
+than the file. PrecompressedStaticHandler sends the variant
+that the browser accepts, so there is no compression work
+at request time.
+
+@author:     Andreas Paepcke
+
+'''
+
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import sys
+import urlparse
+
+from tornado.web import StaticFileHandler
+
+
+# Files and directories copied from the source directory:
+ASSET_SOURCES = ['index.html', 'css', 'js', 'wordclouds']
+ASSET_TYPES   = ['.html', '.css', '.js', '.json', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.ico']
+
+MANIFEST_FILE = 'assets.json'
+
+# Content encodings in order of preference, and
+# the suffixes of their variants:
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# A variant is only kept if it is at most this
+# fraction of the size of the file:
+MAX_VARIANT_RATIO = 0.9
+
+HASH_LENGTH = 12
+HASHED_NAME = re.compile(r'\.[0-9a-f]{%s}\.\w+$' % HASH_LENGTH)
+
+HTML_REFERENCE = re.compile(r'''(\b(?:src|href)\s*=\s*)(["'])([^"']*)\2''', re.IGNORECASE)
+CSS_REFERENCE  = re.compile(r'''(url\(\s*)(["']?)([^"')]*)\2''', re.IGNORECASE)
+
+class PrecompressedStaticHandler(StaticFileHandler):
+    '''
+    Serves the output of buildAssets(). Of each file, the
+    variant with the most preferred encoding that the request's
+    Accept-Encoding allows is sent. Hashed names are cached for
+    a year without revalidation; other files are revalidated by
+    ETag on every hit.
+    '''
+
+    # Seconds hashed names may be cached:
+    IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(PrecompressedStaticHandler, self).validate_absolute_path(root, absolute_path)
+        self.identityPath = absolute_path
+        self.contentEncoding = None
+        if absolute_path is None:
+            return None
+        accepted = acceptedEncodings(self.request.headers.get('Accept-Encoding', ''))
+        for (encoding, suffix) in ENCODINGS:
+            if encoding in accepted and os.path.isfile(absolute_path + suffix):
+                self.contentEncoding = encoding
+                return absolute_path + suffix
+        return absolute_path
+
+    def get_content_type(self):
+        # The type of the content, not of its variant:
+        (mimeType, _encoding) = mimetypes.guess_type(self.identityPath)
+        return mimeType or 'application/octet-stream'
+
+    def get_cache_time(self, path, modified, mime_type):
+        return PrecompressedStaticHandler.IMMUTABLE_MAX_AGE if HASHED_NAME.search(path) else 0
+
+    def set_extra_headers(self, path):
+        self.set_header('Vary', 'Accept-Encoding')
+        if self.contentEncoding is not None:
+            self.set_header('Content-Encoding', self.contentEncoding)
+        if HASHED_NAME.search(path):
+            self.set_header('Cache-Control', 'public, max-age=%s, immutable' % PrecompressedStaticHandler.IMMUTABLE_MAX_AGE)
+        else:
+            self.set_header('Cache-Control', 'no-cache')
+
+# ====================================  Utilities ================
+
+def acceptedEncodings(acceptEncoding):
+    '''
+    The content encodings an Accept-Encoding header allows.
+
+    @param acceptEncoding: header value, such as 'gzip, deflate;q=0.5'
+    @type acceptEncoding: str
+    @return: the encodings, lower case, whose quality is not 0
+    @rtype: set
+    '''
+    accepted = set()
+    for part in acceptEncoding.split(','):
+        fields = part.split(';')
+        encoding = fields[0].strip().lower()
+        quality = 1.0
+        for param in fields[1:]:
+            (name, _sep, value) = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if len(encoding) > 0 and quality > 0:
+            accepted.add(encoding)
+    if '*' in accepted:
+        accepted.update([encoding for (encoding, _suffix) in ENCODINGS])
+    return accepted
+
+def loadManifest(staticDir):
+    '''
+    @return: URL path of each asset --> URL path of its hashed name;
+        empty if staticDir has no manifest
+    @rtype: {str : str}
+    '''
+    path = os.path.join(staticDir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifestFile:
+        return dict((str(url), str(hashedUrl)) for (url, hashedUrl) in json.load(manifestFile).items())
+
+def assetFiles(sourceDir):
+    '''
+    @return: paths relative to sourceDir of the files to serve
+    @rtype: [str]
+    '''
+    paths = []
+    for source in ASSET_SOURCES:
+        sourcePath = os.path.join(sourceDir, source)
+        if os.path.isfile(sourcePath):
+            paths.append(source)
+            continue
+        for (dirPath, _dirNames, fileNames) in os.walk(sourcePath):
+            for fileName in fileNames:
+                if os.path.splitext(fileName)[1].lower() in ASSET_TYPES:
+                    paths.append(os.path.relpath(os.path.join(dirPath, fileName), sourceDir))
+    return sorted(paths)
+
+def hashedName(path, content):
+    '''
+    @return: path with a hash of content before its extension
+    @rtype: str
+    '''
+    (stem, extension) = os.path.splitext(path)
+    return '%s.%s%s' % (stem, hashlib.sha1(content).hexdigest()[:HASH_LENGTH], extension)
+
+def rewriteReferences(content, url, pattern, hashedUrls):
+    '''
+    Replace the references in content to assets that have
+    hashed names by those names.
+
+    @param content: text of a page or style sheet
+    @type content: str
+    @param url: URL path of the page or style sheet
+    @type url: str
+    @param pattern: regular expression whose third group is a reference
+    @type pattern: re.RegexObject
+    @param hashedUrls: URL path of each asset --> of its hashed name
+    @type hashedUrls: {str : str}
+    @return: the rewritten text
+    @rtype: str
+    '''
+    def rewrite(referenceMatch):
+        (prefix, quote, reference) = referenceMatch.groups()
+        hashedUrl = hashedUrls.get(urlparse.urljoin(url, reference))
+        if hashedUrl is None:
+            # Other hosts, queries, and pages stay as they are:
+            return referenceMatch.group(0)
+        return prefix + quote + hashedUrl + quote
+    return pattern.sub(rewrite, content)
+
+def compressVariants(path, content, useBrotli=False):
+    '''
+    Write the compressed variants of the file at path.
+
+    @return: number of variants written
+    @rtype: int
+    '''
+    numVariants = 0
+    with open(path + '.gz', 'wb') as variantFile:
+        # A fixed mtime gives the same bytes for the same content:
+        gzipFile = gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=variantFile, mtime=0)
+        gzipFile.write(content)
+        gzipFile.close()
+    if os.path.getsize(path + '.gz') <= MAX_VARIANT_RATIO * len(content):
+        numVariants += 1
+    else:
+        os.remove(path + '.gz')
+    if useBrotli:
+        import brotli
+        compressed = brotli.compress(content, quality=11)
+        if len(compressed) <= MAX_VARIANT_RATIO * len(content):
+            with open(path + '.br', 'wb') as variantFile:
+                variantFile.write(compressed)
+            numVariants += 1
+    return numVariants
+
+def buildAssets(sourceDir, outDir, useBrotli=False):
+    '''
+    Copy the assets of sourceDir into outDir, with hashed names,
+    rewritten references, and compressed variants; see above.
+    outDir is replaced once the build is complete.
+
+    @param sourceDir: directory holding ASSET_SOURCES
+    @type sourceDir: str
+    @param outDir: directory to write
+    @type outDir: str
+    @param useBrotli: whether to write brotli variants too
+    @type useBrotli: bool
+    @return: number of files, and of variants written
+    @rtype: (int, int)
+    @raise ValueError: if useBrotli, and brotli is not installed
+    '''
+    if useBrotli:
+        try:
+            import brotli
+        except ImportError:
+            raise ValueError("Brotli variants require the brotli package.")
+    paths = assetFiles(sourceDir)
+    contents = {}
+    for path in paths:
+        with open(os.path.join(sourceDir, path), 'rb') as assetFile:
+            contents[path] = assetFile.read()
+
+    # Hash what refers to nothing, then style sheets, which
+    # refer to images, then rewrite the pages, which keep
+    # their names:
+    hashedUrls = {}
+    kinds = [([path for path in paths if not path.endswith(('.css', '.html'))], None),
+             ([path for path in paths if path.endswith('.css')], CSS_REFERENCE),
+             ([path for path in paths if path.endswith('.html')], HTML_REFERENCE)]
+    for (kindPaths, referencePattern) in kinds:
+        for path in kindPaths:
+            url = '/' + path.replace(os.path.sep, '/')
+            if referencePattern is not None:
+                contents[path] = rewriteReferences(contents[path], url, referencePattern, hashedUrls)
+            if not path.endswith('.html'):
+                hashedUrls[url] = hashedName(url, contents[path])
+
+    tmpDir = outDir.rstrip(os.path.sep) + '.tmp'
+    if os.path.exists(tmpDir):
+        shutil.rmtree(tmpDir)
+    numVariants = 0
+    for path in paths:
+        url = '/' + path.replace(os.path.sep, '/')
+        names = [path]
+        if url in hashedUrls:
+            names.append(hashedUrls[url][1:].replace('/', os.path.sep))
+        for name in names:
+            outPath = os.path.join(tmpDir, name)
+            if not os.path.isdir(os.path.dirname(outPath)):
+                os.makedirs(os.path.dirname(outPath))
+            with open(outPath, 'wb') as outFile:
+                outFile.write(contents[path])
+            numVariants += compressVariants(outPath, contents[path], useBrotli)
+    with open(os.path.join(tmpDir, MANIFEST_FILE), 'w') as manifestFile:
+        json.dump(hashedUrls, manifestFile, indent=1, sort_keys=True)
+
+    if os.path.exists(outDir):
+        oldDir = outDir.rstrip(os.path.sep) + '.old'
+        if os.path.exists(oldDir):
+            shutil.rmtree(oldDir)
+        os.rename(outDir, oldDir)
+        os.rename(tmpDir, outDir)
+        shutil.rmtree(oldDir)
+    else:
+        os.rename(tmpDir, outDir)
+    return (len(paths), numVariants)
+
+# ====================================  Main ================
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     description='Prepare the static files for --static-dir: hashed '
+                                                 'names, and precompressed variants.')
+    parser.add_argument('--source-dir',
+                        default=os.path.dirname(os.path.abspath(__file__)),
+                        help='Directory holding %s (default: %%(default)s)' % ', '.join(ASSET_SOURCES))
+    parser.add_argument('--out-dir',
+                        default='static',
+                        help='Directory to write; replaced when complete (default: %(default)s)')
+    parser.add_argument('--brotli',
+                        action='store_true',
+                        help='Also write brotli variants; requires the brotli package')
+    args = parser.parse_args(argv)
+
+    try:
+        (numFiles, numVariants) = buildAssets(args.source_dir, args.out_dir, args.brotli)
+    except ValueError as e:
+        sys.stderr.write('%s\n' % str(e))
+        return 2
+    sys.stdout.write('Wrote %s files and %s compressed variants to %s.\n' % (numFiles, numVariants, args.out_dir))
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())
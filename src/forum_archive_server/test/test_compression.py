@@ -0,0 +1,84 @@
+'''
+Tests for gzipPieces(): the gzip file it concatenates from
+deflate segments must decompress, byte for byte, to the same
+text as a gzip file of the full response body, with the same
+CRC and length in its trailer. The compressed data themselves
+differ from those of one-shot compression by the sync flush
+that ends each segment.
+
+The server modules are Python 2; under Python 3 the
+tests are skipped.
+
+@author:     Andreas Paepcke
+'''
+
+import gzip
+import os
+import random
+import sys
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    from StringIO import StringIO
+    from compression import constantSegment, deflateSegment, gzipPieces, splicedPieces
+    from result_cache import SplicedText, placeholder
+except (ImportError, SyntaxError) as e:
+    raise unittest.SkipTest("Server modules not importable: %s" % repr(e))
+
+
+def gzipOf(text):
+    '''
+    Reference: the text gzipped in one piece by the gzip module.
+    '''
+    buf = StringIO()
+    gzipFile = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+    gzipFile.write(text)
+    gzipFile.close()
+    return buf.getvalue()
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data), mode='rb').read()
+
+class GzipPiecesTest(unittest.TestCase):
+
+    def setUp(self):
+        rand = random.Random(815)
+        words = ['<pre class="prettyprint">', 'convolution', 'relu', '\n', '</pre>', 'caf\xc3\xa9', ' ']
+        self.texts = [''.join(rand.choice(words) for _ in range(rand.randint(0, 400))) for _ in range(8)]
+        # One empty piece, which has an empty segment:
+        self.texts[3] = ''
+
+    def assertSameAsGzipOf(self, gzipped, body):
+        reference = gzipOf(body)
+        self.assertEqual(gunzip(gzipped), body)
+        self.assertEqual(zlib.decompress(gzipped, 16 + zlib.MAX_WBITS), body)
+        # CRC32 and length of the body:
+        self.assertEqual(gzipped[-8:], reference[-8:])
+        # Magic number and compression method:
+        self.assertEqual(gzipped[:3], reference[:3])
+
+    def testSegments(self):
+        for level in [1, 6, 9]:
+            pieces = [(text, deflateSegment(text, level)) for text in self.texts]
+            self.assertSameAsGzipOf(gzipPieces(pieces, level), ''.join(self.texts))
+
+    def testUncompressedPieces(self):
+        # Every other piece is compressed by gzipPieces() itself:
+        pieces = [(text, None if i % 2 == 1 else constantSegment(text)) for (i, text) in enumerate(self.texts)]
+        self.assertSameAsGzipOf(gzipPieces(pieces), ''.join(self.texts))
+
+    def testEmpty(self):
+        self.assertSameAsGzipOf(gzipPieces([]), '')
+        self.assertSameAsGzipOf(gzipPieces([('', None)]), '')
+
+    def testSplicedText(self):
+        template = '<ol>%s</ol>' % ''.join('<li id="%s">%s</li>' % (placeholder('rank'), text) for text in self.texts)
+        splicedText = SplicedText(template, ['rank'])
+        pieces = splicedPieces(splicedText, 6, rank='17')
+        self.assertSameAsGzipOf(gzipPieces(pieces), splicedText.fill(rank='17'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+'''
+Tests for parseFeedback(), which checks the feedback values
+that browsers send before they are stored or logged.
+
+The server modules are Python 2; under Python 3 the
+tests are skipped.
+
+@author:     Andreas Paepcke
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    from feedback_store import FEEDBACK_VALUES, MAX_SESSION_ID_LEN, MAX_UID_LEN, parseFeedback
+except (ImportError, SyntaxError) as e:
+    raise unittest.SkipTest("Server modules not importable: %s" % repr(e))
+
+
+class ParseFeedbackTest(unittest.TestCase):
+
+    def testAccepts(self):
+        for feedback in FEEDBACK_VALUES:
+            self.assertEqual(parseFeedback('%s,1508259512.53,3,u42' % feedback),
+                             (feedback, '1508259512.53', 3, 'u42'))
+
+    def testEmptyUid(self):
+        self.assertEqual(parseFeedback('Not,s1,1,'), ('Not', 's1', 1, ''))
+
+    def testUidWithCommas(self):
+        # Only the first three commas separate fields:
+        self.assertEqual(parseFeedback('Partial,s1,2,a,b'), ('Partial', 's1', 2, 'a,b'))
+
+    def testLongestFields(self):
+        session_id = 's' * MAX_SESSION_ID_LEN
+        uid = 'u' * MAX_UID_LEN
+        self.assertEqual(parseFeedback('Completely,%s,1,%s' % (session_id, uid)),
+                         ('Completely', session_id, 1, uid))
+
+    def testRejects(self):
+        for value in ['',
+                      'Not',
+                      'Not,s1,1',
+                      'not,s1,1,u1',
+                      'Maybe,s1,1,u1',
+                      'Not,s1,first,u1',
+                      'Not,s1,,u1',
+                      'Not,%s,1,u1' % ('s' * (MAX_SESSION_ID_LEN + 1)),
+                      'Not,s1,1,%s' % ('u' * (MAX_UID_LEN + 1))]:
+            self.assertRaises(ValueError, parseFeedback, value)
+
+if __name__ == "__main__":
+    unittest.main()
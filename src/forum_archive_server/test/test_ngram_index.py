@@ -0,0 +1,129 @@
+'''
+Correctness tests for the n-gram SubstringIndex: its matches
+must be exactly the keywords that the SQL lookup's
+LOCATE('<substring>', keyword) > 0 would find.
+
+The tests compare against a brute-force reference implementation
+of LOCATE over synthetic vocabularies. If a MySQL 'unittest'
+database with a ForumKeywords table is reachable, results are
+also compared with LOCATE as evaluated by MySQL itself.
+
+@author:     Andreas Paepcke
+'''
+
+import os
+import random
+import string
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ngram_index import SubstringIndex
+
+
+VOCABULARY = ['convolution', 'convnet', 'Convolutional', 'conv', 'matrix',
+              'minute', 'relu', 'leaky relu', 'softmax', 'max pooling',
+              'a', 'aa', 'aaa', 'banana', 'x']
+
+def locate(substring, keywords, caseSensitive=False):
+    '''
+    Reference semantics of LOCATE(substring, keyword) > 0
+    '''
+    if caseSensitive:
+        return set(keyword for keyword in keywords if substring in keyword)
+    return set(keyword for keyword in keywords if substring.lower() in keyword.lower())
+
+class SubstringIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SubstringIndex(VOCABULARY)
+
+    def testPrefix(self):
+        self.assertEqual(self.index.matches('conv'),
+                         set(['convolution', 'convnet', 'Convolutional', 'conv']))
+
+    def testInfix(self):
+        self.assertEqual(self.index.matches('olut'), set(['convolution', 'Convolutional']))
+        self.assertEqual(self.index.matches('max'), set(['softmax', 'max pooling']))
+
+    def testCaseInsensitive(self):
+        self.assertEqual(self.index.matches('CONVOLUTION'), set(['convolution', 'Convolutional']))
+        self.assertEqual(self.index.equals('Matrix'), set(['matrix']))
+
+    def testCaseSensitive(self):
+        index = SubstringIndex(VOCABULARY, caseSensitive=True)
+        self.assertEqual(index.matches('Conv'), set(['Convolutional']))
+        self.assertEqual(index.equals('Matrix'), set())
+
+    def testGramsPresentButNotAdjacent(self):
+        # All trigrams of 'nanaba' occur in 'banana', but
+        # 'nanaba' itself does not:
+        self.assertEqual(self.index.matches('nanaba'), set())
+        self.assertEqual(self.index.matches('anana'), set(['banana']))
+
+    def testRepeatedCharacters(self):
+        self.assertEqual(self.index.matches('aa'), set(['aa', 'aaa']))
+        self.assertEqual(self.index.matches('aaaa'), set())
+
+    def testEmptyAndMissing(self):
+        self.assertEqual(self.index.matches(''), set(VOCABULARY))
+        self.assertEqual(self.index.matches('zebra'), set())
+        self.assertEqual(SubstringIndex([]).matches('conv'), set())
+
+    def testRandomAgainstReference(self):
+        rand = random.Random(4711)
+        alphabet = 'abcdeAB '
+        vocabulary = set(''.join(rand.choice(alphabet) for _ in range(rand.randint(1, 12)))
+                         for _ in range(2000))
+        for gramLength in (1, 2, 3, 4):
+            for caseSensitive in (False, True):
+                index = SubstringIndex(vocabulary, gramLength=gramLength, caseSensitive=caseSensitive)
+                for _ in range(300):
+                    substring = ''.join(rand.choice(alphabet) for _ in range(rand.randint(0, 7)))
+                    self.assertEqual(index.matches(substring),
+                                     locate(substring, vocabulary, caseSensitive),
+                                     "Mismatch for '%s' (gramLength=%s, caseSensitive=%s)" %\
+                                     (substring, gramLength, caseSensitive))
+
+class SubstringIndexMySQLTest(unittest.TestCase):
+    '''
+    Compares with MySQL's own LOCATE on the unittest db.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from pymysql_utils.pymysql_utils import MySQLDB
+            cls.mysqlDb = MySQLDB(user='unittest', db='unittest')
+            cls.vocabulary = [row[0] for row in cls.mysqlDb.query('SELECT DISTINCT keyword FROM ForumKeywords')]
+        except Exception as e:
+            raise unittest.SkipTest("No MySQL unittest db with ForumKeywords available: %s" % repr(e))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mysqlDb.close()
+
+    def sqlLocate(self, substring):
+        cursor = self.mysqlDb.connection.cursor()
+        try:
+            cursor.execute('SELECT DISTINCT keyword FROM ForumKeywords WHERE LOCATE(%s, keyword) > 0', (substring,))
+            return set(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+
+    def testAgainstSQL(self):
+        index = SubstringIndex(self.vocabulary)
+        rand = random.Random(4711)
+        substrings = ['conv', 'a', 'the', 'relu', '']
+        # Substrings of actual keywords, plus random ones:
+        for keyword in rand.sample(self.vocabulary, min(200, len(self.vocabulary))):
+            start = rand.randint(0, max(0, len(keyword) - 1))
+            substrings.append(keyword[start:start + rand.randint(1, 6)])
+        substrings.extend(''.join(rand.choice(string.ascii_lowercase) for _ in range(3)) for _ in range(50))
+        for substring in substrings:
+            self.assertEqual(index.matches(substring), self.sqlLocate(substring),
+                             "Mismatch with SQL LOCATE for '%s'" % substring)
+
+if __name__ == "__main__":
+    unittest.main()
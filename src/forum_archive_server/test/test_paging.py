@@ -0,0 +1,132 @@
+'''
+Tests for result paging: PageCursor must survive the round
+trip through the 'after' URL argument, reject malformed
+cursors, and the cursors that RankedRows hands out must
+continue the SQL lookup of query_planner.buildPlanQuery()
+exactly where the previous page ended, with ranks that
+continue across pages.
+
+The SQL runs on an in-memory SQLite db, as in
+test_query_planner.py. The server modules are Python 2;
+under Python 3 the tests are skipped.
+
+@author:     Andreas Paepcke
+'''
+
+import base64
+import json
+import os
+import random
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    from tornado import gen
+    from paging import PageCursor, RankedRows
+    from query_planner import buildPlanQuery
+except (ImportError, SyntaxError) as e:
+    raise unittest.SkipTest("Server modules not importable: %s" % repr(e))
+
+
+KEYWORDS = ['convolution', 'convnet', 'matrix', 'relu', 'leaky relu', 'softmax']
+
+class ListRows(object):
+    '''
+    RowBatches over a list of rows, in batches of batchSize.
+    '''
+
+    def __init__(self, rows, batchSize=2):
+        self.rows = list(rows)
+        self.batchSize = batchSize
+
+    @gen.coroutine
+    def nextBatch(self):
+        (batch, self.rows) = (self.rows[:self.batchSize], self.rows[self.batchSize:])
+        raise gen.Return(batch)
+
+def locate(substring, text):
+    return text.lower().find(substring.lower()) + 1
+
+class PageCursorTest(unittest.TestCase):
+
+    def testRoundTrip(self):
+        for cursor in [PageCursor(0),
+                       PageCursor(20),
+                       PageCursor(20, (2, 1, 340, 7, '4711'), 1),
+                       PageCursor(40, (1, None, None, 0, '17'), 3)]:
+            token = cursor.encode()
+            self.assertEqual(PageCursor.decode(token), cursor)
+            # Must fit into a URL argument unquoted:
+            self.assertTrue(all(c.isalnum() or c in '.-_=' for c in token), token)
+
+    def testRejects(self):
+        goodKey = base64.urlsafe_b64encode(json.dumps([1, 1, 1, 1, '1']))
+        shortKey = base64.urlsafe_b64encode(json.dumps([1, 1, 1, '1']))
+        notJson = base64.urlsafe_b64encode('not json')
+        for token in ['', 'x', '-1', '3.1', '3.1.2.4', '-3.1.' + goodKey, '3.0.' + goodKey,
+                      '3.1.!!!', '3.1.' + shortKey, '3.1.' + notJson]:
+            self.assertRaises(ValueError, PageCursor.decode, token)
+
+class KeysetContinuationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.create_function('LOCATE', 2, locate)
+        self.connection.execute('''CREATE TABLE ForumPosts (id TEXT PRIMARY KEY, question TEXT, answer TEXT,
+                                                            answer_type INT, unique_views INT, total_no_upvotes INT)''')
+        self.connection.execute('CREATE TABLE ForumKeywords (question_id TEXT, keyword TEXT)')
+        rand = random.Random(1742)
+        # Few distinct column values, so that many posts tie:
+        for postNum in range(50):
+            (answer_type, unique_views, total_no_upvotes) = [rand.choice([None, 0, 1]) for _ in range(3)]
+            question_id = str(postNum)
+            self.connection.execute('INSERT INTO ForumPosts VALUES (?,?,?,?,?,?)',
+                                    (question_id, 'q', 'a', answer_type, unique_views, total_no_upvotes))
+            for keyword in rand.sample(KEYWORDS, rand.randint(1, 3)):
+                self.connection.execute('INSERT INTO ForumKeywords VALUES (?,?)', (question_id, keyword))
+
+    def tearDown(self):
+        self.connection.close()
+
+    def sqlLookup(self, keywords, limit, after=None):
+        (query, params) = buildPlanQuery(keywords, limit, 'any', after)
+        return self.connection.execute(query.replace('%s', '?'), params).fetchall()
+
+    def readPage(self, keywords, pageSize, after):
+        '''
+        One result page as the server reads it: pageSize + 1
+        rows, cut to a page by RankedRows.
+        '''
+        firstRank = 1 if after is None else after.rank + 1
+        ranked = RankedRows(ListRows(self.sqlLookup(keywords, pageSize + 1, after)), firstRank, pageSize, after)
+        page = []
+        while True:
+            batch = ranked.nextBatch().result()
+            if len(batch) == 0:
+                break
+            page.extend(batch)
+        return (page, ranked.nextPage)
+
+    def testPagesAddUp(self):
+        for keywords in [['conv'], ['relu', 'matrix'], ['conv', 'max', 'relu']]:
+            allRows = self.sqlLookup(keywords, 1000)
+            for pageSize in [1, 4, 9]:
+                ranked = []
+                after = None
+                while True:
+                    (page, nextPage) = self.readPage(keywords, pageSize, after)
+                    self.assertTrue(len(page) <= pageSize)
+                    ranked.extend(page)
+                    if nextPage is None:
+                        break
+                    # As the server gets it back from the 'More results' link:
+                    after = PageCursor.decode(nextPage.encode())
+                self.assertEqual([rank for (rank, _row) in ranked], list(range(1, len(allRows) + 1)))
+                self.assertEqual([row[2] for (_rank, row) in ranked], [row[2] for row in allRows],
+                                 "Pages of %s differ for %s" % (pageSize, keywords))
+
+if __name__ == "__main__":
+    unittest.main()
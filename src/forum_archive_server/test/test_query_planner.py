@@ -0,0 +1,102 @@
+'''
+Consistency tests for the two ways of planning a FAQ lookup:
+the SQL of query_planner.buildPlanQuery(), and the in-memory
+KeywordIndex. Both must return the same posts in the same
+order, including posts that tie on all ranking columns or
+have NULL ones, and keyset pages of the SQL lookup must add
+up to the full result.
+
+The SQL runs on an in-memory SQLite db, with LOCATE supplied
+as a Python function; SQLite, like MySQL, sorts NULLs last
+in DESC order.
+
+@author:     Andreas Paepcke
+'''
+
+from collections import namedtuple
+import os
+import random
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from keyword_index import KeywordIndex
+from query_planner import buildPlanQuery
+
+
+KEYWORDS = ['convolution', 'convnet', 'matrix', 'relu', 'leaky relu', 'softmax']
+
+# The PageCursor fields that buildPlanQuery() reads:
+Cursor = namedtuple('Cursor', ['rank', 'sortKey', 'ties'])
+
+class SQLiteDb(object):
+    '''
+    Runs MySQLDB.query() calls on SQLite.
+    '''
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def query(self, query):
+        return self.connection.execute(query).fetchall()
+
+def locate(substring, text):
+    return text.lower().find(substring.lower()) + 1
+
+class PlanConsistencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.create_function('LOCATE', 2, locate)
+        self.connection.execute('''CREATE TABLE ForumPosts (id TEXT PRIMARY KEY, question TEXT, answer TEXT,
+                                                            answer_type INT, unique_views INT, total_no_upvotes INT)''')
+        self.connection.execute('CREATE TABLE ForumKeywords (question_id TEXT, keyword TEXT)')
+        rand = random.Random(4711)
+        # Few distinct column values, so that many posts tie:
+        for postNum in range(60):
+            (answer_type, unique_views, total_no_upvotes) = [rand.choice([None, 0, 1, 2]) for _ in range(3)]
+            question_id = str(rand.randint(0, 10 ** rand.randint(1, 4)) * 100 + postNum)
+            self.connection.execute('INSERT INTO ForumPosts VALUES (?,?,?,?,?,?)',
+                                    (question_id, 'q', 'a', answer_type, unique_views, total_no_upvotes))
+            for keyword in rand.sample(KEYWORDS, rand.randint(1, 3)):
+                self.connection.execute('INSERT INTO ForumKeywords VALUES (?,?)', (question_id, keyword))
+        self.index = KeywordIndex()
+        self.index.load(SQLiteDb(self.connection))
+
+    def tearDown(self):
+        self.connection.close()
+
+    def sqlLookup(self, keywords, limit, match='any', after=None):
+        (query, params) = buildPlanQuery(keywords, limit, match, after)
+        return self.connection.execute(query.replace('%s', '?'), params).fetchall()
+
+    def requests(self):
+        for keywords in [['conv'], ['relu'], ['RELU', 'matrix'], ['conv', 'max', 'relu'], ['zebra']]:
+            for match in ['any', 'all']:
+                yield (keywords, match)
+
+    def testSameOrder(self):
+        for (keywords, match) in self.requests():
+            self.assertEqual([row[2] for row in self.sqlLookup(keywords, 1000, match)],
+                             self.index.lookup(keywords, match),
+                             "Plans differ for %s, match '%s'" % (keywords, match))
+
+    def testKeysetPages(self):
+        for (keywords, match) in self.requests():
+            for pageSize in [1, 3, 7]:
+                questionIds = []
+                after = None
+                while True:
+                    rows = self.sqlLookup(keywords, pageSize, match, after)
+                    questionIds.extend(row[2] for row in rows)
+                    if len(rows) < pageSize:
+                        break
+                    lastRow = rows[-1]
+                    after = Cursor(len(questionIds), (lastRow[6], lastRow[3], lastRow[4], lastRow[5], lastRow[2]), 1)
+                self.assertEqual(questionIds, self.index.lookup(keywords, match),
+                                 "Pages of %s differ for %s, match '%s'" % (pageSize, keywords, match))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+'''
+Tests for the result cache: LRU eviction within the entry
+and byte budgets, expiration, and generations across
+invalidate(); and SplicedText, whose fill() must produce
+the text that rendering with the field values would.
+
+The server modules are Python 2; under Python 3 the
+tests are skipped.
+
+@author:     Andreas Paepcke
+'''
+
+import os
+import sys
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try:
+    from result_cache import LRUCache, SplicedText, normalizeKeywords, placeholder
+except (ImportError, SyntaxError) as e:
+    raise unittest.SkipTest("Server modules not importable: %s" % repr(e))
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def testHitAndMiss(self):
+        cache = LRUCache(maxEntries=2)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def testEvictsLeastRecentlyUsed(self):
+        cache = LRUCache(maxEntries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # Makes 'b' the least recently used:
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def testByteBudget(self):
+        cache = LRUCache(maxEntries=10, maxBytes=100)
+        cache.put('a', 'A', 60)
+        cache.put('b', 'B', 30)
+        self.assertEqual(cache.stats()['bytes'], 90)
+        cache.put('c', 'C', 30)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['bytes'], 60)
+        # Too large by itself; evicts nothing:
+        cache.put('d', 'D', 101)
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual(len(cache), 2)
+
+    def testReplaceKeepsByteCount(self):
+        cache = LRUCache(maxBytes=100)
+        cache.put('a', 'A', 60)
+        cache.put('a', 'AA', 70)
+        self.assertEqual(cache.get('a'), 'AA')
+        self.assertEqual(cache.stats()['bytes'], 70)
+
+    def testExpiration(self):
+        cache = LRUCache(ttl=0, maxBytes=100)
+        cache.put('a', 1, 10)
+        self.assertIsNone(cache.get('a'))
+        stats = cache.stats()
+        self.assertEqual((stats['expirations'], stats['bytes'], stats['entries']), (1, 0, 0))
+
+    def testStaleGeneration(self):
+        cache = LRUCache()
+        generation = cache.generation
+        cache.put('a', 1)
+        cache.invalidate()
+        self.assertIsNone(cache.get('a'))
+        # Computed before the invalidation:
+        cache.put('b', 2, generation=generation)
+        self.assertIsNone(cache.get('b'))
+        cache.put('b', 2, generation=cache.generation)
+        self.assertEqual(cache.get('b'), 2)
+
+    def testNormalizeKeywords(self):
+        self.assertEqual(normalizeKeywords(['ReLU', 'conv', 'relu']),
+                         normalizeKeywords(['conv', 'relu']))
+
+class SplicedTextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.template = 'rank %s: <b>q</b> %s, again rank %s'
+        self.text = SplicedText(self.template % (placeholder('rank'), placeholder('uid'), placeholder('rank')),
+                                ['rank', 'uid'])
+
+    def testFill(self):
+        self.assertEqual(self.text.fill(rank='7', uid='u1'), self.template % ('7', 'u1', '7'))
+        self.assertEqual(self.text.fill(rank='12', uid=''), self.template % ('12', '', '12'))
+
+    def testParts(self):
+        self.assertEqual(self.text.fieldNames, ['rank', 'uid', 'rank'])
+        self.assertEqual(len(self.text), len(self.template % ('', '', '')))
+
+    def testNoGaps(self):
+        text = SplicedText('<p>no gaps</p>', ['rank'])
+        self.assertEqual(text.fill(), '<p>no gaps</p>')
+
+    def testDeflated(self):
+        self.assertEqual(self.text.deflatedLength(), 0)
+        segments = self.text.deflated(6)
+        self.assertEqual(len(segments), len(self.text.parts))
+        self.assertEqual(self.text.deflatedLength(), sum(len(segment) for segment in segments))
+        for (part, segment) in zip(self.text.parts, segments):
+            self.assertEqual(zlib.decompressobj(-zlib.MAX_WBITS).decompress(segment), part)
+
+if __name__ == "__main__":
+    unittest.main()
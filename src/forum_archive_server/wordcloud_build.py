@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# encoding: utf-8
+'''
+Builds the wordcloud pages served under /wordclouds, one
+directory per week:
+
+    <week>/wordcloud.jpg   the cloud
+    <week>/index.html      the image, and a map with one area
+                           per keyword that looks up its FAQs
+    <week>/keywords.json   manifest of the keywords and their
+                           weights, most frequent first
+
+A week is given as <name>=<first>[-<last>]: the keywords of
+the posts whose --week-column lies in that range, weighted by
+the number of such posts. <name>=all takes all posts:
+
+    wordcloud_build.py --db ForumArchive week1-3=1-3 week4=4 consolidated=all
+
+Rendering the clouds requires the wordcloud package. Pages
+made elsewhere, such as at WordClouds.com, are compacted in
+place with --compact, keeping their image:
+
+    wordcloud_build.py --compact wordclouds/week4 wordclouds/week5
+
+Either way, each keyword gets one area, whose link is relative
+to the server rather than naming its host, and the clicks of
+all areas are handled by one listener on the map. Weeks are
+built in parallel by a process pool.
+
+@author:     Andreas Paepcke
+
+'''
+
+import argparse
+import cgi
+from collections import OrderedDict
+import getpass
+import json
+import multiprocessing
+import os
+import re
+import sys
+import urllib
+import urlparse
+
+from archive_snapshot import utf8
+from db_pool import MySQLConnectionPool, readMySQLPwd
+from row_batches import drainQuery
+
+
+KEYWORD_COUNTS_QUERY = '''SELECT keyword, COUNT(DISTINCT question_id) AS numPosts
+                            FROM ForumKeywords
+                            JOIN ForumPosts
+                              ON question_id = id
+                            %s
+                           GROUP BY keyword
+                           ORDER BY numPosts DESC, keyword
+                           LIMIT %%s'''
+
+WEEK_SPEC = re.compile(r'^([\w.-]+)=(?:(all)|(\d+)(?:-(\d+))?)$')
+
+AREA_TAG  = re.compile(r'<area\b[^>]*>', re.IGNORECASE)
+ATTRIBUTE = re.compile(r'\b([\w-]+)\s*=\s*"([^"]*)"')
+TITLE     = re.compile(r'<title>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+IMAGE_SRC = re.compile(r'<img\b[^>]*?\bsrc\s*=\s*"([^"]*)"', re.IGNORECASE)
+
+IMAGE_FILE    = 'wordcloud.jpg'
+PAGE_FILE     = 'index.html'
+MANIFEST_FILE = 'keywords.json'
+
+PAGE_HEAD = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%(title)s</title>
+<script type="text/javascript" src="../../js/wordclouds.js"></script>
+</head>
+<body style="margin:0; background-color: #808080">
+<img alt="Word Cloud" src="%(image)s"%(size)s usemap="#wordCloudMap">
+<map name="wordCloudMap" onclick="mapClick(event)">
+'''
+PAGE_FOOT = '''</map>
+</body>
+</html>
+'''
+
+# ====================================  Utilities ================
+
+def parseWeekSpec(spec):
+    '''
+    @param spec: <name>=<first>[-<last>], or <name>=all
+    @type spec: str
+    @return: name, and first and last week; None for all weeks
+    @rtype: (str, {int | None}, {int | None})
+    @raise ValueError: if spec is malformed
+    '''
+    specMatch = WEEK_SPEC.match(spec)
+    if specMatch is None:
+        raise ValueError("Week must be <name>=<first>[-<last>] or <name>=all; got '%s'" % spec)
+    (name, allWeeks, first, last) = specMatch.groups()
+    if allWeeks is not None:
+        return (name, None, None)
+    first = int(first)
+    last = first if last is None else int(last)
+    if last < first:
+        raise ValueError("Week range of '%s' ends before it starts" % spec)
+    return (name, first, last)
+
+def keywordCounts(mysqlDb, weekColumn, first, last, maxWords):
+    '''
+    The most frequent keywords of the posts of some weeks.
+
+    @param mysqlDb: open connection
+    @type mysqlDb: MySQLDB
+    @param weekColumn: ForumPosts column holding the week of a post
+    @type weekColumn: str
+    @param first: first week; None for all posts
+    @type first: {int | None}
+    @param last: last week
+    @type last: {int | None}
+    @param maxWords: maximum number of keywords
+    @type maxWords: int
+    @return: keywords, and their numbers of posts, most frequent first
+    @rtype: [(str, int)]
+    '''
+    if first is None:
+        return drainQuery(mysqlDb, KEYWORD_COUNTS_QUERY % '', [maxWords])
+    # The column name is checked by main(); the weeks are parameters:
+    weekCondition = 'WHERE %s BETWEEN %%s AND %%s' % weekColumn
+    return drainQuery(mysqlDb, KEYWORD_COUNTS_QUERY % weekCondition, [first, last, maxWords])
+
+def renderCloud(counts, width, height, fontPath=None):
+    '''
+    Lay out and draw a wordcloud of the keywords.
+
+    @param counts: keywords and their weights
+    @type counts: [(str, int)]
+    @return: the image, and the keywords with the rectangles
+        (left, top, right, bottom) they were drawn in
+    @rtype: (PIL.Image.Image, [(str, (int, int, int, int))])
+    @raise ValueError: if the wordcloud package is not installed
+    '''
+    try:
+        from PIL import ImageDraw, ImageFont
+        from wordcloud import WordCloud
+    except ImportError:
+        raise ValueError("Rendering wordclouds requires the wordcloud package; "
+                         "use --compact for pages made elsewhere.")
+    # A fixed seed gives the same cloud for the same counts:
+    cloud = WordCloud(width=width,
+                      height=height,
+                      scale=1,
+                      font_path=fontPath,
+                      background_color='gray',
+                      max_words=len(counts),
+                      random_state=0)
+    cloud.generate_from_frequencies(dict(counts))
+    image = cloud.to_image()
+    draw = ImageDraw.Draw(image)
+    areas = []
+    # Positions are (row, column) of the top left corner:
+    for ((keyword, _frequency), fontSize, (top, left), orientation, _color) in cloud.layout_:
+        font = ImageFont.TransposedFont(ImageFont.truetype(cloud.font_path, fontSize), orientation=orientation)
+        (boxWidth, boxHeight) = draw.textsize(keyword, font=font)
+        areas.append((keyword, (left, top, left + boxWidth, top + boxHeight)))
+    return (image, areas)
+
+def buildWeek(args):
+    '''
+    Process pool task: render and write the page of one week.
+
+    @param args: output directory, week name, keyword counts,
+        image width and height, and font file
+    @type args: (str, str, [(str, int)], int, int, {str | None})
+    @return: the week name, number of areas, and page size in bytes
+    @rtype: (str, int, int)
+    '''
+    (outDir, name, counts, width, height, fontPath) = args
+    (image, areas) = renderCloud(counts, width, height, fontPath)
+    weekDir = os.path.join(outDir, name)
+    if not os.path.isdir(weekDir):
+        os.makedirs(weekDir)
+    imagePath = os.path.join(weekDir, IMAGE_FILE)
+    image.save(imagePath + '.tmp', 'JPEG', quality=85)
+    os.rename(imagePath + '.tmp', imagePath)
+    weights = dict(counts)
+    numBytes = writePage(weekDir,
+                         name,
+                         IMAGE_FILE,
+                         [(keyword, 'rect', coords) for (keyword, coords) in areas],
+                         [(keyword, weights[keyword]) for (keyword, _coords) in areas],
+                         image.size)
+    return (name, len(areas), numBytes)
+
+def compactPage(pageDir):
+    '''
+    Process pool task: rewrite the page in pageDir with one
+    area per keyword and place. The page is first saved as
+    index.htmlORIG, unless that file exists, as does
+    makeAnswersOpenInSameTab.sh.
+
+    @param pageDir: directory of a wordcloud page
+    @type pageDir: str
+    @return: the directory, number of areas, and page size in bytes
+    @rtype: (str, int, int)
+    '''
+    pagePath = os.path.join(pageDir, PAGE_FILE)
+    with open(pagePath) as pageFile:
+        page = pageFile.read()
+    origPath = pagePath + 'ORIG'
+    if not os.path.exists(origPath):
+        with open(origPath, 'w') as origFile:
+            origFile.write(page)
+    titleMatch = TITLE.search(page)
+    imageMatch = IMAGE_SRC.search(page)
+    # (keyword, shape, coords) --> weight, in page order:
+    areas = OrderedDict()
+    for tag in AREA_TAG.findall(page):
+        attributes = dict((name.lower(), value) for (name, value) in ATTRIBUTE.findall(tag))
+        query = attributes.get('href', '').replace('&amp;', '&').partition('?')[2]
+        keywords = urlparse.parse_qs(query).get('keyword')
+        coords = attributes.get('coords')
+        if keywords is None or coords is None:
+            continue
+        area = (keywords[0], attributes.get('shape', 'rect'), tuple(int(coord) for coord in coords.split(',')))
+        # WordClouds.com puts a keyword's weight in the alt text:
+        alt = attributes.get('alt', '')
+        areas.setdefault(area, int(alt) if alt.isdigit() else None)
+    # Keywords in several places appear once in the manifest:
+    weights = OrderedDict()
+    for ((keyword, _shape, _coords), weight) in areas.items():
+        weights.setdefault(keyword, weight)
+    numBytes = writePage(pageDir,
+                         titleMatch.group(1).strip() if titleMatch else cgi.escape(os.path.basename(pageDir)),
+                         imageMatch.group(1) if imageMatch else IMAGE_FILE,
+                         areas.keys(),
+                         weights.items())
+    return (pageDir, len(areas), numBytes)
+
+def writePage(pageDir, title, image, areas, weights, size=None):
+    '''
+    Write the page and the manifest of a wordcloud.
+
+    @param pageDir: directory of the page
+    @type pageDir: str
+    @param title: page title, as HTML
+    @type title: str
+    @param image: image file, relative to the page
+    @type image: str
+    @param areas: keyword, shape, and coordinates of each area
+    @type areas: [(str, str, (int, ...))]
+    @param weights: keywords and their weights, or None if unknown
+    @type weights: [(str, {int | None})]
+    @param size: width and height of the image, if known
+    @type size: {(int, int) | None}
+    @return: size of the page in bytes
+    @rtype: int
+    '''
+    lines = [PAGE_HEAD % {'title' : title,
+                          'image' : cgi.escape(image, True),
+                          'size'  : '' if size is None else ' width="%s" height="%s"' % size}]
+    for (keyword, shape, coords) in areas:
+        keyword = utf8(keyword)
+        href = '/serveFaqs?' + urllib.urlencode([('req', 'getFaqs'), ('keyword', keyword)])
+        lines.append('<area shape="%s" coords="%s" href="%s" alt="%s">\n' %\
+                     (shape, ','.join(str(coord) for coord in coords), cgi.escape(href, True), cgi.escape(keyword, True)))
+    lines.append(PAGE_FOOT)
+    page = ''.join(lines)
+    ranked = sorted(weights, key=lambda keywordWeight: -(keywordWeight[1] or 0))
+    manifest = json.dumps({'image'    : image,
+                           'keywords' : [{'keyword' : keyword, 'weight' : weight} for (keyword, weight) in ranked]},
+                          separators=(',', ':'))
+    writeFile(os.path.join(pageDir, MANIFEST_FILE), manifest)
+    writeFile(os.path.join(pageDir, PAGE_FILE), page)
+    return len(page)
+
+def writeFile(path, text):
+    '''
+    Replace the file at path, so that the server never
+    sends a partial file.
+    '''
+    with open(path + '.tmp', 'w') as outFile:
+        outFile.write(text)
+    os.rename(path + '.tmp', path)
+
+def runTasks(task, tasks, processes=1):
+    '''
+    Run task on each of tasks, in parallel if processes > 1.
+
+    @return: the results of the tasks, in order
+    @rtype: list
+    '''
+    if processes > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(processes, len(tasks)))
+        try:
+            return pool.map(task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return [task(oneTask) for oneTask in tasks]
+
+# ====================================  Main ================
+
+def main(argv=None):
+    '''Command line options.'''
+
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog=os.path.basename(sys.argv[0]),
+                                     description='Build the wordcloud pages of weeks from the keyword '
+                                                 'frequencies in ForumKeywords, or compact existing pages.')
+    parser.add_argument('weeks',
+                        nargs='+',
+                        help='Weeks as <name>=<first>[-<last>] or <name>=all; with --compact, '
+                             'directories of existing pages')
+    parser.add_argument('--compact',
+                        action='store_true',
+                        help='Rewrite existing pages with one area per keyword, keeping their images')
+    parser.add_argument('--db',
+                        default='ForumArchive',
+                        help='MySQL database holding ForumPosts and ForumKeywords (default: %(default)s)')
+    parser.add_argument('--week-column',
+                        default='week',
+                        help='ForumPosts column holding the week of each post (default: %(default)s)')
+    parser.add_argument('--out-dir',
+                        default='wordclouds',
+                        help='Directory holding a directory per week (default: %(default)s)')
+    parser.add_argument('--max-words',
+                        type=int,
+                        default=200,
+                        help='Keywords per wordcloud (default: %(default)s)')
+    parser.add_argument('--width',
+                        type=int,
+                        default=1024,
+                        help='Image width in pixels (default: %(default)s)')
+    parser.add_argument('--height',
+                        type=int,
+                        default=768,
+                        help='Image height in pixels (default: %(default)s)')
+    parser.add_argument('--font',
+                        help='TrueType font file; default: the font of the wordcloud package')
+    parser.add_argument('--processes',
+                        type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='Weeks built in parallel (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.compact:
+        for pageDir in args.weeks:
+            if not os.path.exists(os.path.join(pageDir, PAGE_FILE)):
+                parser.error("No %s in '%s'" % (PAGE_FILE, pageDir))
+        results = runTasks(compactPage, args.weeks, args.processes)
+    else:
+        if re.match(r'^\w+$', args.week_column) is None:
+            parser.error("--week-column must be a column name; got '%s'" % args.week_column)
+        try:
+            weeks = [parseWeekSpec(spec) for spec in args.weeks]
+        except ValueError as e:
+            parser.error(str(e))
+        db_pool = MySQLConnectionPool(user=getpass.getuser(),
+                                      passwd=readMySQLPwd(),
+                                      db=args.db,
+                                      minSize=0,
+                                      maxSize=1)
+        # The counts come from the db one week after the other;
+        # the clouds are laid out in parallel:
+        try:
+            tasks = [(args.out_dir,
+                      name,
+                      db_pool.withConnection(keywordCounts, args.week_column, first, last, args.max_words),
+                      args.width,
+                      args.height,
+                      args.font)
+                     for (name, first, last) in weeks]
+        finally:
+            db_pool.close()
+        try:
+            results = runTasks(buildWeek, tasks, args.processes)
+        except ValueError as e:
+            sys.stderr.write('%s\n' % str(e))
+            return 2
+    for (name, numAreas, numBytes) in results:
+        sys.stdout.write('%s: %s areas, %s bytes\n' % (name, numAreas, numBytes))
+    return 0
+
+if __name__ == "__main__":
+
+    sys.exit(main())